@@ -1,14 +1,33 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, request, jsonify, g
-import os, logging, sqlite3, json, requests, uuid
+from flask import Flask, request, jsonify, g, has_request_context
+import os, logging, sqlite3, json, requests, uuid, threading, time
 from datetime import datetime
 
 import os
 import dropbox
 from flask_cors import CORS
-from database_backup import download_db, upload_db  # ✅ Dropbox sync helpers
+from database_backup import download_db  # ✅ Dropbox restore (uploads: dropbox_sync)
+from estack_schema import (
+    ESTACK_COLUMNS, ensure_estack_schema, backfill_estack_columns, ensure_estack_unique_keys,
+    ensure_estack_tokens, estack_tokens_missing, rebuild_estack_tokens,
+    ensure_estack_fts, estack_fts_query,
+    insert_estack_transaction,
+)
+from transaction_parser import format_investment, format_loan
+from investment_pool import investment_pool, claim_investment
+from db_pool import (
+    estack_db, transactions_db, estack_read_db, transactions_read_db,
+    ESTACK_DB_PATH, TRANSACTIONS_DB_PATH,
+)
+from write_queue import StillProcessing, estack_writer, transactions_writer
+from upserts import TRANSACTION_COLUMNS, upsert_transaction, upsert_estack_investment
+from schema_registry import schema
+from callback_journal import callback_journal
+from callback_dedupe import callback_dedupe, dedupe_key
+from dropbox_sync import dropbox_sync
+import changelog
 
 app = Flask(__name__)
 CORS(app)
@@ -17,15 +36,71 @@ CORS(app)
 #  🔹 Dropbox Auto Sync Section
 # ============================================================
 
-# Download the latest database on server startup
-print("⏬ Checking Dropbox for latest estack.db...")
-download_db()
+# STARTUP_RESTORE=background  serve straight away; estack.db is restored from
+#                             Dropbox in a thread and estack-backed routes answer
+#                             503 until it is in place (default)
+#                 blocking    restore before the app finishes importing
+#                 off         use the local estack.db as it is
+# RESTORE_POLICY (see database_backup.py) decides whether a restore downloads.
+STARTUP_RESTORE = os.getenv("STARTUP_RESTORE", "background").lower()
+RESTORE_TIMEOUT = float(os.getenv("STARTUP_RESTORE_TIMEOUT", "600"))  # s a journaled eStack callback waits
+BOOT_STARTED = time.time()
+estack_ready = threading.Event()  # estack.db restored, migrated and warmed
+restore_state = {"mode": STARTUP_RESTORE, "outcome": None, "seconds": None, "error": None}
+
+if STARTUP_RESTORE == "blocking":
+    print("⏬ Checking Dropbox for latest estack.db...")
+    restore_state["outcome"] = download_db(boot_started=BOOT_STARTED)
+    restore_state["seconds"] = round(time.time() - BOOT_STARTED, 3)
+elif STARTUP_RESTORE == "background":
+    # Nothing may open estack.db until the restored file is in place
+    estack_db.hold()
+    estack_read_db.hold()
+
+# ============================================================
+#  🔹 Database connections (see db_pool.py)
+# ============================================================
+READ_METHODS = ("GET", "HEAD")
+
 
-def get_db():
-    """Connect to SQLite database"""
-    db = sqlite3.connect("estack.db", check_same_thread=False)
-    db.row_factory = sqlite3.Row
-    return db
+def _wants_read_only(readonly):
+    # GET handlers only read, so by default they go through the read-only pool
+    if readonly is None:
+        return has_request_context() and request.method in READ_METHODS
+    return readonly
+
+
+def _request_conn(key, pool, read_key, read_pool, readonly):
+    if _wants_read_only(readonly):
+        if read_key not in g:
+            try:
+                g.setdefault(read_key, read_pool.acquire())
+            except sqlite3.OperationalError:
+                # mode=ro cannot create the file: fall back until init has run
+                logger.warning("Read-only %s connection unavailable, using the writer pool", read_pool.name)
+                return _request_conn(key, pool, read_key, read_pool, False)
+        return g.get(read_key)
+    if key not in g:
+        g.setdefault(key, pool.acquire())
+    return g.get(key)
+
+
+def get_db(readonly=None):
+    """
+    estack.db connection for the current request.
+    Pooled and reused across requests; returned to the pool at teardown.
+    GET / HEAD requests get a read-only connection unless readonly=False.
+    """
+    return _request_conn("estack_db", estack_db, "estack_read_db", estack_read_db, readonly)
+
+
+def get_db_sc(readonly=None):
+    """
+    transactions.db connection for the current request.
+    Kept separate from get_db() so a request can never get the wrong database.
+    GET / HEAD requests get a read-only connection unless readonly=False.
+    """
+    return _request_conn("transactions_db", transactions_db, "transactions_read_db", transactions_read_db, readonly)
 
 # -------------------------
 # API CONFIGURATION
@@ -34,7 +109,7 @@ API_MODE = os.getenv("API_MODE", "sandbox")
 SANDBOX_API_TOKEN = os.getenv("SANDBOX_API_TOKEN")
 LIVE_API_TOKEN = os.getenv("LIVE_API_TOKEN")
 
-DATABASE_sc = os.path.join(os.path.dirname(__file__), "transactions.db")
+DATABASE_sc = TRANSACTIONS_DB_PATH
 
 API_TOKEN = LIVE_API_TOKEN if API_MODE == "live" else SANDBOX_API_TOKEN
 PAWAPAY_URL = (
@@ -52,48 +127,79 @@ PAWAPAY_PAYOUT_URL = (
 # -------------------------
 # DATABASE
 # -------------------------
-DATABASE = os.path.join(os.path.dirname(__file__), "transactions.db")
+DATABASE = TRANSACTIONS_DB_PATH
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # JUST ADDED 1___________________________________________
+def init_notifications_table(conn):
+    """Migration 2 (estack.db): notifications written by notify_investor."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            message TEXT,
+            created_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id, created_at)")
+
+
+def store_notification(conn, user_id, message):
+    """Write unit for estack_writer: insert one notification row."""
+    conn.execute("""
+        INSERT INTO notifications (user_id, message, created_at)
+        VALUES (?, ?, ?)
+    """, (user_id, message, datetime.utcnow().isoformat()))
+
+
 def notify_investor(user_id, message):
     """
     Notify investor of investment status change.
     In real systems this could send email, SMS, or push.
     For now, we just log and store in a notifications table.
-    """
-    try:
-        conn = sqlite3.connect(DATABASE)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                message TEXT,
-                created_at TEXT
-            )
-        """)
-        conn.commit()
 
-        cur.execute("""
-            INSERT INTO notifications (user_id, message, created_at)
-            VALUES (?, ?, ?)
-        """, (user_id, message, datetime.utcnow().isoformat()))
-        conn.commit()
-        conn.close()
+    Notifications live in estack.db. The insert is queued on the estack
+    writer without waiting, so this never blocks the caller's response.
+    """
+    def log_failure(future):
+        if future.exception() is not None:
+            logger.error(f"❌ Failed to notify investor {user_id}: {future.exception()}")
 
+    try:
+        estack_writer.submit(store_notification, user_id, message).add_done_callback(log_failure)
         logger.info(f"📢 Notification sent to investor {user_id}: {message}")
     except Exception as e:
         logger.error(f"❌ Failed to notify investor {user_id}: {e}")
 
-def init_db_sc():
+
+def still_processing():
     """
-    Create the transactions and loans tables if missing and safely add any missing columns.
-    Also run a small backfill to populate 'type' and 'user_id' from metadata where possible.
+    Response for a write unit that outlived WRITE_QUEUE_TIMEOUT while
+    running (write_queue.StillProcessing): it may still commit, so this is
+    not a failure and the client must check before retrying.
+    """
+    return jsonify({"status": "PROCESSING",
+                    "message": "Still processing; it may still be applied. Check its status before retrying."}), 202
+
+
+def when_committed(future, follow_up):
+    """Run follow_up(result) once a unit that outlived its request commits (notifications etc.)."""
+    def done(f):
+        if f.cancelled() or f.exception() is not None:
+            logger.error(f"❌ Write that outlived its request failed: {f.exception() if not f.cancelled() else 'cancelled'}")
+        else:
+            follow_up(f.result())
+    future.add_done_callback(done)
+
+def init_db_sc(conn):
+    """
+    Migration 1 (transactions.db): create the wallets, transactions and loans
+    tables if missing and safely add any missing columns. Populating 'type'
+    and 'user_id' from metadata is a separate chunked backfill
+    (backfill_transaction_metadata).
     """
-    conn = sqlite3.connect(DATABASE_sc)
     cur = conn.cursor()
 
     # Create wallets table if not exists
@@ -172,7 +278,11 @@ def init_db_sc():
             expected_return_date TEXT,
             created_at TEXT,
             phone TEXT,
-            metadata TEXT
+            metadata TEXT,
+            approved_by TEXT,
+            approved_at TEXT,
+            updated_at TEXT,
+            disbursed_at TEXT
         )
     """)
     conn.commit()
@@ -190,7 +300,11 @@ def init_db_sc():
         "expected_return_date": "TEXT",
         "created_at": "TEXT",
         "phone": "TEXT",
-        "metadata": "TEXT"
+        "metadata": "TEXT",
+        "approved_by": "TEXT",
+        "approved_at": "TEXT",
+        "updated_at": "TEXT",
+        "disbursed_at": "TEXT"
     }
 
     for col, coltype in loan_needed.items():
@@ -203,123 +317,74 @@ def init_db_sc():
 
     conn.commit()
 
-    # =========================
-    # ✅ BACKFILL TRANSACTIONS
-    # =========================
-    try:
-        cur.execute("SELECT depositId, metadata, type, user_id FROM transactions")
-        rows = cur.fetchall()
-        updates = []
-        for deposit_id, metadata, cur_type, cur_user in rows:
-            new_type = cur_type
-            new_user = cur_user
-            changed = False
-            if metadata:
-                try:
-                    meta_obj = json.loads(metadata)
-                except Exception:
-                    meta_obj = None
-
-                if isinstance(meta_obj, list):
-                    for entry in meta_obj:
-                        if not isinstance(entry, dict):
-                            continue
-                        fn = str(entry.get("fieldName") or "").lower()
-                        fv = entry.get("fieldValue")
-                        if fn == "userid" and fv and not new_user:
-                            new_user = str(fv)
-                            changed = True
-                        if fn == "purpose" and isinstance(fv, str) and fv.lower() == "investment":
-                            if new_type != "investment":
-                                new_type = "investment"
-                                changed = True
-                elif isinstance(meta_obj, dict):
-                    if "userId" in meta_obj and not new_user:
-                        new_user = str(meta_obj.get("userId"))
-                        changed = True
-                    purpose = meta_obj.get("purpose")
-                    if isinstance(purpose, str) and purpose.lower() == "investment":
-                        if new_type != "investment":
-                            new_type = "investment"
-                            changed = True
-
-            if new_type is None:
-                new_type = "payment"
-
-            if changed or (cur_user is None and new_user is not None) or (cur_type is None and new_type):
-                updates.append((new_user, new_type, deposit_id))
-
-        for u, t, dep in updates:
-            cur.execute("UPDATE transactions SET user_id = ?, type = ? WHERE depositId = ?", (u, t, dep))
-        if updates:
-            conn.commit()
-            logger.info("Backfilled %d transactions with user_id/type from metadata.", len(updates))
-    except Exception:
-        logger.exception("Error during migration/backfill pass")
 
-    conn.close()
-
-
-# ✅ Run safely within the Flask app context
-with app.app_context():
-    init_db_sc()
-
-def get_db_sc():
+def metadata_user_and_purpose(meta_obj):
     """
-    Return a DB connection scoped to the Flask request context.
-    Row factory is sqlite3.Row for dict-like rows.
+    (userId, purpose) from PawaPay metadata, which is either a dict or a
+    list of {"fieldName", "fieldValue"} entries. Missing values are None.
     """
-    db = getattr(g, "_database", None)
-    if db is None:
-        db = g._database = sqlite3.connect(DATABASE_sc)
-        db.row_factory = sqlite3.Row
-    return db
-
-# -------------------------
-# LOANS TABLE INIT
-# -------------------------
-def init_loans_table():
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS loans (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        loanId TEXT UNIQUE,
-        user_id TEXT,
-        phone TEXT,                -- 🔹 NEW: borrower's phone number for payouts
-        investment_id TEXT,        -- 🔹 links this loan to an investment
-        amount REAL,
-        interest REAL,
-        status TEXT,               -- PENDING, APPROVED, DISAPPROVED, PAID
-        expected_return_date TEXT,
-        created_at TEXT,
-        approved_by TEXT
-    )
-    """)
-
-    conn.commit()
-    conn.close()
-    
-with app.app_context():
-    init_loans_table()
+    user_id, purpose = None, None
+    if isinstance(meta_obj, list):
+        for entry in meta_obj:
+            if not isinstance(entry, dict):
+                continue
+            fn = str(entry.get("fieldName") or "").lower()
+            fv = entry.get("fieldValue")
+            if fn == "userid" and fv and not user_id:
+                user_id = str(fv)
+            if fn == "purpose" and isinstance(fv, str):
+                purpose = fv.lower()
+    elif isinstance(meta_obj, dict):
+        if "userId" in meta_obj:
+            user_id = str(meta_obj.get("userId"))
+        if isinstance(meta_obj.get("purpose"), str):
+            purpose = meta_obj["purpose"].lower()
+    return user_id, purpose
+
+
+def backfill_transaction_metadata(conn, after, limit):
+    """
+    Backfill chunk: populate 'type' and 'user_id' from metadata for up to
+    `limit` transactions with id > after. Returns (last id, rows seen),
+    or None once every row has been visited (see schema.backfill).
+    """
+    rows = conn.execute(
+        "SELECT id, metadata, type, user_id FROM transactions WHERE id > ? ORDER BY id LIMIT ?",
+        (after, limit)
+    ).fetchall()
+    if not rows:
+        return None
+
+    updates = []
+    for row_id, metadata, cur_type, cur_user in rows:
+        new_type = cur_type
+        new_user = cur_user
+        changed = False
+        if metadata:
+            try:
+                meta_user, purpose = metadata_user_and_purpose(json.loads(metadata))
+            except Exception:
+                meta_user, purpose = None, None
+            if meta_user and not new_user:
+                new_user = meta_user
+                changed = True
+            if purpose == "investment" and new_type != "investment":
+                new_type = "investment"
+                changed = True
 
-def migrate_loans_table():
-    db = get_db_sc()
-    existing_columns = [col["name"] for col in db.execute("PRAGMA table_info(loans)").fetchall()]
+        if new_type is None:
+            new_type = "payment"
 
-    # ✅ Ensure disbursed_at column exists
-    if "disbursed_at" not in existing_columns:
-        db.execute("ALTER TABLE loans ADD COLUMN disbursed_at TEXT")
-        db.commit()
-        print("✅ Added missing column: disbursed_at")
+        if changed or (cur_user is None and new_user is not None) or (cur_type is None and new_type):
+            updates.append((new_user, new_type, row_id))
 
-    db.close()
+    conn.executemany("UPDATE transactions SET user_id = ?, type = ? WHERE id = ?", updates)
+    return rows[-1][0], len(rows)
 
 
-# ✅ run migrations safely once app starts
-with app.app_context():
-    init_db_sc()
-    migrate_loans_table()
+# ✅ Run once per database by schema.init() (see init_db below)
+schema.migration(transactions_db, 1, "wallets, transactions and loans tables", init_db_sc)
+schema.backfill(transactions_db, "transactions_metadata", backfill_transaction_metadata, table="transactions")
 
 
 # -------------------------
@@ -332,13 +397,6 @@ from datetime import datetime
 
 app = Flask(__name__)
 
-DB_PATH = "estack.db"
-
-def get_db():
-    db = sqlite3.connect(DB_PATH)
-    db.row_factory = sqlite3.Row
-    return db
-
 
 # ------------------------
 # 1️⃣ REQUEST A LOAN
@@ -347,6 +405,30 @@ def get_db():
 # ------------------------
 # 1️⃣ REQUEST A LOAN
 # ------------------------
+def request_loan_unit(conn, phone, amount, investment_id):
+    """
+    Write unit: claim a COMPLETED investment (IN_USE) and record a loan
+    against it. Returns (investment_id, loan_id), or None if no investment
+    could be claimed.
+    """
+    cur = conn.cursor()
+    investment = claim_investment(cur, investment_pool, "IN_USE", deposit_id=investment_id, status="COMPLETED")
+    if not investment:
+        return None
+
+    try:
+        # ✅ Generate unique loan ID and name
+        loan_id = str(uuid.uuid4())
+        loan_name = format_loan(amount, phone, investment.deposit_id, loan_id)
+
+        # ✅ Insert new loan record
+        insert_estack_transaction(cur, loan_name, "ACTIVE")
+    except Exception:
+        investment_pool.release(investment)  # the unit is rolled back: still lendable
+        raise
+    return investment.deposit_id, loan_id
+
+
 @app.route("/api/transactions/request", methods=["POST"])
 def request_loan():
     try:
@@ -361,53 +443,24 @@ def request_loan():
         if not phone or not investment_id or not amount:
             return jsonify({"error": "Missing required fields"}), 400
 
-        db = get_db()
-        cur = db.cursor()
-
-        # ✅ Find investment that includes this ID and is COMPLETED
-        cur.execute(
-            """
-            SELECT * FROM estack_transactions 
-            WHERE name_of_transaction LIKE ? 
-            AND status = 'COMPLETED'
-            """,
-            (f"%{investment_id}%",)
-        )
-        investment = cur.fetchone()
-
-        if not investment:
-            db.close()
+        # ✅ Claim a COMPLETED investment, mark it IN_USE and record the loan in one write unit
+        claimed = estack_writer.run(request_loan_unit, phone, amount, investment_id)
+        if not claimed:
             return jsonify({"error": "Investment not found or not completed"}), 404
 
-        print(f"✅ Found matching investment: {investment['name_of_transaction']}")
-
-        # ✅ Generate unique loan ID and name
-        loan_id = str(uuid.uuid4())
-        loan_name = f"LOAN | ZMW{amount} | {phone} | {investment_id} | {loan_id}"
-
-        # ✅ Insert new loan record
-        cur.execute(
-            "INSERT INTO estack_transactions (name_of_transaction, status) VALUES (?, ?)",
-            (loan_name, "ACTIVE")
-        )
-
-        # ✅ Mark investment as IN_USE
-        cur.execute(
-            "UPDATE estack_transactions SET status = ? WHERE name_of_transaction LIKE ?",
-            ("IN_USE", f"%{investment_id}%")
-        )
-
-        db.commit()
-        db.close()
-
+        investment_id, loan_id = claimed
+        print(f"✅ Found matching investment: {investment_id}")
         print(f"💰 Loan {loan_id} created for borrower {phone} using investment {investment_id}")
 
         return jsonify({
             "message": "Loan request recorded successfully",
             "loan_id": loan_id,
+            "investment_id": investment_id,
             "status": "ACTIVE"
         }), 200
 
+    except StillProcessing:
+        return still_processing()
     except Exception as e:
         print("❌ Error in /api/transactions/request:", e)
         return jsonify({"error": str(e)}), 500
@@ -551,169 +604,194 @@ def request_loan():
 #         print("❌ Error fetching loans:", e)
 #         return jsonify({"error": str(e)}), 500
 
+# ------------------------
+# KEYSET PAGINATION HELPERS
+# ------------------------
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def page_args():
+    """
+    Read ?limit=&before=<rowid> for keyset pagination.
+    Returns None when neither is given (legacy clients get the full list),
+    otherwise (limit, before). Raises ValueError on non-integer values.
+    """
+    limit = request.args.get("limit")
+    before = request.args.get("before")
+    if limit is None and before is None:
+        return None
+    limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    before = int(before) if before else None
+    return limit, before
+
+
+def user_rows_page(cur, columns, user_id, page):
+    """
+    Stream estack rows that mention user_id (newest first) straight off
+    the estack_tokens (token, txn_rowid) primary key. With a page, only
+    limit + 1 rows are ever read, however long the history is.
+    Returns (rows, next_cursor).
+    """
+    sql = f"""
+        SELECT k.txn_rowid AS rowid, {columns}
+        FROM estack_tokens k
+        JOIN estack_transactions t ON t.rowid = k.txn_rowid
+        WHERE k.token = ?
+    """
+    params = [user_id]
+    if page is None:
+        return cur.execute(sql + " ORDER BY k.txn_rowid DESC", params).fetchall(), None
+
+    limit, before = page
+    if before is not None:
+        sql += " AND k.txn_rowid < ?"
+        params.append(before)
+    sql += " ORDER BY k.txn_rowid DESC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = []
+    for row in cur.execute(sql, params):
+        if len(rows) == limit:
+            return rows, rows[-1]["rowid"]
+        rows.append(row)
+    return rows, None
+
+
 # ------------------------
 # 2️⃣ GET USER LOANS
 # ------------------------
 @app.route("/api/loans/user/<user_id>", methods=["GET"])
 def get_user_loans(user_id):
     try:
+        try:
+            page = page_args()
+        except ValueError:
+            return jsonify({"error": "limit and before must be integers"}), 400
+
         db = get_db()
         cur = db.cursor()
 
         # Fetch transactions linked to this user (investor or borrower)
-        cur.execute(
-            """
-            SELECT * FROM estack_transactions
-            WHERE name_of_transaction LIKE ?
-            ORDER BY rowid DESC
-            """,
-            (f"%{user_id}%",)
-        )
-        rows = cur.fetchall()
+        rows, next_cursor = user_rows_page(cur, "t.*", user_id, page)
         db.close()
 
         results = []
         for r in rows:
-            name = r["name_of_transaction"]
-            parts = [p.strip() for p in name.split("|")]
-
             # Example:
-            # INVESTMENT | K1000 | user_12 | 0f59ea4f-bc6d | Borrower:260977364437
-            loan_id = parts[3] if len(parts) > 3 else "N/A"
-            amount = parts[1].replace("K", "").strip() if len(parts) > 1 else "N/A"
-            borrower = None
-
-            # Check for borrower info
-            if len(parts) > 4 and "Borrower:" in parts[4]:
-                borrower = parts[4].split(":", 1)[1]
-
+            # ZMW1000 | user_12 | 0f59ea4f-bc6d | Borrower:260977364437
             entry = {
-                "loan_id": loan_id,
-                "amount": amount,
-                "borrower": borrower or "N/A",
+                "loan_id": r["loan_id"] or r["deposit_id"] or "N/A",
+                "amount": r["amount"] if r["amount"] is not None else "N/A",
+                "borrower": r["borrower_phone"] or "N/A",
                 "status": r["status"],
             }
+            if page is not None:
+                entry["cursor"] = r["rowid"]
             results.append(entry)
 
+        if page is not None:
+            return jsonify({"results": results, "next_cursor": next_cursor}), 200
         return jsonify(results), 200
 
     except Exception as e:
         print("❌ Error fetching loans:", e)
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/transactions/request", methods=["POST"])
-def create_loan_request():
-    try:
-        data = request.get_json()
-        print("data: " + str(data))
-        required = ["borrower_phone", "investment_id", "amount"]
-        missing = [f for f in required if f not in data]
-
-        if missing:
-            return jsonify({"error": f"Missing required fields: {', '.join(missing)}"}), 400
-
-        borrower_phone = data["borrower_phone"]
-        investment_id = data["investment_id"]
-        amount = data["amount"]
-
-        conn = get_db()
-        cur = conn.cursor()
-
-        # 🔍 1️⃣ Check if investment exists and is available
-        cur.execute(
-            "SELECT name_of_transaction, status FROM estack_transactions WHERE name_of_transaction LIKE ?",
-            (f"%{investment_id}%",)
-        )
-        investment = cur.fetchone()
-
-        if not investment:
-            conn.close()
-            return jsonify({"error": "Investment not found"}), 404
-
-        if investment["status"] != "AVAILABLE":
-            conn.close()
-            return jsonify({"error": "Investment already loaned or pending"}), 400
-
-        # 🧩 2️⃣ Update record to include borrower details
-        old_name = investment["name_of_transaction"]
-        # Example: "INVESTMENT | K1000 | user_12 | 0f59ea4f-bc6d"
-        new_name = f"{old_name} | Borrower:{borrower_phone}"
-
-        cur.execute(
-            "UPDATE estack_transactions SET name_of_transaction = ?, status = ? WHERE name_of_transaction = ?",
-            (new_name, "REQUESTED", old_name)
-        )
-
-        conn.commit()
-        conn.close()
-
-        print(f"✅ Loan requested: {new_name}")
+# ------------------------
+# 3️⃣ MARK LOAN AS REPAID
+# ------------------------
+MAX_BULK_REPAY = 5000
 
-        return jsonify({
-            "message": "Loan request recorded successfully",
-            "investment_id": investment_id,
-            "status": "REQUESTED"
-        }), 200
 
-    except Exception as e:
-        print("❌ Error in /api/transactions/request:", e)
-        return jsonify({"error": str(e)}), 500
+def settle_loan(cur, loan_id):
+    """
+    Mark one LOAN row REPAID and make its linked investment AVAILABLE.
+    Both rows are found by key (loan_id, then the loan's deposit_id), so
+    exactly two rows are touched. Runs inside the caller's transaction.
+    Returns "REPAID", "ALREADY_REPAID" or "NOT_FOUND".
+    """
+    loan = cur.execute(
+        "SELECT rowid AS rowid, status, deposit_id FROM estack_transactions WHERE loan_id = ? AND kind = 'LOAN'",
+        (loan_id,)
+    ).fetchone()
 
+    if not loan:
+        return "NOT_FOUND"
+    if loan["status"] == "REPAID":
+        return "ALREADY_REPAID"
+
+    # Mark the loan as REPAID
+    cur.execute("UPDATE estack_transactions SET status = 'REPAID' WHERE rowid = ?", (loan["rowid"],))
+
+    # Make the linked investment AVAILABLE again
+    if loan["deposit_id"]:
+        investment = cur.execute(
+            "SELECT rowid AS rowid, amount FROM estack_transactions WHERE deposit_id = ? AND kind = 'INVESTMENT'",
+            (loan["deposit_id"],)
+        ).fetchone()
+        if investment:
+            cur.execute(
+                "UPDATE estack_transactions SET status = 'AVAILABLE' WHERE rowid = ?",
+                (investment["rowid"],)
+            )
+            investment_pool.update(loan["deposit_id"], "AVAILABLE", investment["rowid"], investment["amount"])
+    return "REPAID"
 
 
-# ------------------------
-# 3️⃣ MARK LOAN AS REPAID
-# ------------------------
 @app.route("/api/loans/repay/<loan_id>", methods=["POST"])
 def repay_loan(loan_id):
     try:
-        db = get_db()
-        cur = db.cursor()
-
-        # Find the loan transaction
-        cur.execute(
-            "SELECT name_of_transaction FROM estack_transactions WHERE name_of_transaction LIKE ?",
-            (f"%{loan_id}%",)
-        )
-        loan = cur.fetchone()
+        outcome = estack_writer.run(settle_loan, loan_id)
 
-        if not loan:
-            db.close()
+        if outcome == "NOT_FOUND":
             return jsonify({"error": "Loan not found"}), 404
+        if outcome == "ALREADY_REPAID":
+            return jsonify({"message": "Loan already repaid"}), 200
 
-        # Mark the loan as REPAID
-        cur.execute(
-            "UPDATE estack_transactions SET status = ? WHERE name_of_transaction LIKE ?",
-            ("REPAID", f"%{loan_id}%")
-        )
+        print(f"✅ Loan {loan_id} repaid — investment set to AVAILABLE")
 
-        # Extract user_id from transaction
-        parts = [p.strip() for p in loan["name_of_transaction"].split("|")]
-        user_id = parts[2] if len(parts) > 2 else None
+        return jsonify({"message": "Loan repaid successfully"}), 200
 
-        # Make the user's investment AVAILABLE again
-        if user_id:
-            cur.execute(
-                """
-                UPDATE estack_transactions
-                SET status = ?
-                WHERE name_of_transaction LIKE ?
-                AND name_of_transaction NOT LIKE ?
-                """,
-                ("AVAILABLE", f"%{user_id}%", "%LOAN%")
-            )
+    except StillProcessing:
+        return still_processing()
+    except Exception as e:
+        print("❌ Error in repay_loan:", e)
+        return jsonify({"error": str(e)}), 500
 
-        db.commit()
-        db.close()
 
-        print(f"✅ Loan {loan_id} repaid — investment set to AVAILABLE")
+@app.route("/api/loans/repay/bulk", methods=["POST"])
+def repay_loans_bulk():
+    """
+    Settle many loans in one transaction.
+    Body: {"loan_ids": ["...", ...]}
+    Returns a per-loan result list; unknown ids don't abort the batch.
+    """
+    data = request.get_json(silent=True) or {}
+    loan_ids = data.get("loan_ids")
 
-        return jsonify({"message": "Loan repaid successfully"}), 200
+    if not isinstance(loan_ids, list) or not loan_ids:
+        return jsonify({"error": "loan_ids must be a non-empty list"}), 400
+    if len(loan_ids) > MAX_BULK_REPAY:
+        return jsonify({"error": f"At most {MAX_BULK_REPAY} loan_ids per request"}), 400
+
+    def settle_all(conn):
+        return [{"loan_id": loan_id, "result": settle_loan(conn, str(loan_id))} for loan_id in loan_ids]
 
+    try:
+        # One write unit: the whole list commits or none of it does
+        results = estack_writer.run(settle_all)
+    except StillProcessing:
+        return still_processing()
     except Exception as e:
-        print("❌ Error in repay_loan:", e)
+        print("❌ Error in repay_loans_bulk:", e)
         return jsonify({"error": str(e)}), 500
 
+    repaid = sum(1 for r in results if r["result"] == "REPAID")
+    print(f"✅ Bulk repayment: {repaid}/{len(results)} loans repaid")
+
+    return jsonify({"repaid": repaid, "results": results}), 200
+
 # # ------------------------
 # # 3️⃣ MARK LOAN AS REPAID
 # # ------------------------
@@ -791,7 +869,7 @@ def repay_loan(loan_id):
 # -------------------------
 @app.route("/api/loans/pending", methods=["GET"])
 def pending_loans():
-    db = get_db()
+    db = get_db_sc()
     rows = db.execute("SELECT * FROM loans WHERE status='PENDING' ORDER BY created_at DESC").fetchall()
     results = [dict(row) for row in rows]
     return jsonify(results), 200
@@ -800,55 +878,79 @@ def pending_loans():
 # -------------------------
 # APPROVE LOAN
 # # -------------------------
+def approve_loan_unit(conn, loan_id, admin_id):
+    """
+    Write unit: approve a loan and mark its investment LOANED_OUT.
+    Returns (outcome, loan, investor_user_id); outcome is "APPROVED",
+    "ALREADY_APPROVED" or "NOT_FOUND".
+    """
+    # ✅ Fetch loan by loanId
+    loan = conn.execute("SELECT * FROM loans WHERE loanId = ?", (loan_id,)).fetchone()
+    if not loan:
+        return "NOT_FOUND", None, None
+
+    # ✅ Prevent double approval
+    if loan["status"] and loan["status"].upper() == "APPROVED":
+        return "ALREADY_APPROVED", loan, None
+
+    now = datetime.utcnow().isoformat()
+
+    # ✅ Approve loan
+    conn.execute("""
+        UPDATE loans
+        SET status = 'APPROVED',
+            approved_by = ?,
+            approved_at = ?,
+            updated_at = ?
+        WHERE loanId = ?
+    """, (admin_id, now, now, loan_id))
+
+    # ✅ Update investor’s transaction using investment_id, not user_id
+    investor = None
+    if loan["investment_id"]:
+        conn.execute("""
+            UPDATE transactions
+            SET status = 'LOANED_OUT',
+                updated_at = ?,
+                failureMessage = 'Loan Approved',
+                failureCode = 'LOAN'
+            WHERE depositId = ?
+        """, (now, loan["investment_id"]))
+        txn = conn.execute("SELECT user_id FROM transactions WHERE depositId=?", (loan["investment_id"],)).fetchone()
+        investor = txn["user_id"] if txn else None
+    return "APPROVED", loan, investor
+
+
+def loan_approved(outcome, loan, investor):
+    """After approve_loan_unit has committed: log the investor update and notify the investor."""
+    if outcome != "APPROVED" or not loan["investment_id"]:
+        return
+    logger.info(f"✅ Investor transaction {loan['investment_id']} marked as LOANED_OUT.")
+
+    # ✅ Notify investor
+    if investor:
+        notify_investor(investor, f"Your investment {loan['investment_id']} has been loaned out.")
+
+
 @app.route("/api/loans/approve/<loan_id>", methods=["POST"])
 def approve_loan(loan_id):
     try:
-        db = get_db()
         admin_id = request.json.get("admin_id", "admin_default")
 
-        # ✅ Fetch loan by loanId
-        loan = db.execute("SELECT * FROM loans WHERE loanId = ?", (loan_id,)).fetchone()
-        if not loan:
+        outcome, loan, investor = transactions_writer.run(approve_loan_unit, loan_id, admin_id)
+        if outcome == "NOT_FOUND":
             return jsonify({"error": "Loan not found"}), 404
-
-        # ✅ Prevent double approval
-        if loan["status"] and loan["status"].upper() == "APPROVED":
+        if outcome == "ALREADY_APPROVED":
             return jsonify({"message": "Loan already approved"}), 200
 
-        now = datetime.utcnow().isoformat()
-
-        # ✅ Approve loan
-        db.execute("""
-            UPDATE loans
-            SET status = 'APPROVED',
-                approved_by = ?,
-                approved_at = ?,
-                updated_at = ?
-            WHERE loanId = ?
-        """, (admin_id, now, now, loan_id))
-
-        # ✅ Update investor’s transaction using investment_id, not user_id
-        if loan["investment_id"]:
-            db.execute("""
-                UPDATE transactions
-                SET status = 'LOANED_OUT',
-                    updated_at = ?,
-                    failureMessage = 'Loan Approved',
-                    failureCode = 'LOAN'
-                WHERE depositId = ?
-            """, (now, loan["investment_id"]))
-            logger.info(f"✅ Investor transaction {loan['investment_id']} marked as LOANED_OUT.")
-
-            # ✅ Notify investor
-            txn = db.execute("SELECT user_id FROM transactions WHERE depositId=?", (loan["investment_id"],)).fetchone()
-            if txn and txn["user_id"]:
-                notify_investor(txn["user_id"], f"Your investment {loan['investment_id']} has been loaned out.")
-
-        db.commit()
+        loan_approved(outcome, loan, investor)
         return jsonify({"message": f"Loan {loan_id} approved and linked investor updated"}), 200
 
+    except StillProcessing as e:
+        # The approval (and its notification) still happens once it commits
+        when_committed(e.future, lambda result: loan_approved(*result))
+        return still_processing()
     except Exception as e:
-        db.rollback()
         logger.exception("Error approving loan")
         return jsonify({"error": str(e)}), 500
 
@@ -906,9 +1008,7 @@ def approve_loan(loan_id):
 # -------------------------
 @app.route("/api/loans/disapprove/<loan_id>", methods=["POST"])
 def disapprove_loan(loan_id):
-    db = get_db()
-    db.execute("UPDATE loans SET status='DISAPPROVED' WHERE loanId=?", (loan_id,))
-    db.commit()
+    transactions_writer.run(lambda conn: conn.execute("UPDATE loans SET status='DISAPPROVED' WHERE loanId=?", (loan_id,)))
     return jsonify({"message": "Loan disapproved"}), 200
 
 
@@ -917,16 +1017,29 @@ def disapprove_loan(loan_id):
 # -------------------------
 @app.route("/api/loans/user/<user_id>", methods=["GET"])
 def user_loans(user_id):
-    db = get_db()
+    db = get_db_sc()
     rows = db.execute("SELECT * FROM loans WHERE user_id=? ORDER BY created_at DESC", (user_id,)).fetchall()
     results = [dict(row) for row in rows]
     return jsonify(results), 200
 
+@app.errorhandler(StillProcessing)
+def handle_still_processing(e):
+    return still_processing()
+
+
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, "_database", None)
+    # Hand pooled connections back (uncommitted work is rolled back)
+    db = g.pop("estack_db", None)
     if db is not None:
-        db.close()
+        estack_db.release(db)
+    db_sc = g.pop("transactions_db", None)
+    if db_sc is not None:
+        transactions_db.release(db_sc)
+    for key, pool in (("estack_read_db", estack_read_db), ("transactions_read_db", transactions_read_db)):
+        read_db = g.pop(key, None)
+        if read_db is not None:
+            pool.release(read_db)
 
 
 # -------------------------
@@ -1029,28 +1142,22 @@ def initiate_payment():
         except Exception:
             logger.warning("Non-JSON response from PawaPay for initiate-payment: %s", resp.text)
 
-        db = get_db_sc()
-        db.execute("""
-            INSERT OR REPLACE INTO transactions
-            (depositId,status,amount,currency,phoneNumber,provider,
-             providerTransactionId,failureCode,failureMessage,metadata,received_at,type,user_id)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, (
-            deposit_id,
-            result.get("status", "PENDING"),
-            float(amount),
-            "ZMW",
-            phone,
-            None, None, None, None,
-            json.dumps(payload["metadata"]),
-            datetime.utcnow().isoformat(),
-            "payment",
-            None
-        ))
-        db.commit()
+        # If PawaPay's callback beat us here, keep what it recorded
+        transactions_writer.run(upsert_transaction, {
+            "depositId": deposit_id,
+            "status": result.get("status", "PENDING"),
+            "amount": float(amount),
+            "currency": "ZMW",
+            "phoneNumber": phone,
+            "metadata": json.dumps(payload["metadata"]),
+            "received_at": datetime.utcnow().isoformat(),
+            "type": "payment",
+        }, keep_existing=True)
         logger.info("initiate-payment: inserted depositId=%s status=%s", deposit_id, result.get("status", "PENDING"))
         return jsonify({"depositId": deposit_id, **result}), 200
 
+    except StillProcessing:
+        return still_processing()
     except Exception:
         logger.exception("Payment initiation error")
         return jsonify({"error": "Internal server error"}), 500
@@ -1196,197 +1303,351 @@ def initiate_payment():
 #         print("❌ Unified callback error:", e)
 #         return jsonify({"error": str(e)}), 500
 
-@app.route("/callback/deposit", methods=["POST"])
-def deposit_callback():
+def plan_deposit_callback(data):
+    """
+    Work out what one PawaPay callback (eStack investment or StudyCraft
+    payment/payout) has to do, without doing it.
+    Returns (error, None) where error is (body, http_status), or
+    (None, (writer, write, finish)): write(conn) is the database unit to
+    run on writer, finish(result) does the post-commit work and returns
+    (body, http_status).
+    """
+    # Identify app type: StudyCraft vs eStack
+    metadata = data.get("metadata", {})
+    is_estack = isinstance(metadata, dict) and "userId" in metadata
+    is_studycraft = "payer" in data or "recipient" in data
+
+    # =====================================================
+    # 🔹 Case 1: eStack Application
+    # =====================================================
+    if is_estack:
+        deposit_id = data.get("depositId")
+        status = data.get("status", "PENDING").strip().upper()
+        amount = data.get("depositedAmount", 0)
+        user_id = metadata.get("userId", "unknown")
+
+        if not deposit_id:
+            return ({"error": "Missing depositId"}, 400), None
+
+        name_of_transaction = format_investment("ZMW", amount, user_id, deposit_id)
+
+        def write(conn):
+            return upsert_estack_investment(conn, name_of_transaction, status)
+
+        def finish(stored):
+            rowid, stored_amount, _ = stored
+            print(f"💾 Upserted eStack transaction {deposit_id} → {status}")
+            investment_pool.update(deposit_id, status, rowid, stored_amount)
+            return {"success": True, "source": "eStack", "deposit_id": deposit_id, "status": status}, 200
+
+        return None, (estack_writer, write, finish)
+
+    # =====================================================
+    # 🔹 Case 2: StudyCraft Application
+    # =====================================================
+    elif is_studycraft:
+        deposit_id = data.get("depositId")
+        payout_id = data.get("payoutId")
+
+        if not deposit_id and not payout_id:
+            return ({"error": "Missing depositId/payoutId"}, 400), None
+
+        txn_type = "payment" if deposit_id else "payout"
+        txn_id = deposit_id or payout_id
+        status = data.get("status")
+        amount = data.get("amount")
+        currency = data.get("currency")
+
+        if txn_type == "payment":
+            phone = data.get("payer", {}).get("accountDetails", {}).get("phoneNumber")
+            provider = data.get("payer", {}).get("accountDetails", {}).get("provider")
+        else:
+            phone = data.get("recipient", {}).get("accountDetails", {}).get("phoneNumber")
+            provider = data.get("recipient", {}).get("accountDetails", {}).get("provider")
+
+        provider_txn = data.get("providerTransactionId")
+        failure_code = data.get("failureReason", {}).get("failureCode")
+        failure_message = data.get("failureReason", {}).get("failureMessage")
+
+        user_id, loan_id = None, None
+        metadata_obj = metadata
+        if metadata_obj:
+            if isinstance(metadata_obj, dict):
+                user_id = metadata_obj.get("userId")
+                loan_id = metadata_obj.get("loanId")
+            elif isinstance(metadata_obj, list):
+                for entry in metadata_obj:
+                    if isinstance(entry, dict):
+                        if entry.get("fieldName") == "userId":
+                            user_id = entry.get("fieldValue")
+                        if entry.get("fieldName") == "loanId":
+                            loan_id = entry.get("fieldValue")
+
+        # Investment deposits are typed at write time (this used to be redone by a backfill on every boot)
+        _, purpose = metadata_user_and_purpose(metadata_obj)
+        stored_type = "investment" if txn_type == "payment" and purpose == "investment" else txn_type
+
+        now_iso = datetime.utcnow().isoformat()
+        metadata_str = json.dumps(metadata_obj) if metadata_obj else None
+
+        def write(db):
+            upsert_transaction(db, {
+                "depositId": txn_id,
+                "status": status,
+                "amount": float(amount) if amount else None,
+                "currency": currency,
+                "phoneNumber": phone,
+                "provider": provider,
+                "providerTransactionId": provider_txn,
+                "failureCode": failure_code,
+                "failureMessage": failure_message,
+                "metadata": metadata_str,
+                "received_at": now_iso,
+                "updated_at": now_iso,
+                "type": stored_type,
+                "user_id": user_id,
+            })
+
+            # ✅ Handle loan repayment notification
+            if txn_type == "payout" and loan_id and status in ("COMPLETED", "SUCCESS", "PAYMENT_COMPLETED"):
+                db.execute("UPDATE loans SET status=? WHERE loanId=?", (status, loan_id))
+                loan_row = db.execute("SELECT user_id FROM loans WHERE loanId=?", (loan_id,)).fetchone()
+                return loan_row["user_id"] if loan_row else None
+            return None
+
+        def finish(repaid_user):
+            if repaid_user:
+                notify_investor(repaid_user, f"Loan {loan_id[:8]} has been successfully repaid.")
+            return {"received": True, "source": "StudyCraft"}, 200
+
+        return None, (transactions_writer, write, finish)
+
+    # =====================================================
+    # 🔹 Unknown callback structure
+    # =====================================================
+    else:
+        return ({"error": "Unknown callback format"}, 400), None
+
+
+
+ESTACK_RESTORING = "estack.db is being restored, retry later"
+
+
+def process_deposit_callback(data, estack_wait=0):
+    """
+    Apply one PawaPay callback. Returns (body, http_status). Called by the
+    route in synchronous mode and by the callback journal workers in
+    fast-ack mode. eStack callbacks wait up to `estack_wait` seconds for
+    the startup restore, then get a 503.
+    """
     try:
-        data = request.get_json(force=True)
         print("📩 Full callback data:", data)
+        error, plan = plan_deposit_callback(data)
+        if error:
+            return error
+        writer, write, finish = plan
+        if writer is estack_writer and not estack_ready.wait(estack_wait):
+            return {"error": ESTACK_RESTORING}, 503
+        try:
+            response = finish(writer.run(write))
+        except StillProcessing as e:
+            # Running, so it commits (or fails) on its own: don't have it applied twice
+            when_committed(e.future, finish)
+            response = {"received": True, "processing": True}, 202
+        if writer is estack_writer:
+            dropbox_sync.mark_dirty()  # uploaded in the background, debounced
+        return response
 
-        # Identify app type: StudyCraft vs eStack
-        metadata = data.get("metadata", {})
-        is_estack = isinstance(metadata, dict) and "userId" in metadata
-        is_studycraft = "payer" in data or "recipient" in data
-
-        # =====================================================
-        # 🔹 Case 1: eStack Application
-        # =====================================================
-        if is_estack:
-            deposit_id = data.get("depositId")
-            status = data.get("status", "PENDING").strip().upper()
-            amount = data.get("depositedAmount", 0)
-            user_id = metadata.get("userId", "unknown")
-
-            if not deposit_id:
-                return jsonify({"error": "Missing depositId"}), 400
-
-            name_of_transaction = f"ZMW{amount} | {user_id} | {deposit_id}"
-
-            db = sqlite3.connect("estack.db")
-            db.row_factory = sqlite3.Row
-            cur = db.cursor()
-
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS estack_transactions (
-                    name_of_transaction TEXT NOT NULL,
-                    status TEXT NOT NULL
-                )
-            """)
+    except Exception as e:
+        print("❌ Unified callback error:", e)
+        return {"error": str(e)}, 500
 
-            existing = cur.execute(
-                "SELECT name_of_transaction FROM estack_transactions WHERE name_of_transaction LIKE ?",
-                (f"%{deposit_id}%",)
-            ).fetchone()
 
-            if existing:
-                cur.execute(
-                    "UPDATE estack_transactions SET status = ? WHERE name_of_transaction LIKE ?",
-                    (status, f"%{deposit_id}%")
-                )
-                print(f"🔄 Updated eStack transaction {deposit_id} → {status}")
-            else:
-                cur.execute(
-                    "INSERT INTO estack_transactions (name_of_transaction, status) VALUES (?, ?)",
-                    (name_of_transaction, status)
-                )
-                print(f"💾 Inserted new eStack transaction {deposit_id} → {status}")
 
-            db.commit()
-            db.close()
+# -------------------------
+# FAST-ACK CALLBACK INGESTION
+# -------------------------
+# PawaPay only needs a 200. In fast-ack mode (the default) the callback
+# is validated, appended to the durable callback journal and acknowledged;
+# journal workers apply it in order per depositId / payoutId, off the
+# request path (so a slow Dropbox upload never delays the ack).
+# CALLBACK_FAST_ACK=0 applies callbacks inline as before.
+CALLBACK_FAST_ACK = os.getenv("CALLBACK_FAST_ACK", "1").lower() in ("1", "true", "yes")
+
+
+def callback_key(data):
+    """(journal key, error) for a callback, classified like process_deposit_callback does."""
+    if not isinstance(data, dict):
+        return None, "Unknown callback format"
+    metadata = data.get("metadata", {})
+    if isinstance(metadata, dict) and "userId" in metadata:
+        return (data["depositId"], None) if data.get("depositId") else (None, "Missing depositId")
+    if "payer" in data or "recipient" in data:
+        key = data.get("depositId") or data.get("payoutId")
+        return (key, None) if key else (None, "Missing depositId/payoutId")
+    return None, "Unknown callback format"
+
+
+def apply_journaled_callback(data):
+    # The "queued" ack is not remembered, so a PawaPay retry can be journaled
+    # twice: the second copy finds the first one's response and is skipped.
+    replay_key = dedupe_key(data)
+    if replay_key and callback_dedupe.lookup(replay_key):
+        return
+    # A journaled eStack callback just waits for the startup restore
+    body, code = process_deposit_callback(data, estack_wait=RESTORE_TIMEOUT)
+    if code >= 500:
+        raise RuntimeError(body.get("error", "callback failed"))  # journal retries it
+    if replay_key:
+        callback_dedupe.remember(replay_key, body, code)
 
-            # ✅ Dropbox Sync (optional if using persistence)
-            try:
-                from database_backup import upload_db
-                upload_db()
-            except Exception as sync_err:
-                print("⚠️ Dropbox sync skipped:", sync_err)
-
-            return jsonify({"success": True, "source": "eStack", "deposit_id": deposit_id, "status": status}), 200
-
-        # =====================================================
-        # 🔹 Case 2: StudyCraft Application
-        # =====================================================
-        elif is_studycraft:
-            deposit_id = data.get("depositId")
-            payout_id = data.get("payoutId")
-
-            if not deposit_id and not payout_id:
-                return jsonify({"error": "Missing depositId/payoutId"}), 400
-
-            txn_type = "payment" if deposit_id else "payout"
-            txn_id = deposit_id or payout_id
-            status = data.get("status")
-            amount = data.get("amount")
-            currency = data.get("currency")
-
-            if txn_type == "payment":
-                phone = data.get("payer", {}).get("accountDetails", {}).get("phoneNumber")
-                provider = data.get("payer", {}).get("accountDetails", {}).get("provider")
-            else:
-                phone = data.get("recipient", {}).get("accountDetails", {}).get("phoneNumber")
-                provider = data.get("recipient", {}).get("accountDetails", {}).get("provider")
-
-            provider_txn = data.get("providerTransactionId")
-            failure_code = data.get("failureReason", {}).get("failureCode")
-            failure_message = data.get("failureReason", {}).get("failureMessage")
-
-            user_id, loan_id = None, None
-            metadata_obj = metadata
-            if metadata_obj:
-                if isinstance(metadata_obj, dict):
-                    user_id = metadata_obj.get("userId")
-                    loan_id = metadata_obj.get("loanId")
-                elif isinstance(metadata_obj, list):
-                    for entry in metadata_obj:
-                        if isinstance(entry, dict):
-                            if entry.get("fieldName") == "userId":
-                                user_id = entry.get("fieldValue")
-                            if entry.get("fieldName") == "loanId":
-                                loan_id = entry.get("fieldValue")
-
-            db = get_db_sc()
-            existing = db.execute(
-                "SELECT * FROM transactions WHERE depositId=? OR depositId=?",
-                (deposit_id, payout_id)
-            ).fetchone()
-
-            now_iso = datetime.utcnow().isoformat()
-            metadata_str = json.dumps(metadata_obj) if metadata_obj else None
-
-            if existing:
-                db.execute("""
-                    UPDATE transactions
-                    SET status = COALESCE(?, status),
-                        amount = COALESCE(?, amount),
-                        currency = COALESCE(?, currency),
-                        phoneNumber = COALESCE(?, phoneNumber),
-                        provider = COALESCE(?, provider),
-                        providerTransactionId = COALESCE(?, providerTransactionId),
-                        failureCode = COALESCE(?, failureCode),
-                        failureMessage = COALESCE(?, failureMessage),
-                        metadata = COALESCE(?, metadata),
-                        updated_at = ?,
-                        user_id = COALESCE(?, user_id)
-                    WHERE depositId = ? OR depositId = ?
-                """, (
-                    status,
-                    float(amount) if amount else None,
-                    currency,
-                    phone,
-                    provider,
-                    provider_txn,
-                    failure_code,
-                    failure_message,
-                    metadata_str,
-                    now_iso,
-                    user_id,
-                    deposit_id,
-                    payout_id
-                ))
-            else:
-                db.execute("""
-                    INSERT INTO transactions
-                    (depositId, status, amount, currency, phoneNumber, provider, providerTransactionId,
-                     failureCode, failureMessage, metadata, received_at, updated_at, type, user_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    txn_id,
-                    status,
-                    float(amount) if amount else None,
-                    currency,
-                    phone,
-                    provider,
-                    provider_txn,
-                    failure_code,
-                    failure_message,
-                    metadata_str,
-                    now_iso,
-                    now_iso,
-                    txn_type,
-                    user_id
-                ))
 
-            # ✅ Handle loan repayment notification
-            if txn_type == "payout" and loan_id and status in ("COMPLETED", "SUCCESS", "PAYMENT_COMPLETED"):
-                db.execute("UPDATE loans SET status=? WHERE loanId=?", (status, loan_id))
-                loan_row = db.execute("SELECT user_id FROM loans WHERE loanId=?", (loan_id,)).fetchone()
-                if loan_row and loan_row["user_id"]:
-                    notify_investor(
-                        loan_row["user_id"],
-                        f"Loan {loan_id[:8]} has been successfully repaid."
-                    )
-
-            db.commit()
-            return jsonify({"received": True, "source": "StudyCraft"}), 200
-
-        # =====================================================
-        # 🔹 Unknown callback structure
-        # =====================================================
+@app.route("/callback/deposit", methods=["POST"])
+def deposit_callback():
+    data = request.get_json(force=True, silent=True)
+    if data is None:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    # PawaPay retry of a delivery we already handled: answer as we did then
+    replay_key = dedupe_key(data)
+    if replay_key:
+        replay = callback_dedupe.lookup(replay_key)
+        if replay:
+            return jsonify(replay[0]), replay[1]
+
+    if not CALLBACK_FAST_ACK:
+        body, code = process_deposit_callback(data)
+    else:
+        key, error = callback_key(data)
+        if error:
+            return jsonify({"error": error}), 400
+        try:
+            seq = callback_journal.append(key, data)
+        except Exception as e:
+            # Not journaled: make PawaPay retry rather than lose the callback
+            logger.exception("Could not journal callback %s", key)
+            return jsonify({"error": str(e)}), 503
+        # Not remembered: the row may still end up FAILED, and PawaPay's retry
+        # must then be journaled again (apply_journaled_callback remembers it)
+        return jsonify({"received": True, "queued": True, "seq": seq}), 200
+
+    if replay_key:
+        callback_dedupe.remember(replay_key, body, code)
+    return jsonify(body), code
+
+
+# -------------------------
+# BATCH CALLBACK REPLAY
+# -------------------------
+MAX_CALLBACK_BATCH = 5000
+
+
+def apply_callback_batch(items):
+    """
+    Apply many callbacks with one transaction per database. Each item runs
+    in its own savepoint, so a bad item is rolled back and reported without
+    failing the rest. Exact replays are answered from the dedupe cache.
+    Returns one result dict per item, in order.
+    """
+    results = [None] * len(items)
+    groups = {}  # writer -> [(index, write, finish, replay_key)]
+
+    for i, data in enumerate(items):
+        replay_key = dedupe_key(data)
+        replay = callback_dedupe.lookup(replay_key) if replay_key else None
+        if replay:
+            results[i] = {"status_code": replay[1], "replayed": True, **replay[0]}
+            continue
+        try:
+            error, plan = plan_deposit_callback(data) if isinstance(data, dict) else (
+                ({"error": "Unknown callback format"}, 400), None)
+        except Exception as e:
+            error, plan = ({"error": str(e)}, 500), None
+        if error:
+            results[i] = {"status_code": error[1], **error[0]}
+            continue
+        writer, write, finish = plan
+        if writer is estack_writer and not estack_ready.is_set():
+            results[i] = {"status_code": 503, "error": ESTACK_RESTORING}
+            continue
+        groups.setdefault(writer, []).append((i, write, finish, replay_key))
+
+    def write_all(conn, group):
+        outcomes = []
+        for _, write, _, _ in group:
+            conn.execute("SAVEPOINT item")
+            try:
+                outcomes.append((True, write(conn)))
+                conn.execute("RELEASE item")
+            except Exception as e:
+                conn.execute("ROLLBACK TO item")
+                conn.execute("RELEASE item")
+                outcomes.append((False, str(e)))
+        return outcomes
+
+    def finish_group(group, outcomes):
+        finished = []
+        for (i, _, finish, replay_key), (ok, value) in zip(group, outcomes):
+            if not ok:
+                finished.append((i, {"status_code": 500, "error": value}))
+                continue
+            body, code = finish(value)
+            if replay_key:
+                callback_dedupe.remember(replay_key, body, code)
+            finished.append((i, {"status_code": code, **body}))
+        return finished
+
+    for writer, group in groups.items():
+        try:
+            outcomes = writer.run(write_all, group)
+        except StillProcessing as e:
+            # Already running: it may still commit, so these must not be retried yet
+            when_committed(e.future, lambda outcomes, group=group: finish_group(group, outcomes))
+            finished = [(i, {"status_code": 202, "received": True, "processing": True}) for i, *_ in group]
+        except Exception as e:
+            # the transaction failed or never started: nothing in this group was written
+            finished = [(i, {"status_code": 500, "error": str(e)}) for i, *_ in group]
         else:
-            return jsonify({"error": "Unknown callback format"}), 400
+            finished = finish_group(group, outcomes)
+        for i, result in finished:
+            results[i] = result
 
-    except Exception as e:
-        print("❌ Unified callback error:", e)
-        return jsonify({"error": str(e)}), 500
+    if estack_writer in groups:
+        dropbox_sync.mark_dirty()
+    return results
+
+
+@app.route("/callback/deposit/batch", methods=["POST"])
+def deposit_callback_batch():
+    """
+    Replay many callbacks (eStack and StudyCraft shapes may be mixed).
+    Body: [callback, ...] or {"callbacks": [callback, ...]}
+    Always applied synchronously; returns a per-item result list.
+    """
+    data = request.get_json(force=True, silent=True)
+    items = data.get("callbacks") if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Body must be a non-empty list of callbacks"}), 400
+    if len(items) > MAX_CALLBACK_BATCH:
+        return jsonify({"error": f"At most {MAX_CALLBACK_BATCH} callbacks per request"}), 400
+
+    results = apply_callback_batch(items)
+    applied = sum(1 for r in results if r["status_code"] == 200)
+    logger.info("Callback batch: %d/%d applied", applied, len(results))
+    return jsonify({"applied": applied, "results": results}), 200
+
+
+@app.route("/debug/callbacks", methods=["GET"])
+def debug_callbacks():
+    """Journal backlog and de-duplication hit/miss counters."""
+    return jsonify({"journal": callback_journal.stats(), "dedupe": callback_dedupe.stats()}), 200
+
+
+@app.route("/debug/sync", methods=["GET"])
+def debug_sync():
+    """Background Dropbox sync: last sync time, current lag and upload / coalescing counters."""
+    return jsonify(dropbox_sync.stats()), 200
 
 # -------------------------
 # DEPOSIT STATUS / TRANSACTION LOOKUP
@@ -1603,144 +1864,146 @@ def debug_transactions():
 # -------------------------
 
 #TEST 4
-@app.route("/api/loans/disburse/<loan_id>", methods=["POST"])
-def disburse_loan(loan_id):
-    try:
-        db = get_db_sc()  # ✅ Get the database connection
-        data = request.get_json() or {}
-        logger.info(f"Disbursing loan {loan_id} with data: {data}")
+def disburse_loan_unit(conn, loan_id):
+    """
+    Write unit: credit the borrower's wallet, mark the loan disbursed,
+    record the disbursement and link one ACTIVE investment to the loan,
+    all in one transaction (this used to be three separate commits).
+    Returns None if the loan doesn't exist, else a dict for the response
+    plus the investor to notify.
+    """
+    now = datetime.utcnow().isoformat()
 
-        # ✅ Fetch loan details (fixed column name)
-        loan = db.execute("SELECT * FROM loans WHERE loanId = ?", (loan_id,)).fetchone()
-        if not loan:
-            return jsonify({"error": "Loan not found"}), 404
+    # ✅ Fetch loan details (fixed column name)
+    loan = conn.execute("SELECT * FROM loans WHERE loanId = ?", (loan_id,)).fetchone()
+    if not loan:
+        return None
+
+    borrower_id = loan["user_id"]
+    amount = float(loan["amount"])
 
-        # ✅ Ensure loan is approved before disbursement
-        # if loan["status"] != "approved":
-        #     return jsonify({"error": "Loan is not approved for disbursement"}), 400
+    # ✅ Fetch borrower wallet
+    borrower_wallet = conn.execute(
+        "SELECT * FROM wallets WHERE user_id = ?", (borrower_id,)
+    ).fetchone()
 
-        borrower_id = loan["user_id"]
-        amount = float(loan["amount"])
+    if not borrower_wallet:
+        conn.execute("""
+            INSERT INTO wallets (user_id, balance, created_at, updated_at)
+            VALUES (?, 0, ?, ?)
+        """, (borrower_id, now, now))
+        logger.info(f"✅ Created new wallet for borrower {borrower_id}")
 
-        # ✅ Fetch borrower wallet
-        borrower_wallet = db.execute(
+        borrower_wallet = conn.execute(
             "SELECT * FROM wallets WHERE user_id = ?", (borrower_id,)
         ).fetchone()
-        
-        if not borrower_wallet:
-            db.execute("""
-                INSERT INTO wallets (user_id, balance, created_at, updated_at)
-                VALUES (?, 0, ?, ?)
-            """, (borrower_id, datetime.utcnow().isoformat(), datetime.utcnow().isoformat()))
-            db.commit()
-            logger.info(f"✅ Created new wallet for borrower {borrower_id}")
-        
-            borrower_wallet = db.execute(
-                "SELECT * FROM wallets WHERE user_id = ?", (borrower_id,)
-            ).fetchone()
 
-        borrower_balance = float(borrower_wallet["balance"])
+    # ✅ Credit borrower wallet
+    new_balance = float(borrower_wallet["balance"]) + amount
+    conn.execute(
+        "UPDATE wallets SET balance = ?, updated_at = ? WHERE user_id = ?",
+        (new_balance, now, borrower_id)
+    )
 
-        # ✅ Credit borrower wallet
-        new_balance = borrower_balance + amount
-        db.execute(
-            "UPDATE wallets SET balance = ?, updated_at = ? WHERE user_id = ?",
-            (new_balance, datetime.utcnow().isoformat(), borrower_id)
-        )
+    # ✅ Mark loan as disbursed (fixed column name)
+    conn.execute(
+        "UPDATE loans SET status = 'disbursed', disbursed_at = ? WHERE loanId = ?",
+        (now, loan_id)
+    )
 
-        # ✅ Mark loan as disbursed (fixed column name)
-        db.execute(
-            "UPDATE loans SET status = 'disbursed', disbursed_at = ? WHERE loanId = ?",
-            (datetime.utcnow().isoformat(), loan_id)
-        )
+    # ✅ Record the disbursement transaction
+    conn.execute("""
+        INSERT INTO transactions (user_id, amount, type, status, reference, created_at, updated_at)
+        VALUES (?, ?, 'loan_disbursement', 'SUCCESS', ?, ?, ?)
+    """, (borrower_id, amount, loan_id, now, now))
 
-        # ✅ Record the disbursement transaction
-        db.execute("""
-            INSERT INTO transactions (user_id, amount, type, status, reference, created_at, updated_at)
-            VALUES (?, ?, 'loan_disbursement', 'SUCCESS', ?, ?, ?)
-        """, (
-            borrower_id, amount, loan_id,
-            datetime.utcnow().isoformat(),
-            datetime.utcnow().isoformat()
-        ))
+    result = {"borrower_id": borrower_id, "amount": amount, "new_balance": new_balance,
+              "investment_id": None, "investor": None}
 
-        db.commit()
+    # ✅ Link this loan to one available investment. A failure here must
+    # not undo the disbursement, so it gets its own savepoint.
+    conn.execute("SAVEPOINT link_investment")
+    try:
+        investment_row = conn.execute("""
+            SELECT reference FROM transactions
+            WHERE type = 'investment' AND status = 'ACTIVE'
+            ORDER BY created_at ASC LIMIT 1
+        """).fetchone()
 
-        # ✅ Link this loan to one available investment
-        try:
-            # investment_row = db.execute("""
-            #     SELECT depositId FROM transactions
-            #     WHERE type = 'investment' AND status = 'ACTIVE'
-            #     ORDER BY received_at ASC LIMIT 1
-            # """).fetchone()
-            investment_row = db.execute("""
-                SELECT reference FROM transactions
-                WHERE type = 'investment' AND status = 'ACTIVE'
-                ORDER BY created_at ASC LIMIT 1
-            """).fetchone()
+        if investment_row:
+            investment_id = investment_row["reference"]
 
+            # ✅ Mark that single investment as LOANED_OUT
+            conn.execute("""
+                UPDATE transactions
+                SET status = 'LOANED_OUT', updated_at = ?
+                WHERE reference = ?
+            """, (now, investment_id))
+
+            investor_row = conn.execute("""
+                SELECT user_id FROM transactions
+                WHERE reference = ? AND type = 'investment'
+            """, (investment_id,)).fetchone()
+
+            # ✅ Also mark investor's transaction as DISBURSED
+            if loan["investment_id"]:
+                conn.execute("""
+                    UPDATE transactions
+                    SET status = 'DISBURSED', updated_at = ?
+                    WHERE depositId = ?
+                """, (now, loan["investment_id"]))
+                logger.info(f"✅ Investor transaction {loan['investment_id']} marked as DISBURSED.")
+
+            result["investment_id"] = investment_id
+            result["investor"] = investor_row["user_id"] if investor_row else None
+        conn.execute("RELEASE link_investment")
+    except Exception as e:
+        conn.execute("ROLLBACK TO link_investment")
+        conn.execute("RELEASE link_investment")
+        logger.error(f"Error linking investment to loan {loan_id}: {e}")
 
-            if investment_row:
-                # investment_id = investment_row["depositId"]
-                investment_id = investment_row["reference"]
+    return result
 
 
-                # ✅ Mark that single investment as LOANED_OUT
-                db.execute("""
-                    UPDATE transactions
-                    SET status = 'LOANED_OUT', updated_at = ?
-                    WHERE reference = ?
-
-                    # UPDATE transactions
-                    # SET status = 'LOANED_OUT', investment_id = ?, updated_at = ?
-                    # WHERE depositId = ?
-                """, (loan_id, datetime.utcnow().isoformat(), investment_id))
-                db.commit()
-
-                # ✅ Notify the investor
-                investor_row = db.execute("""
-                    SELECT user_id FROM transactions
-                    WHERE reference = ? AND type = 'investment'
-                    # SELECT user_id FROM transactions
-                    # WHERE depositId = ? AND type = 'investment'
-                """, (investment_id,)).fetchone()
-                # investment_row = db.execute("""
-                #     SELECT reference FROM transactions
-                #     WHERE type = 'investment' AND status = 'ACTIVE'
-                #     ORDER BY created_at ASC LIMIT 1
-                # """).fetchone()
-
-                # ✅ Also mark investor's transaction as DISBURSED
-                if loan["investment_id"]:
-                    db.execute("""
-                        UPDATE transactions
-                        SET status = 'DISBURSED', updated_at = ?
-                        WHERE depositId = ?
-                    """, (datetime.utcnow().isoformat(), loan["investment_id"]))
-                    logger.info(f"✅ Investor transaction {loan['investment_id']} marked as DISBURSED.")
-
-
-
-                if investor_row and investor_row["user_id"]:
-                    notify_investor(
-                        investor_row["user_id"],
-                        f"Your investment {investment_id[:8]} has been loaned out to borrower {loan_id[:8]}."
-                    )
-
-                logger.info(f"Investment {investment_id} linked to loan {loan_id}")
-            else:
-                logger.warning("No available active investment found to link with this loan.")
+@app.route("/api/loans/disburse/<loan_id>", methods=["POST"])
+def disburse_loan(loan_id):
+    try:
+        data = request.get_json() or {}
+        logger.info(f"Disbursing loan {loan_id} with data: {data}")
 
-        except Exception as e:
-            logger.error(f"Error linking investment to loan {loan_id}: {e}")
+        result = transactions_writer.run(disburse_loan_unit, loan_id)
+        if result is None:
+            return jsonify({"error": "Loan not found"}), 404
+
+        investment_id = result["investment_id"]
+        if investment_id:
+            # ✅ Notify the investor
+            if result["investor"]:
+                notify_investor(
+                    result["investor"],
+                    f"Your investment {investment_id[:8]} has been loaned out to borrower {loan_id[:8]}."
+                )
+            logger.info(f"Investment {investment_id} linked to loan {loan_id}")
+        else:
+            logger.warning("No available active investment found to link with this loan.")
 
         return jsonify({
             "message": f"Loan {loan_id} successfully disbursed",
-            "borrower_id": borrower_id,
-            "amount": amount,
-            "new_balance": new_balance
+            "borrower_id": result["borrower_id"],
+            "amount": result["amount"],
+            "new_balance": result["new_balance"]
         }), 200
 
+    except StillProcessing as e:
+        # The wallet may still be credited: a retry now would pay out twice
+        def disbursed(result):
+            if result and result["investor"]:
+                notify_investor(
+                    result["investor"],
+                    f"Your investment {result['investment_id'][:8]} has been loaned out to borrower {loan_id[:8]}."
+                )
+        when_committed(e.future, disbursed)
+        return still_processing()
     except Exception as e:
         logger.error(f"Error disbursing loan {loan_id}: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1751,23 +2014,26 @@ def disburse_loan(loan_id):
 @app.route("/api/loans/reject/<loan_id>", methods=["POST"])
 def reject_loan(loan_id):
     admin_id = request.json.get("admin_id", "admin_default")
-    db = get_db_sc()
-    loan = db.execute("SELECT * FROM loans WHERE loanId=?", (loan_id,)).fetchone()
-    if not loan:
-        return jsonify({"error": "Loan not found"}), 404
-    if loan["status"] != "PENDING":
-        return jsonify({"error": f"Loan already {loan['status']}"}), 400
 
-    db.execute("UPDATE loans SET status='REJECTED', approved_by=? WHERE loanId=?", (admin_id, loan_id))
-    db.commit()
+    def reject(conn):
+        # check and update in the same write unit, so two admins can't both act on it
+        loan = conn.execute("SELECT status FROM loans WHERE loanId=?", (loan_id,)).fetchone()
+        if loan and loan["status"] == "PENDING":
+            conn.execute("UPDATE loans SET status='REJECTED', approved_by=? WHERE loanId=?", (admin_id, loan_id))
+        return loan["status"] if loan else None
+
+    status = transactions_writer.run(reject)
+    if status is None:
+        return jsonify({"error": "Loan not found"}), 404
+    if status != "PENDING":
+        return jsonify({"error": f"Loan already {status}"}), 400
 
     return jsonify({"loanId": loan_id, "status": "REJECTED"}), 200
 
 # OPTIONAL CODE CHECK NOTIFICATION 
 @app.route("/api/notifications/<user_id>", methods=["GET"])
 def get_notifications(user_id):
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("SELECT * FROM notifications WHERE user_id=? ORDER BY created_at DESC", (user_id,))
     rows = cur.fetchall()
@@ -1779,9 +2045,6 @@ def get_notifications(user_id):
 # -------------------------
 
 if __name__ == "__main__":
-    with app.app_context():
-        init_db()
-        init_db_sc()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
 
@@ -1824,46 +2087,137 @@ if __name__ == "__main__":
 # =========================
 # ✅ DATABASE CONFIG
 # =========================
-DATABASE = os.path.join(os.path.dirname(__file__), "estack.db")
+DATABASE = ESTACK_DB_PATH
 
-def init_db():
+def init_db(conn):
     """
-    Create the estack_transactions table if missing.
-    Stores combined transaction info and status only.
+    Migration 1 (estack.db): create the estack_transactions table if missing.
+    Stores the transaction string, its status and the structured
+    columns parsed from it (see estack_schema).
     """
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-
-    # ✅ Create the single table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS estack_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name_of_transaction TEXT NOT NULL,  -- e.g. "K1000 | user_123 | DEP4567"
-            status TEXT NOT NULL,               -- e.g. "invested", "loaned_out", "repaid"
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    conn.commit()
-    conn.close()
+    # ✅ Create the table, add structured columns + indexes, then backfill them
+    ensure_estack_schema(conn)
+    backfill_estack_columns(conn)
+    ensure_estack_unique_keys(conn)  # one INVESTMENT row per deposit_id (upsert key)
+
+    # ✅ Token index (+ triggers); populate it once for databases that predate it
+    ensure_estack_tokens(conn)
+    if estack_tokens_missing(conn):
+        rebuild_estack_tokens(conn)
+
+    # ✅ FTS5 mirror for /api/estack/search (skipped if SQLite lacks FTS5)
+    ensure_estack_fts(conn)
     print("✅ estack.db initialized with estack_transactions table.")
 
 
-# ✅ Initialize database once Flask app starts
-with app.app_context():
-    init_db()
+schema.migration(estack_db, 1, "estack_transactions, structured columns, tokens and FTS", init_db)
+schema.migration(estack_db, 2, "notifications table", init_notifications_table)
+schema.migration(estack_db, 3, "row change log for Dropbox change shipping", changelog.install_triggers)
+schema.migration(estack_db, 4, "token triggers that accept control characters", ensure_estack_tokens)
+schema.migration(callback_journal.pool, 1, "callback_journal table", callback_journal.create_tables)
+schema.migration(callback_journal.pool, 2, "callback_dedupe table", callback_dedupe.create_tables)
+schema.migration(callback_journal.pool, 3, "callback_journal claim owner and lease", callback_journal.add_claim_columns)
+
+# What the handlers rely on; checked once every migration has run
+schema.expect(transactions_db, "transactions", TRANSACTION_COLUMNS)
+schema.expect(transactions_db, "loans", ("loanId", "investment_id", "status", "approved_by", "approved_at",
+                                         "updated_at", "disbursed_at"))
+schema.expect(transactions_db, "wallets")
+schema.expect(estack_db, "estack_transactions", ("name_of_transaction", "status", *ESTACK_COLUMNS),
+              ("idx_estack_investment_deposit",))
+schema.expect(estack_db, "notifications", ("user_id", "message", "created_at"))
+schema.expect(estack_db, "estack_changelog", ("seq", "tbl", "op", "row_id", "data"))
+schema.expect(callback_journal.pool, "callback_journal", ("key", "payload", "status", "owner", "lease_until"))
+schema.expect(callback_journal.pool, "callback_dedupe", ("dedupe_key", "response"))
+
+
+def start_estack():
+    """
+    Restore estack.db (background mode), migrate it, warm the investment
+    pool, then let everything else open it. Runs in its own thread in
+    background mode, inline otherwise.
+    """
+    try:
+        if STARTUP_RESTORE == "background":
+            estack_db.hold()  # this thread now owns the hold
+            estack_read_db.hold()
+            print("⏬ Checking Dropbox for latest estack.db (background)...")
+            restore_state["outcome"] = download_db(boot_started=BOOT_STARTED)
+
+        if not schema.init():
+            raise RuntimeError("estack.db schema check failed")
+        # ✅ Warm the in-memory pool of lendable investments
+        with estack_db.connection() as conn:
+            investment_pool.warm(conn)
+    except Exception as e:
+        restore_state["error"] = str(e)
+        logger.exception("estack.db startup failed; estack routes stay unavailable")
+        return
+    finally:
+        restore_state["seconds"] = round(time.time() - BOOT_STARTED, 3)
+
+    estack_db.resume()
+    estack_read_db.resume()
+    estack_ready.set()
+    logger.info("estack.db ready after %.2fs (restore: %s)", restore_state["seconds"], restore_state["outcome"])
 
 
-def get_db():
+# ✅ Create and verify every table once, before the first request
+with app.app_context():
+    schema.init(exclude=[estack_db])
+    if STARTUP_RESTORE == "background":
+        threading.Thread(target=start_estack, name="estack-startup", daemon=True).start()
+    else:
+        start_estack()
+
+    # Replays anything journaled but not yet applied before the last shutdown
+    callback_journal.start(apply=apply_journaled_callback)
+
+
+# Routes that touch estack.db: 503 until start_estack() has finished
+ESTACK_ENDPOINTS = {
+    "request_loan", "get_user_loans", "repay_loan", "repay_loans_bulk",
+    "get_notifications", "initiate_investment", "get_user_investments", "get_investment_status",
+    "search_estack_transactions", "batch_status",
+}
+READINESS_EXEMPT = {"readiness", "static"}
+
+
+@app.before_request
+def require_ready():
+    # Handlers carry no DDL, so nothing can be served until its database checks out
+    if request.endpoint in READINESS_EXEMPT:
+        return None
+    if not schema.is_ready(transactions_db, callback_journal.pool):
+        return jsonify({"error": "Service unavailable: database schema not ready", **schema.status()}), 503
+    if request.endpoint in ESTACK_ENDPOINTS and not estack_ready.is_set():
+        return jsonify({"error": ESTACK_RESTORING, "restore": restore_state}), 503, {"Retry-After": "5"}
+    return None
+
+
+@app.route("/ready", methods=["GET"])
+def readiness():
     """
-    Return a DB connection scoped to the Flask request context.
-    Row factory is sqlite3.Row for dict-like access.
+    Readiness probe: 200 once every database (estack.db included) is
+    migrated and the startup restore is done, 503 before.
     """
-    db = getattr(g, "_database", None)
-    if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
-    return db
+    core = schema.is_ready(transactions_db, callback_journal.pool)
+    ready = core and estack_ready.is_set()
+    return jsonify({
+        "ready": ready,
+        "core": core,
+        "estack": estack_ready.is_set(),
+        "restore": restore_state,
+        "schema": schema.status(),
+    }), 200 if ready else 503
+
+
+@app.before_request
+def ensure_callback_workers():
+    # gunicorn forks after import: each worker starts its own journal threads
+    callback_journal.start()
+
+
     
 # # -------------------------
 # # REQUEST A LOAN
@@ -2239,15 +2593,13 @@ def initiate_investment():
 
         # Create readable name for transaction
         # e.g. "K500 | user_001 | DEP12345"
-        name_of_transaction = f"{currency}{amount} | {user_id} | {deposit_id}"
+        name_of_transaction = format_investment(currency, amount, user_id, deposit_id)
 
-        # Save to estack.db
-        db = get_db()
-        db.execute("""
-            INSERT INTO estack_transactions (name_of_transaction, status)
-            VALUES (?, ?)
-        """, (name_of_transaction, status))
-        db.commit()
+        # Save to estack.db (if the callback got there first, its status stands)
+        rowid, stored_amount, status = estack_writer.run(
+            upsert_estack_investment, name_of_transaction, status, keep_existing=True
+        )
+        investment_pool.update(deposit_id, status, rowid, stored_amount)
 
         logger.info("💰 Investment initiated: %s (user_id=%s, status=%s)",
                     name_of_transaction, user_id, status)
@@ -2260,6 +2612,9 @@ def initiate_investment():
             "status": status
         }), 200
 
+    except StillProcessing as e:
+        when_committed(e.future, lambda stored: investment_pool.update(deposit_id, stored[2], stored[0], stored[1]))
+        return still_processing()
     except Exception as e:
         logger.exception("Investment initiation error")
         return jsonify({"error": str(e)}), 500
@@ -2267,16 +2622,23 @@ def initiate_investment():
 @app.route("/api/investments/user/<user_id>", methods=["GET"])
 def get_user_investments(user_id):
     try:
+        try:
+            page = page_args()
+        except ValueError:
+            return jsonify({"error": "limit and before must be integers"}), 400
+
         db = get_db()
-        rows = db.execute("""
-            SELECT name_of_transaction, status
-            FROM estack_transactions
-            WHERE name_of_transaction LIKE ?
-            ORDER BY rowid DESC
-        """, (f"%{user_id}%",)).fetchall()
+        rows, next_cursor = user_rows_page(db.cursor(), "t.name_of_transaction, t.status", user_id, page)
 
-        results = [{"name_of_transaction": r["name_of_transaction"], "status": r["status"]} for r in rows]
-        return jsonify(results), 200
+        if page is None:
+            results = [{"name_of_transaction": r["name_of_transaction"], "status": r["status"]} for r in rows]
+            return jsonify(results), 200
+
+        results = [
+            {"name_of_transaction": r["name_of_transaction"], "status": r["status"], "cursor": r["rowid"]}
+            for r in rows
+        ]
+        return jsonify({"results": results, "next_cursor": next_cursor}), 200
 
     except Exception as e:
         logger.exception("Error fetching user investments")
@@ -2285,12 +2647,14 @@ def get_user_investments(user_id):
 @app.route("/api/investments/status/<deposit_id>", methods=["GET"])
 def get_investment_status(deposit_id):
     try:
-        db = sqlite3.connect("estack.db")
-        db.row_factory = sqlite3.Row
+        db = get_db()
         cur = db.cursor()
 
         # ✅ Match the same table name
-        cur.execute("SELECT status FROM estack_transactions WHERE name_of_transaction LIKE ?", (f"%{deposit_id}%",))
+        cur.execute(
+            "SELECT status FROM estack_transactions WHERE deposit_id = ? AND kind = 'INVESTMENT'",
+            (deposit_id,)
+        )
         row = cur.fetchone()
         db.close()
 
@@ -2303,6 +2667,96 @@ def get_investment_status(deposit_id):
         print("Error in get_investment_status:", e)
         return jsonify({"error": str(e)}), 500
 
+
+# -------------------------
+# SUPPORT SEARCH (FTS5)
+# -------------------------
+@app.route("/api/estack/search", methods=["GET"])
+def search_estack_transactions():
+    """
+    Token / prefix search over eStack transactions.
+    ?q=user_12           exact token
+    ?q=26097*            prefix (or pass prefix=1 to make every term a prefix)
+    ?q=0f59ea4f-bc6d     (part of) a deposit / loan uuid
+    Terms are ANDed. Newest rows first.
+    """
+    q = request.args.get("q", "")
+    prefix = request.args.get("prefix", "0").lower() in ("1", "true", "yes")
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 200)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    match = estack_fts_query(q, prefix=prefix)
+    if not match:
+        return jsonify({"error": "Missing search query"}), 400
+
+    try:
+        db = get_db()
+        rows = db.execute("""
+            SELECT t.rowid AS rowid, t.name_of_transaction, t.status, t.kind,
+                   t.user_id, t.deposit_id, t.loan_id, t.borrower_phone
+            FROM estack_fts f
+            JOIN estack_transactions t ON t.rowid = f.rowid
+            WHERE estack_fts MATCH ?
+            ORDER BY f.rowid DESC
+            LIMIT ?
+        """, (match, limit)).fetchall()
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e):
+            return jsonify({"error": "Search index not available"}), 503
+        logger.exception("eStack search failed")
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"query": q, "count": len(rows), "results": [dict(r) for r in rows]}), 200
+
+
+# -------------------------
+# BATCH STATUS (dashboard polling)
+# -------------------------
+MAX_STATUS_BATCH = 500
+
+
+@app.route("/api/status/batch", methods=["POST"])
+def batch_status():
+    """
+    Resolve many deposit / investment ids in one call.
+    Body: {"ids": ["...", ...]}
+    One indexed IN-query against estack.db (investments by deposit_id) and
+    one against transactions.db (depositId). eStack wins if an id is in both.
+    Response: {"statuses": {id: {"status": ..., "source": "estack"|"transactions"} | null}}
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+
+    if not isinstance(ids, list) or not ids:
+        return jsonify({"error": "ids must be a non-empty list"}), 400
+    if len(ids) > MAX_STATUS_BATCH:
+        return jsonify({"error": f"At most {MAX_STATUS_BATCH} ids per request"}), 400
+
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    marks = ", ".join("?" for _ in ids)
+    statuses = dict.fromkeys(ids)
+
+    try:
+        # POST only because of the body size; it never writes
+        for deposit_id, status in get_db_sc(readonly=True).execute(
+            f"SELECT depositId, status FROM transactions WHERE depositId IN ({marks})", ids
+        ):
+            statuses[deposit_id] = {"status": status, "source": "transactions"}
+
+        db = get_db(readonly=True)
+        for row in db.execute(
+            f"SELECT deposit_id, status FROM estack_transactions WHERE deposit_id IN ({marks}) AND kind = 'INVESTMENT'",
+            ids
+        ):
+            statuses[row["deposit_id"]] = {"status": row["status"], "source": "estack"}
+    except Exception as e:
+        logger.exception("Batch status lookup failed")
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({"statuses": statuses}), 200
+
 # # +++++++++++++++++++++++++++++++++++++++
 # # Rerieving loans requests
 # # +++++++++++++++++++++++++++++++++++++++
@@ -2344,7 +2798,7 @@ def get_investment_status(deposit_id):
 #----------------------------------
 @app.route("/api/loans/pending", methods=["GET"])
 def get_pending_loans():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_sc()
     cur = conn.cursor()
     cur.execute("SELECT loanId, user_id, amount, interest, status, expected_return_date FROM loans WHERE status = ?", ("PENDING",))
     rows = cur.fetchall()
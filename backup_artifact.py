@@ -0,0 +1,95 @@
+import os
+import gzip
+import shutil
+import struct
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd artifacts need it, gzip is always there
+    zstandard = None
+
+# ============================================================
+# 🔹 Compressed backup artifacts
+# ------------------------------------------------------------
+# A compressed artifact is a 17-byte header followed by the
+# compressed database:
+#   magic    8 bytes   b"ESTACKZ1"
+#   codec    1 byte    1 = gzip, 2 = zstd
+#   size     8 bytes   original size, big-endian
+# Anything without the magic (a plain SQLite file starts with
+# "SQLite format 3") is a legacy, uncompressed upload.
+# Both directions stream file to file, CHUNK bytes at a time.
+# ============================================================
+
+MAGIC = b"ESTACKZ1"
+HEADER = struct.Struct(">8sBQ")
+CODECS = {"gzip": 1, "zstd": 2}
+CODEC_NAMES = {v: k for k, v in CODECS.items()}
+CHUNK = 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def resolve_codec(name):
+    """Map a setting (off / gzip / zstd / auto) to a codec name, or None for no compression."""
+    name = (name or "off").lower()
+    if name in ("off", "none", "0", ""):
+        return None
+    if name == "auto":
+        return "zstd" if zstandard is not None else "gzip"
+    if name not in CODECS:
+        raise ValueError(f"unknown compression codec {name!r}")
+    if name == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+    return name
+
+
+def read_header(path):
+    """(codec, original_size) of a compressed artifact, or None for a legacy file."""
+    with open(path, "rb") as f:
+        head = f.read(HEADER.size)
+    if len(head) < HEADER.size or not head.startswith(MAGIC):
+        return None
+    _, codec_id, size = HEADER.unpack(head)
+    if codec_id not in CODEC_NAMES:
+        raise ValueError(f"unknown codec id {codec_id} in backup header")
+    return CODEC_NAMES[codec_id], size
+
+
+def pack(src, dest, codec):
+    """Compress the file `src` into the artifact `dest`."""
+    with open(src, "rb") as fin, open(dest, "wb") as fout:
+        fout.write(HEADER.pack(MAGIC, CODECS[codec], os.path.getsize(src)))
+        if codec == "zstd":
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(fin, fout, read_size=CHUNK, write_size=CHUNK)
+        else:
+            # mtime=0 keeps the output identical for identical input
+            with gzip.GzipFile(fileobj=fout, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as out:
+                shutil.copyfileobj(fin, out, CHUNK)
+
+
+def unpack(src, dest):
+    """
+    Decompress the artifact `src` into `dest` (fsynced) and return its
+    codec. Raises ValueError if `src` is not a compressed artifact or
+    does not decompress to the size in its header.
+    """
+    header = read_header(src)
+    if header is None:
+        raise ValueError(f"{src} is not a compressed backup")
+    codec, size = header
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("backup is zstd-compressed but the zstandard package is not installed")
+    with open(src, "rb") as fin, open(dest, "wb") as fout:
+        fin.seek(HEADER.size)
+        if codec == "zstd":
+            zstandard.ZstdDecompressor().copy_stream(fin, fout, read_size=CHUNK, write_size=CHUNK)
+        else:
+            with gzip.GzipFile(fileobj=fin, mode="rb") as inp:
+                shutil.copyfileobj(inp, fout, CHUNK)
+        fout.flush()
+        os.fsync(fout.fileno())
+        written = fout.tell()
+    if written != size:
+        raise ValueError(f"backup decompressed to {written} bytes, header says {size}")
+    return codec
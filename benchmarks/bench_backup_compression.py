@@ -0,0 +1,61 @@
+"""
+Size and time of a compressed backup artifact for an estack.db of --rows
+investments, after --deleted-pct of them were deleted again (free pages,
+like a database that has seen settled loans cleaned up).
+
+    python benchmarks/bench_backup_compression.py [--rows 200000] [--deleted-pct 30]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backup_artifact  # noqa: E402
+from estack_schema import ensure_estack_schema, insert_estack_transaction  # noqa: E402
+from transaction_parser import format_investment  # noqa: E402
+
+
+def make_db(path, rows, deleted_pct):
+    conn = sqlite3.connect(path)
+    ensure_estack_schema(conn)
+    cur = conn.cursor()
+    for i in range(rows):
+        insert_estack_transaction(cur, format_investment("ZMW", 100 + i % 900, f"user_{i % 2000}", f"dep-{i}"),
+                                  "COMPLETED")
+    conn.commit()
+    conn.execute("DELETE FROM estack_transactions WHERE id % 100 < ?", (deleted_pct,))
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--deleted-pct", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "estack.db")
+        make_db(db, args.rows, args.deleted_pct)
+        size = os.path.getsize(db)
+        print(f"estack.db: {args.rows} rows, {args.deleted_pct}% deleted, {size / 1e6:.1f} MB")
+
+        codecs = ["gzip"] + (["zstd"] if backup_artifact.zstandard is not None else [])
+        for codec in codecs:
+            artifact = os.path.join(tmp, f"estack.db.{codec}")
+            restored = os.path.join(tmp, f"restored.{codec}")
+            started = time.perf_counter()
+            backup_artifact.pack(db, artifact, codec)
+            packed = time.perf_counter() - started
+            started = time.perf_counter()
+            backup_artifact.unpack(artifact, restored)
+            unpacked = time.perf_counter() - started
+            compressed = os.path.getsize(artifact)
+            print(f"{codec:5}: {compressed / 1e6:6.1f} MB ({100 * compressed / size:4.1f}% of the database)   "
+                  f"compress {packed:5.2f}s   decompress {unpacked:5.2f}s")
+        if "zstd" not in codecs:
+            print("zstd: skipped, the zstandard package is not installed")
@@ -0,0 +1,128 @@
+"""
+Worker boot time (import app) against a transactions.db with --rows
+transactions whose user_id / type still have to be backfilled from
+metadata.
+
+  unversioned, backfill at boot   what every boot paid before schema
+                                  versions: ALTERs + full metadata backfill
+  unversioned, backfill background  first boot today: ready after the
+                                  migrations, backfill finishes in a thread
+  versioned                       every later boot: schema_version says
+                                  there is nothing to do
+
+Each boot runs in a fresh process with empty estack / journal
+databases and no Dropbox credentials.
+
+    python benchmarks/bench_boot_migrations.py [--rows 1000000]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Columns as they were before init_db_sc added user_id / type / etc.
+LEGACY_DDL = """
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, depositId TEXT UNIQUE, status TEXT, amount REAL,
+        currency TEXT, phoneNumber TEXT, provider TEXT, providerTransactionId TEXT, failureCode TEXT,
+        failureMessage TEXT, metadata TEXT, received_at TEXT
+    )
+"""
+
+
+def make_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(LEGACY_DDL)
+
+    def metadata(i):
+        if i % 2:
+            return json.dumps([{"fieldName": "userId", "fieldValue": f"user_{i % 5000}"},
+                               {"fieldName": "purpose", "fieldValue": random.choice(["investment", "fees"])}])
+        return json.dumps({"userId": f"user_{i % 5000}", "orderId": f"ORD-{i}"})
+
+    batch = 50000
+    for start in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO transactions (depositId, status, amount, currency, metadata, received_at) "
+            "VALUES (?, 'COMPLETED', 100, 'ZMW', ?, '2024-01-01')",
+            [(f"dep-{i}", metadata(i)) for i in range(start, min(start + batch, rows))]
+        )
+    conn.commit()
+    conn.close()
+
+
+def child():
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+    import builtins
+    builtins.print = lambda *a, **k: None
+
+    started = time.perf_counter()
+    import app  # noqa: F401  (boot = import)
+    from schema_registry import schema
+    ready = time.perf_counter() - started
+
+    # Background mode: also time how long until the backfill has caught up
+    done = None
+    if schema.backfill_mode == "background":
+        while not all(p.get("done") for p in schema.backfill_progress.values()) or not schema.backfill_progress:
+            time.sleep(0.05)
+        done = time.perf_counter() - started
+    sys.stdout.write(json.dumps({"ready": ready, "backfill_done": done}) + "\n")
+
+
+def boot(db_path, mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {k: v for k, v in os.environ.items() if not k.startswith("DROPBOX_")}
+        env.update({
+            "TRANSACTIONS_DB_PATH": db_path,
+            "ESTACK_DB_PATH": os.path.join(tmp, "estack.db"),
+            "CALLBACK_JOURNAL_PATH": os.path.join(tmp, "callback_journal.db"),
+            "SCHEMA_BACKFILL": mode,
+        })
+        out = subprocess.run([sys.executable, __file__, "--child"], env=env, cwd=tmp,
+                             capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pristine = os.path.join(tmp, "pristine.db")
+        started = time.perf_counter()
+        make_db(pristine, args.rows)
+        print(f"{args.rows} transactions generated in {time.perf_counter() - started:.1f}s")
+
+        db = os.path.join(tmp, "transactions.db")
+        for label, mode in (("unversioned, backfill at boot      ", "boot"),
+                            ("unversioned, backfill in background", "background")):
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db + suffix):
+                    os.remove(db + suffix)
+            shutil.copy(pristine, db)
+            result = boot(db, mode)
+            line = f"{label}: ready in {result['ready']:6.2f}s"
+            if result["backfill_done"] is not None:
+                line += f", backfill done at {result['backfill_done']:.2f}s"
+            print(line)
+
+        result = boot(db, "boot")
+        print(f"versioned (later boots)            : ready in {result['ready']:6.2f}s")
@@ -0,0 +1,117 @@
+"""
+/callback/deposit acknowledge latency while Dropbox is slow: callbacks
+applied inline (CALLBACK_FAST_ACK=0) vs journaled and acknowledged
+(CALLBACK_FAST_ACK=1).
+
+Each mode runs in a fresh process against empty temp databases, with
+database_backup.upload_db replaced by a sleep of --dropbox-ms to stand
+in for a slow upload. Reports ack p50/p99 and, for fast-ack, how long
+the journal took to apply everything afterwards.
+
+    python benchmarks/bench_callback_ack.py [--callbacks 400] [--threads 8] [--dropbox-ms 300]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def child(callbacks, threads, dropbox_ms):
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+    import builtins
+    builtins.print = lambda *a, **k: None  # the callback handler prints every payload
+
+    import database_backup
+    database_backup.upload_db = lambda: time.sleep(dropbox_ms / 1000)
+
+    import app as app_module
+    from callback_journal import callback_journal
+
+    app = app_module.app
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        client = app.test_client()
+        for i in range(callbacks // threads):
+            deposit_id = str(uuid.uuid4())
+            payload = {"depositId": deposit_id, "status": "COMPLETED", "depositedAmount": 100 + i,
+                       "metadata": {"userId": f"user_{n}"}}
+            started = time.perf_counter()
+            code = client.post("/callback/deposit", json=payload).status_code
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if code != 200:
+                    errors.append(code)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    acked = time.perf_counter() - started
+    drained = callback_journal.drain(timeout=600)
+    applied = time.perf_counter() - started
+
+    sys.stdout.write(json.dumps({"latencies": latencies, "errors": len(errors), "acked_s": acked,
+                                 "applied_s": applied, "drained": drained,
+                                 "journal": callback_journal.stats()}) + "\n")
+
+
+def run(fast_ack, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {k: v for k, v in os.environ.items() if not k.startswith("DROPBOX_")}
+        env.update({
+            "ESTACK_DB_PATH": os.path.join(tmp, "estack.db"),
+            "TRANSACTIONS_DB_PATH": os.path.join(tmp, "transactions.db"),
+            "CALLBACK_JOURNAL_PATH": os.path.join(tmp, "callback_journal.db"),
+            "CALLBACK_FAST_ACK": "1" if fast_ack else "0",
+        })
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--callbacks", str(args.callbacks),
+             "--threads", str(args.threads), "--dropbox-ms", str(args.dropbox_ms)],
+            env=env, cwd=tmp, capture_output=True, text=True, check=True,
+        )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    lat = result["latencies"]
+    name = "fast-ack (journal)" if fast_ack else "inline apply      "
+    print(f"{name}: ack p50 {percentile(lat, 50):8.2f} ms  p99 {percentile(lat, 99):8.2f} ms  "
+          f"errors {result['errors']}  all acked in {result['acked_s']:.2f} s", end="")
+    if fast_ack:
+        print(f", applied in {result['applied_s']:.2f} s (pending {result['journal']['pending']}, "
+              f"failed {result['journal']['failed']})")
+    else:
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--callbacks", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--dropbox-ms", type=float, default=300)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.callbacks, args.threads, args.dropbox_ms)
+    else:
+        print(f"{args.callbacks} eStack callbacks from {args.threads} threads, Dropbox upload {args.dropbox_ms:.0f} ms")
+        run(False, args)
+        run(True, args)
@@ -0,0 +1,140 @@
+"""
+Callback writes per second: SELECT then UPDATE-or-INSERT (how
+deposit_callback used to write) vs one INSERT ... ON CONFLICT DO UPDATE
+from upserts.py, for StudyCraft (transactions) and eStack
+(estack_transactions) callbacks.
+
+Half of the callbacks are new ids, half are status updates for ids
+already stored. Each callback is its own transaction, as in the handler.
+
+    python benchmarks/bench_callback_upserts.py [--rows 100000] [--callbacks 20000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from estack_schema import ensure_estack_schema, ensure_estack_unique_keys, insert_estack_transaction  # noqa: E402
+from transaction_parser import format_investment  # noqa: E402
+from upserts import upsert_transaction, upsert_estack_investment  # noqa: E402
+
+TRANSACTIONS_DDL = """
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, depositId TEXT UNIQUE, status TEXT, amount REAL,
+        currency TEXT, phoneNumber TEXT, provider TEXT, providerTransactionId TEXT, failureCode TEXT,
+        failureMessage TEXT, metadata TEXT, received_at TEXT, updated_at TEXT, created_at TEXT,
+        type TEXT DEFAULT 'payment', user_id TEXT, investment_id TEXT, reference TEXT
+    )
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def setup(path, rows):
+    conn = connect(path)
+    conn.execute(TRANSACTIONS_DDL)
+    conn.executemany(
+        "INSERT INTO transactions (depositId, status, amount, received_at, type) VALUES (?, 'PENDING', 10, 't', 'payment')",
+        [(f"sc-{i}",) for i in range(rows)]
+    )
+    ensure_estack_schema(conn)
+    for i in range(rows):
+        insert_estack_transaction(conn.cursor(), format_investment("ZMW", 100, f"user_{i % 500}", f"es-{i}"), "PENDING")
+    conn.commit()
+    ensure_estack_unique_keys(conn)
+    conn.close()
+
+
+def callback_ids(prefix, rows, count):
+    ids = [f"{prefix}-{random.randrange(rows)}" if i % 2 else str(uuid.uuid4()) for i in range(count)]
+    random.shuffle(ids)
+    return ids
+
+
+def studycraft_select_then_write(conn, txn_id):
+    now = time.time()
+    existing = conn.execute("SELECT * FROM transactions WHERE depositId=? OR depositId=?", (txn_id, None)).fetchone()
+    if existing:
+        conn.execute("""
+            UPDATE transactions SET status = COALESCE(?, status), amount = COALESCE(?, amount),
+                currency = COALESCE(?, currency), phoneNumber = COALESCE(?, phoneNumber),
+                provider = COALESCE(?, provider), providerTransactionId = COALESCE(?, providerTransactionId),
+                failureCode = COALESCE(?, failureCode), failureMessage = COALESCE(?, failureMessage),
+                metadata = COALESCE(?, metadata), updated_at = ?, user_id = COALESCE(?, user_id)
+            WHERE depositId = ? OR depositId = ?
+        """, ("COMPLETED", 10.0, "ZMW", "260977000111", "MTN", "p", None, None, None, now, None, txn_id, None))
+    else:
+        conn.execute("""
+            INSERT INTO transactions (depositId, status, amount, currency, phoneNumber, provider,
+                providerTransactionId, failureCode, failureMessage, metadata, received_at, updated_at, type, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (txn_id, "COMPLETED", 10.0, "ZMW", "260977000111", "MTN", "p", None, None, None, now, now, "payment", None))
+
+
+def studycraft_upsert(conn, txn_id):
+    now = time.time()
+    upsert_transaction(conn, {
+        "depositId": txn_id, "status": "COMPLETED", "amount": 10.0, "currency": "ZMW",
+        "phoneNumber": "260977000111", "provider": "MTN", "providerTransactionId": "p",
+        "received_at": now, "updated_at": now, "type": "payment",
+    })
+
+
+def estack_select_then_write(conn, deposit_id):
+    name = format_investment("ZMW", 100, "user_1", deposit_id)
+    existing = conn.execute(
+        "SELECT rowid AS rowid, amount FROM estack_transactions WHERE deposit_id = ? AND kind = 'INVESTMENT'",
+        (deposit_id,)
+    ).fetchone()
+    if existing:
+        conn.execute("UPDATE estack_transactions SET status = ? WHERE rowid = ?", ("COMPLETED", existing["rowid"]))
+    else:
+        insert_estack_transaction(conn.cursor(), name, "COMPLETED")
+
+
+def estack_upsert(conn, deposit_id):
+    upsert_estack_investment(conn, format_investment("ZMW", 100, "user_1", deposit_id), "COMPLETED")
+
+
+def measure(path, write, ids):
+    conn = connect(path)
+    start = time.perf_counter()
+    for txn_id in ids:
+        write(conn, txn_id)
+        conn.commit()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return len(ids) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--callbacks", type=int, default=20000)
+    args = parser.parse_args()
+
+    cases = [
+        ("StudyCraft", "sc", studycraft_select_then_write, studycraft_upsert),
+        ("eStack    ", "es", estack_select_then_write, estack_upsert),
+    ]
+    print(f"{args.rows} existing rows per table, {args.callbacks} callbacks (half new, half updates)")
+    for label, prefix, before, after in cases:
+        rates = []
+        for write in (before, after):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "bench.db")
+                setup(path, args.rows)
+                rates.append(measure(path, write, callback_ids(prefix, args.rows, args.callbacks)))
+        print(f"{label}: select+write {rates[0]:8.0f}/s   upsert {rates[1]:8.0f}/s   ({rates[1] / rates[0]:.2f}x)")
@@ -0,0 +1,210 @@
+"""
+Bytes sent to Dropbox per synced callback: DROPBOX_SYNC_MODE=full (the
+whole estack.db every sync) vs changes (row-change segments on top of a
+base), and a restore check: estack.db rebuilt from the base plus the
+segments must hold the same rows as the live database.
+
+Dropbox is an in-memory stub. The database starts with --rows
+investments and a base upload; each of --callbacks callbacks then
+inserts or updates one investment (plus a notification now and then)
+and is synced on its own.
+
+    python benchmarks/bench_change_shipping.py [--rows 50000] [--callbacks 200]
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+TMP = tempfile.mkdtemp()
+os.environ["ESTACK_DB_PATH"] = os.path.join(TMP, "estack.db")  # before database_backup reads it
+
+import dropbox  # noqa: E402
+
+import changelog  # noqa: E402
+import database_backup  # noqa: E402
+from estack_schema import ensure_estack_schema, insert_estack_transaction  # noqa: E402
+from transaction_parser import format_investment  # noqa: E402
+
+
+class StubDropbox:
+    """Just enough of the Dropbox API for database_backup, counting bytes sent."""
+
+    class Meta:
+        def __init__(self, name, data, rev):
+            self.name = name
+            self.rev = str(rev)
+            self.content_hash = database_backup.content_hash(
+                data[i:i + database_backup.DROPBOX_HASH_BLOCK]
+                for i in range(0, len(data), database_backup.DROPBOX_HASH_BLOCK)
+            )
+
+    class Response:
+        def __init__(self, data):
+            self.content = data
+
+        def iter_content(self, chunk_size):
+            return (self.content[i:i + chunk_size] for i in range(0, len(self.content), chunk_size))
+
+        def close(self):
+            pass
+
+    class Listing:
+        def __init__(self, entries):
+            self.entries = entries
+            self.has_more = False
+
+    def __init__(self):
+        self.files = {}
+        self.sessions = {}
+        self.rev = 0
+        self.bytes_up = 0
+
+    def _missing(self):
+        return dropbox.exceptions.ApiError("stub", None, None, None)
+
+    def files_upload(self, data, path, mode=None):
+        return self._store(path, data)
+
+    def _store(self, path, data):
+        self.rev += 1
+        self.bytes_up += len(data)
+        self.files[path] = (data, self.Meta(path.rsplit("/", 1)[-1], data, self.rev))
+        return self.files[path][1]
+
+    def files_upload_session_start(self, data):
+        session_id = hashlib.sha1(os.urandom(8)).hexdigest()
+        self.sessions[session_id] = [data]
+        self.bytes_up += len(data)
+
+        class Session:
+            pass
+        session = Session()
+        session.session_id = session_id
+        return session
+
+    def files_upload_session_append_v2(self, data, cursor):
+        self.sessions[cursor.session_id].append(data)
+        self.bytes_up += len(data)
+
+    def files_upload_session_finish(self, data, cursor, commit):
+        parts = self.sessions.pop(cursor.session_id) + [data]
+        self.bytes_up -= sum(len(p) for p in parts[:-1])  # _store counts them all again
+        return self._store(commit.path, b"".join(parts))
+
+    def files_get_metadata(self, path):
+        if path not in self.files:
+            raise self._missing()
+        return self.files[path][1]
+
+    def files_download(self, path):
+        if path not in self.files:
+            raise self._missing()
+        data, meta = self.files[path]
+        return meta, self.Response(data)
+
+    def files_list_folder(self, path):
+        entries = [meta for p, (_, meta) in self.files.items() if p.startswith(path + "/")]
+        if not entries:
+            raise self._missing()
+        return self.Listing(entries)
+
+    def files_delete_v2(self, path):
+        self.files.pop(path)
+
+
+def make_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    ensure_estack_schema(conn)
+    conn.execute("CREATE TABLE notifications (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, "
+                 "message TEXT, created_at TEXT)")
+    changelog.install_triggers(conn)
+    cur = conn.cursor()
+    for i in range(rows):
+        insert_estack_transaction(cur, format_investment("ZMW", 100 + i % 900, f"user_{i % 2000}", f"dep-{i}"),
+                                  "COMPLETED")
+    conn.commit()
+    changelog.mark_shipped(conn, changelog.position(conn))  # the rows above predate shipping
+    conn.close()
+
+
+def callback(conn, i, rows):
+    if i % 3:
+        conn.execute("UPDATE estack_transactions SET status = ? WHERE id = ?", (f"LOANED_OUT_{i}", 1 + i * 7 % rows))
+    else:
+        insert_estack_transaction(conn.cursor(), format_investment("ZMW", 250, f"user_{i}", f"new-{i}"), "COMPLETED")
+    if i % 10 == 0:
+        conn.execute("INSERT INTO notifications (user_id, message, created_at) VALUES (?, ?, ?)",
+                     (f"user_{i}", f"Your investment {i} has been loaned out.", "2024-01-01"))
+    if i % 25 == 0:
+        conn.execute("DELETE FROM estack_transactions WHERE id = ?", (2 + i,))
+    conn.commit()
+
+
+def dump(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {table: conn.execute(f"SELECT * FROM {table} ORDER BY rowid").fetchall()
+                for table in changelog.TRACKED_TABLES}
+    finally:
+        conn.close()
+
+
+def run(mode, pristine, args):
+    db = database_backup.LOCAL_DB
+    for suffix in ("", "-wal", "-shm", ".sync.json"):
+        if os.path.exists(db + suffix):
+            os.remove(db + suffix)
+    shutil.copy(pristine, db)
+
+    dbx = StubDropbox()
+    database_backup.get_dbx = lambda: dbx
+    database_backup.DROPBOX_SYNC_MODE = mode
+    assert database_backup.sync_db()
+    base_bytes = dbx.bytes_up
+
+    conn = sqlite3.connect(db)
+    started = time.perf_counter()
+    for i in range(args.callbacks):
+        callback(conn, i, args.rows)
+        assert database_backup.sync_db()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    per_callback = (dbx.bytes_up - base_bytes) / args.callbacks
+    print(f"{mode:8}: base {base_bytes / 1e6:6.2f} MB, then {per_callback:12,.0f} bytes and "
+          f"{elapsed / args.callbacks * 1000:6.1f} ms per synced callback")
+
+    # Restore on a fresh disk: base + segments must equal the live database
+    live = dump(db)
+    os.rename(db, db + ".live")
+    for suffix in ("-wal", "-shm", ".sync.json", ".restored"):
+        if os.path.exists(db + suffix):
+            os.remove(db + suffix)
+    outcome = database_backup.download_db("always")
+    print(f"          restore: {outcome}, matches the live database: {dump(db) == live}")
+    os.remove(db + ".live")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--callbacks", type=int, default=200)
+    args = parser.parse_args()
+
+    database_backup.print = lambda *a, **k: None  # its per-sync messages
+    try:
+        pristine = os.path.join(TMP, "pristine.db")
+        make_db(pristine, args.rows)
+        print(f"estack.db with {args.rows} investments: {os.path.getsize(pristine) / 1e6:.1f} MB")
+        for mode in ("full", "changes"):
+            run(mode, pristine, args)
+    finally:
+        shutil.rmtree(TMP)
@@ -0,0 +1,66 @@
+"""
+Connection overhead per request: a fresh sqlite3.connect() per handler call
+(what app.py used to do) vs a connection checked out of db_pool.
+
+    python benchmarks/bench_connection_pool.py [--requests 20000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db_pool import ConnectionPool  # noqa: E402
+
+QUERY = "SELECT status FROM estack_transactions WHERE deposit_id = ?"
+
+
+def setup(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE estack_transactions (id INTEGER PRIMARY KEY, deposit_id TEXT, status TEXT)")
+    conn.execute("CREATE INDEX idx_estack_deposit_id ON estack_transactions (deposit_id)")
+    conn.executemany("INSERT INTO estack_transactions (deposit_id, status) VALUES (?, 'COMPLETED')",
+                     [(f"dep-{i}",) for i in range(10000)])
+    conn.commit()
+    conn.close()
+
+
+def per_call_connect(path, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        db = sqlite3.connect(path)
+        db.row_factory = sqlite3.Row
+        db.execute(QUERY, (f"dep-{i % 10000}",)).fetchone()
+        db.close()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def pooled(path, requests):
+    pool = ConnectionPool(path)
+    start = time.perf_counter()
+    for i in range(requests):
+        db = pool.acquire()
+        db.execute(QUERY, (f"dep-{i % 10000}",)).fetchone()
+        pool.release(db)
+    elapsed = (time.perf_counter() - start) / requests * 1e6
+    pool.close_all()
+    return elapsed, pool.opened
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "estack.db")
+        setup(path)
+        before = per_call_connect(path, args.requests)
+        after, opened = pooled(path, args.requests)
+
+    print(f"connect per call : {before:8.1f} µs/request ({args.requests} connections opened)")
+    print(f"db_pool          : {after:8.1f} µs/request ({opened} connection opened)")
+    print(f"speed-up         : {before / after:8.1f}x")
@@ -0,0 +1,60 @@
+"""
+Callback-side cost of syncing estack.db to Dropbox: upload inline after
+every callback (as before) vs mark_dirty() and let the debounced worker
+upload.
+
+Dropbox is replaced by a stub that sleeps --upload-s per upload. --callbacks
+callbacks arrive --gap-s apart; the script reports the time each callback
+spends on the sync step and how many uploads went out.
+
+    python benchmarks/bench_dropbox_sync.py [--callbacks 200] [--gap-s 0.01] [--upload-s 0.5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dropbox_sync import DropboxSync  # noqa: E402
+
+
+def run(label, sync_step, args, uploads):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.callbacks):
+        t = time.perf_counter()
+        sync_step()
+        latencies.append(time.perf_counter() - t)
+        time.sleep(args.gap_s)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"{label}: p50 {statistics.median(latencies) * 1000:8.3f} ms   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:8.3f} ms   "
+          f"{uploads()} uploads in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--callbacks", type=int, default=200)
+    parser.add_argument("--gap-s", type=float, default=0.01)
+    parser.add_argument("--upload-s", type=float, default=0.5)
+    parser.add_argument("--debounce", type=float, default=0.2)
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    inline = {"uploads": 0}
+
+    def upload():
+        time.sleep(args.upload_s)
+        inline["uploads"] += 1
+        return True
+
+    run("inline upload_db ", upload, args, lambda: inline["uploads"])
+
+    sync = DropboxSync(upload=lambda: time.sleep(args.upload_s), debounce=args.debounce,
+                       interval=args.interval, max_lag=args.interval)
+    run("debounced worker ", sync.mark_dirty, args, lambda: sync.uploads)
+    sync.flush()
+    print(f"after flush: {sync.uploads} uploads, last lag {sync.last_lag_seconds}s")
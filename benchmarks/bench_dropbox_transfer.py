@@ -0,0 +1,141 @@
+"""
+Peak RSS of a Dropbox upload / restore against estack.db size:
+
+  whole file   upload_db read the file into one bytes object and
+               download_db buffered res.content (as before)
+  streamed     upload sessions and iter_content, DROPBOX_CHUNK_MB at a time
+
+Dropbox is replaced by a stub that discards uploads and serves the
+download from a local file. Each transfer runs in a fresh process;
+the figure is the process's peak RSS minus its RSS just before the
+transfer.
+
+    python benchmarks/bench_dropbox_transfer.py [--sizes 64,256]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def make_db(path, mb):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE filler (id INTEGER PRIMARY KEY, data BLOB)")
+    conn.executemany("INSERT INTO filler (data) VALUES (randomblob(4000))", [()] * (mb * 256))
+    conn.commit()
+    conn.close()
+
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+
+def child(op, mode, remote):
+    sys.path.insert(0, ROOT)
+    import builtins
+    builtins.print = lambda *a, **k: None
+    import database_backup
+
+    class Response:
+        def iter_content(self, chunk_size):
+            with open(remote, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        @property
+        def content(self):
+            with open(remote, "rb") as f:
+                return f.read()
+
+        def close(self):
+            pass
+
+    class Session:
+        session_id = "bench"
+
+    class Metadata:
+        content_hash = None
+        rev = None
+
+    class StubDropbox:
+        def files_upload(self, data, path, mode=None):
+            pass
+
+        def files_upload_session_start(self, data):
+            return Session
+
+        def files_upload_session_append_v2(self, data, cursor):
+            pass
+
+        def files_upload_session_finish(self, data, cursor, commit):
+            pass
+
+        def files_get_metadata(self, path):
+            return Metadata
+
+        def files_download(self, path):
+            return Metadata, Response()
+
+    dbx = StubDropbox()
+    database_backup.get_dbx = lambda: dbx
+    before = peak_mb()
+
+    if op == "upload" and mode == "whole":
+        database_backup.checkpoint_db()
+        with open(database_backup.LOCAL_DB, "rb") as f:
+            dbx.files_upload(f.read(), database_backup.DBX_PATH)
+    elif op == "upload":
+        assert database_backup.upload_db()
+    elif mode == "whole":
+        _, res = dbx.files_download(database_backup.DBX_PATH)
+        data = res.content
+        with open(database_backup.LOCAL_DB, "wb") as f:
+            f.write(data)
+    else:
+        assert database_backup.download_db("always") == "downloaded"
+
+    sys.stdout.write(json.dumps({"before": before, "peak": peak_mb()}) + "\n")
+
+
+def measure(op, mode, db, remote):
+    env = {k: v for k, v in os.environ.items() if not k.startswith("DROPBOX_")}
+    env["ESTACK_DB_PATH"] = db
+    out = subprocess.run([sys.executable, __file__, "--child", op, mode, remote],
+                         env=env, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return result["peak"] - result["before"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="64,256", help="database sizes in MB")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        sys.exit(0)
+
+    for mb in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "estack.db")
+            make_db(db, mb)
+            remote = os.path.join(tmp, "remote.db")
+            shutil.copy(db, remote)
+            size = os.path.getsize(db) / 1e6
+            line = [f"{size:7.1f} MB database:"]
+            for op in ("upload", "download"):
+                for mode in ("whole", "streamed"):
+                    line.append(f"{op} {mode} +{measure(op, mode, db, remote):6.1f} MB")
+            print("   ".join(line))
@@ -0,0 +1,114 @@
+"""
+Lookup latency on estack_transactions: LIKE '%id%' scans vs the indexed
+structured columns and the estack_tokens join, at 10k / 100k / 1M rows.
+
+    python benchmarks/bench_estack_lookup.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from estack_schema import (  # noqa: E402
+    ensure_estack_schema, backfill_estack_columns,
+    ensure_estack_tokens, rebuild_estack_tokens,
+)
+
+QUERIES = 50
+
+
+def build_legacy_db(path, rows):
+    """Old schema: only name_of_transaction + status."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE estack_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_of_transaction TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    deposit_ids, user_ids = [], []
+    batch = []
+    for i in range(rows):
+        user_id = f"user_{i % max(rows // 20, 1)}"
+        deposit_id = str(uuid.uuid4())
+        if i % 10 == 0:
+            name = f"LOAN | ZMW500 | 26097{i:07d} | {deposit_id} | {uuid.uuid4()}"
+        else:
+            name = f"ZMW{1000 + i % 500} | {user_id} | {deposit_id}"
+            deposit_ids.append(deposit_id)
+            user_ids.append(user_id)
+        batch.append((name, "COMPLETED"))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT INTO estack_transactions (name_of_transaction, status) VALUES (?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO estack_transactions (name_of_transaction, status) VALUES (?, ?)", batch)
+    conn.commit()
+    return conn, deposit_ids, user_ids
+
+
+def time_queries(conn, sql, params_list):
+    start = time.perf_counter()
+    for params in params_list:
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) / len(params_list) * 1000
+
+
+def run(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, deposit_ids, user_ids = build_legacy_db(os.path.join(tmp, "estack.db"), rows)
+        deposits = random.sample(deposit_ids, QUERIES)
+        users = random.sample(user_ids, QUERIES)
+
+        like_dep = time_queries(
+            conn, "SELECT status FROM estack_transactions WHERE name_of_transaction LIKE ?",
+            [(f"%{d}%",) for d in deposits])
+        like_user = time_queries(
+            conn, "SELECT * FROM estack_transactions WHERE name_of_transaction LIKE ? ORDER BY rowid DESC",
+            [(f"%{u}%",) for u in users])
+
+        start = time.perf_counter()
+        ensure_estack_schema(conn)
+        backfill_estack_columns(conn)
+        migrate_s = time.perf_counter() - start
+
+        idx_dep = time_queries(
+            conn, "SELECT status FROM estack_transactions WHERE deposit_id = ? AND kind = 'INVESTMENT'",
+            [(d,) for d in deposits])
+        idx_user = time_queries(
+            conn, "SELECT * FROM estack_transactions WHERE user_id = ? OR borrower_phone = ? ORDER BY rowid DESC",
+            [(u, u) for u in users])
+
+        start = time.perf_counter()
+        ensure_estack_tokens(conn)
+        rebuild_estack_tokens(conn)
+        tokens_s = time.perf_counter() - start
+
+        token_user = time_queries(
+            conn, """
+            SELECT t.* FROM estack_tokens k JOIN estack_transactions t ON t.rowid = k.txn_rowid
+            WHERE k.token = ? ORDER BY k.txn_rowid DESC
+            """,
+            [(u,) for u in users])
+        conn.close()
+
+    print(f"{rows:>9} rows | migrate {migrate_s:7.2f}s | "
+          f"by deposit: LIKE {like_dep:8.3f}ms -> index {idx_dep:6.3f}ms | "
+          f"by user: LIKE {like_user:8.3f}ms -> index {idx_user:6.3f}ms | "
+          f"token rebuild {tokens_s:6.2f}s, token join {token_user:6.3f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size)
@@ -0,0 +1,156 @@
+"""
+Deposit callbacks under concurrent GET traffic, per SQLite configuration.
+
+Each configuration runs in a fresh process (db_pool reads the SQLITE_*
+environment at import) against empty temp databases. Writer threads post
+eStack and StudyCraft deposit callbacks while reader threads poll the
+status and listing endpoints through the Flask test client; p50/p99
+latency and error counts are reported for both.
+
+    python benchmarks/bench_sqlite_pragmas.py [--seconds 10] [--writers 4] [--readers 8]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CONFIGS = {
+    "rollback journal (DELETE, FULL)": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_CACHE_SIZE": "-2000",
+        "SQLITE_MMAP_SIZE": "0",
+        "SQLITE_TEMP_STORE": "DEFAULT",
+    },
+    "WAL, synchronous NORMAL": {
+        "SQLITE_JOURNAL_MODE": "WAL",
+        "SQLITE_SYNCHRONOUS": "NORMAL",
+        "SQLITE_CACHE_SIZE": "-2000",
+        "SQLITE_MMAP_SIZE": "0",
+        "SQLITE_TEMP_STORE": "DEFAULT",
+    },
+    "WAL, NORMAL + cache/mmap/temp_store (defaults)": {},
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def child(seconds, writers, readers):
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+    import app as app_module
+
+    app = app_module.app
+    deposit_ids = []
+    ids_lock = threading.Lock()
+    stop = threading.Event()
+    results = {"write": [], "read": [], "write_errors": 0, "read_errors": 0}
+    results_lock = threading.Lock()
+
+    def record(kind, started, ok):
+        elapsed = (time.perf_counter() - started) * 1000
+        with results_lock:
+            results[kind].append(elapsed)
+            if not ok:
+                results[kind + "_errors"] += 1
+
+    def writer(n):
+        client = app.test_client()
+        i = 0
+        while not stop.is_set():
+            i += 1
+            if i % 2:
+                deposit_id = str(uuid.uuid4())
+                payload = {"depositId": deposit_id, "status": "COMPLETED",
+                           "depositedAmount": random.randint(50, 5000),
+                           "metadata": {"userId": f"user_{n}_{i % 50}"}}
+            else:
+                deposit_id = f"sc-{n}-{i}"
+                payload = {"payoutId": deposit_id, "status": "COMPLETED", "amount": "5",
+                           "recipient": {"accountDetails": {"phoneNumber": "260977000111"}},
+                           "metadata": {"loanId": f"L-{n}-{i}"}}
+            started = time.perf_counter()
+            ok = client.post("/callback/deposit", json=payload).status_code == 200
+            record("write", started, ok)
+            if i % 2:
+                with ids_lock:
+                    deposit_ids.append(deposit_id)
+
+    def reader(n):
+        client = app.test_client()
+        while not stop.is_set():
+            with ids_lock:
+                deposit_id = random.choice(deposit_ids) if deposit_ids else None
+            if deposit_id is None:
+                time.sleep(0.001)
+                continue
+            choice = random.random()
+            if choice < 0.5:
+                url = f"/api/investments/status/{deposit_id}"
+            elif choice < 0.8:
+                url = f"/api/investments/user/user_{n % writers}_{random.randint(0, 49)}"
+            else:
+                url = f"/transactions/sc-{n % writers}-2"
+            started = time.perf_counter()
+            ok = client.get(url).status_code in (200, 404)
+            record("read", started, ok)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    print(json.dumps(results))
+
+
+def run(name, overrides, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {k: v for k, v in os.environ.items()
+               if not k.startswith(("DROPBOX_", "SQLITE_", "ESTACK_SQLITE_", "TRANSACTIONS_SQLITE_"))}
+        env.update(overrides)
+        env["ESTACK_DB_PATH"] = os.path.join(tmp, "estack.db")
+        env["TRANSACTIONS_DB_PATH"] = os.path.join(tmp, "transactions.db")
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--seconds", str(args.seconds),
+             "--writers", str(args.writers), "--readers", str(args.readers)],
+            env=env, cwd=tmp, capture_output=True, text=True, check=True,
+        )
+    results = json.loads(out.stdout.strip().splitlines()[-1])
+    writes, reads = results["write"], results["read"]
+    print(f"{name}")
+    print(f"  writes: {len(writes):6d}  p50 {percentile(writes, 50):7.2f} ms  "
+          f"p99 {percentile(writes, 99):7.2f} ms  errors {results['write_errors']}")
+    print(f"  reads : {len(reads):6d}  p50 {percentile(reads, 50):7.2f} ms  "
+          f"p99 {percentile(reads, 99):7.2f} ms  errors {results['read_errors']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.seconds, args.writers, args.readers)
+    else:
+        for name, overrides in CONFIGS.items():
+            run(name, overrides, args)
@@ -0,0 +1,124 @@
+"""
+Time to first request while Dropbox is slow: STARTUP_RESTORE=blocking
+(download estack.db before the app finishes importing, as before) vs
+background (serve straight away, estack routes 503 until restored).
+
+Dropbox is replaced by a stub that serves an estack.db of --rows
+investments after --dropbox-s seconds. Each mode runs in a fresh
+process; times are from just before `import app` to the first non-503
+answer of a transactions.db route and of an estack.db route.
+
+    python benchmarks/bench_startup_restore.py [--dropbox-s 3] [--rows 50000]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def make_remote(path, rows):
+    sys.path.insert(0, ROOT)
+    from estack_schema import ensure_estack_schema, insert_estack_transaction
+    from transaction_parser import format_investment
+
+    conn = sqlite3.connect(path)
+    ensure_estack_schema(conn)
+    cur = conn.cursor()
+    for i in range(rows):
+        insert_estack_transaction(cur, format_investment("ZMW", 100 + i % 900, f"user_{i % 2000}", f"dep-{i}"),
+                                  "COMPLETED")
+    conn.commit()
+    conn.close()
+
+
+def child(remote, dropbox_s):
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+    import builtins
+    builtins.print = lambda *a, **k: None
+
+    import database_backup
+
+    class Remote:
+        content = open(remote, "rb").read()
+        content_hash = None
+        server_modified = None
+
+        @classmethod
+        def iter_content(cls, chunk_size):
+            return (cls.content[i:i + chunk_size] for i in range(0, len(cls.content), chunk_size))
+
+        @staticmethod
+        def close():
+            pass
+
+    class SlowDropbox:
+        def files_download(self, path):
+            time.sleep(dropbox_s)
+            return Remote, Remote
+
+        def files_get_metadata(self, path):
+            return Remote
+
+    database_backup.get_dbx = lambda: SlowDropbox()
+
+    started = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter() - started
+    client = app_module.app.test_client()
+
+    first = {}
+    routes = {"transactions": "/deposit_status/dep-1", "estack": "/api/investments/status/dep-1"}
+    while len(first) < len(routes):
+        for name, url in routes.items():
+            if name not in first and client.get(url).status_code != 503:
+                first[name] = time.perf_counter() - started
+        time.sleep(0.005)
+    sys.stdout.write(json.dumps({"imported": imported, **first}) + "\n")
+
+
+def run(mode, remote, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {k: v for k, v in os.environ.items() if not k.startswith("DROPBOX_")}
+        env.update({
+            "ESTACK_DB_PATH": os.path.join(tmp, "estack.db"),
+            "TRANSACTIONS_DB_PATH": os.path.join(tmp, "transactions.db"),
+            "CALLBACK_JOURNAL_PATH": os.path.join(tmp, "callback_journal.db"),
+            "STARTUP_RESTORE": mode,
+            "RESTORE_POLICY": "always",
+        })
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--remote", remote, "--dropbox-s", str(args.dropbox_s)],
+            env=env, cwd=tmp, capture_output=True, text=True, check=True,
+        )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    print(f"{mode:10}: import {result['imported']:6.2f}s   first transactions.db request "
+          f"{result['transactions']:6.2f}s   first estack.db request {result['estack']:6.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dropbox-s", type=float, default=3.0)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--remote", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.remote, args.dropbox_s)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        remote = os.path.join(tmp, "remote.db")
+        make_remote(remote, args.rows)
+        print(f"estack.db of {args.rows} rows ({os.path.getsize(remote) / 1e6:.1f} MB), "
+              f"Dropbox download takes {args.dropbox_s:.1f}s")
+        run("blocking", remote, args)
+        run("background", remote, args)
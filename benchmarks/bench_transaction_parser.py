@@ -0,0 +1,59 @@
+"""
+Per-row parse cost for name_of_transaction: the split/strip loop that
+get_user_loans used to run vs transaction_parser (uncached and cached).
+
+    python benchmarks/bench_transaction_parser.py [--rows 2000] [--requests 50]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from transaction_parser import parse_name, parse_transaction  # noqa: E402
+
+
+def split_based(name):
+    """The per-row code get_user_loans ran before transaction_parser."""
+    parts = [p.strip() for p in name.split("|")]
+    loan_id = parts[3] if len(parts) > 3 else "N/A"
+    amount = parts[1].replace("K", "").strip() if len(parts) > 1 else "N/A"
+    borrower = None
+    if len(parts) > 4 and "Borrower:" in parts[4]:
+        borrower = parts[4].split(":", 1)[1]
+    return loan_id, amount, borrower
+
+
+def history(rows):
+    names = []
+    for i in range(rows):
+        if i % 3 == 0:
+            names.append(f"LOAN | ZMW500 | 26097{i:07d} | {uuid.uuid4()} | {uuid.uuid4()}")
+        else:
+            names.append(f"ZMW{1000 + i} | user_12 | {uuid.uuid4()} | Borrower:26097{i:07d}")
+    return names
+
+
+def bench(label, fn, names, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        for name in names:
+            fn(name)
+    per_row = (time.perf_counter() - start) / (requests * len(names)) * 1e6
+    print(f"{label:<28} {per_row:7.3f} µs/row")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000, help="rows in one user's history")
+    parser.add_argument("--requests", type=int, default=50, help="times the history is re-read")
+    args = parser.parse_args()
+
+    names = history(args.rows)
+    bench("split-based (old handler)", split_based, names, args.requests)
+    bench("parse_name (uncached)", parse_name, names, args.requests)
+    parse_transaction.cache_clear()
+    bench("parse_transaction (LRU)", parse_transaction, names, args.requests)
+    print(parse_transaction.cache_info())
@@ -0,0 +1,102 @@
+"""
+Write throughput: every thread committing on its own (what the handlers
+used to do) vs submitting units to a WriteQueue that group-commits them.
+
+Each write is the shape of a deposit callback: look the row up by key,
+then update it or insert it.
+
+    python benchmarks/bench_write_queue.py [--threads 16] [--writes 500] [--synchronous NORMAL]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db_pool import ConnectionPool, DEFAULT_PRAGMAS  # noqa: E402
+from write_queue import WriteQueue  # noqa: E402
+
+
+def setup(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE transactions (id INTEGER PRIMARY KEY, depositId TEXT UNIQUE, status TEXT, updated_at TEXT)")
+    conn.commit()
+    conn.close()
+
+
+def record(conn, deposit_id):
+    row = conn.execute("SELECT id FROM transactions WHERE depositId = ?", (deposit_id,)).fetchone()
+    if row:
+        conn.execute("UPDATE transactions SET status = 'COMPLETED', updated_at = ? WHERE id = ?",
+                     (time.time(), row[0]))
+    else:
+        conn.execute("INSERT INTO transactions (depositId, status, updated_at) VALUES (?, 'COMPLETED', ?)",
+                     (deposit_id, time.time()))
+
+
+def hammer(threads, writes, write_one):
+    errors = []
+
+    def worker():
+        for _ in range(writes):
+            try:
+                write_one(str(uuid.uuid4()))
+            except sqlite3.Error as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return threads * writes / elapsed, len(errors)
+
+
+def per_handler_commit(pool, threads, writes):
+    def write_one(deposit_id):
+        conn = pool.acquire()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            record(conn, deposit_id)
+            conn.commit()
+        finally:
+            pool.release(conn)
+    return hammer(threads, writes, write_one)
+
+
+def group_commit(pool, threads, writes, max_delay_ms):
+    writer = WriteQueue(pool, max_delay_ms=max_delay_ms)
+    rate, errors = hammer(threads, writes, lambda deposit_id: writer.run(record, deposit_id))
+    writer.stop()
+    return rate, errors, writer.units / max(writer.batches, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=500, help="writes per thread")
+    parser.add_argument("--synchronous", default="NORMAL", help="NORMAL or FULL")
+    args = parser.parse_args()
+
+    pragmas = dict(DEFAULT_PRAGMAS, synchronous=args.synchronous)
+    print(f"{args.threads} threads x {args.writes} writes, WAL, synchronous={args.synchronous}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "transactions.db")
+        setup(path)
+        pool = ConnectionPool(path, pragmas=pragmas, size=args.threads)
+        rate, errors = per_handler_commit(pool, args.threads, args.writes)
+        print(f"commit per handler       : {rate:9.0f} writes/s  errors {errors}")
+        for delay in (0, 2, 5):
+            rate, errors, per_batch = group_commit(pool, args.threads, args.writes, delay)
+            print(f"write queue (delay {delay} ms) : {rate:9.0f} writes/s  errors {errors}  "
+                  f"{per_batch:.1f} writes/commit")
+        pool.close_all()
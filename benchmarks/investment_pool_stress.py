@@ -0,0 +1,104 @@
+"""
+Concurrency stress for investment claims: several "workers" (each with its
+own InvestmentPool, like separate gunicorn processes) and many threads race
+to claim the same investments by id and by amount. Every investment must be
+claimed at most once, and the database must agree with the claim log.
+
+    python benchmarks/investment_pool_stress.py [--investments 300] [--workers 2] [--threads 8]
+"""
+import argparse
+import collections
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from estack_schema import ensure_estack_schema, insert_estack_transaction  # noqa: E402
+from investment_pool import InvestmentPool, claim_investment  # noqa: E402
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def run(investments, workers, threads, attempts):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "estack.db")
+        conn = connect(path)
+        ensure_estack_schema(conn)
+        ids = []
+        for i in range(investments):
+            deposit_id = f"inv-{i}"
+            insert_estack_transaction(conn.cursor(), f"ZMW{100 + i % 50} | user_{i % 7} | {deposit_id}", "COMPLETED")
+            ids.append(deposit_id)
+        conn.commit()
+
+        pools = []
+        for _ in range(workers):
+            pool = InvestmentPool()
+            pool.warm(conn)
+            pools.append(pool)
+        conn.close()
+
+        claims = collections.Counter()
+        log_lock = threading.Lock()
+        start_gate = threading.Barrier(workers * threads)
+
+        def borrower(pool):
+            db = connect(path)
+            cur = db.cursor()
+            start_gate.wait()
+            for _ in range(attempts):
+                cur.execute("BEGIN IMMEDIATE")
+                if random.random() < 0.5:
+                    entry = claim_investment(cur, pool, "IN_USE", deposit_id=random.choice(ids), status="COMPLETED")
+                else:
+                    entry = claim_investment(cur, pool, "IN_USE", min_amount=random.randint(90, 150), status="COMPLETED")
+                db.commit()
+                if entry is not None:
+                    with log_lock:
+                        claims[entry.deposit_id] += 1
+            db.close()
+
+        started = time.perf_counter()
+        pool_threads = [
+            threading.Thread(target=borrower, args=(pools[w],))
+            for w in range(workers) for _ in range(threads)
+        ]
+        for t in pool_threads:
+            t.start()
+        for t in pool_threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        conn = connect(path)
+        in_use = {r["deposit_id"] for r in conn.execute(
+            "SELECT deposit_id FROM estack_transactions WHERE status = 'IN_USE'")}
+        conn.close()
+
+    doubles = {k: v for k, v in claims.items() if v > 1}
+    total_attempts = workers * threads * attempts
+    print(f"{workers} workers x {threads} threads, {total_attempts} claim attempts on "
+          f"{investments} investments in {elapsed:.2f}s ({total_attempts / elapsed:,.0f} attempts/s)")
+    print(f"claimed: {sum(claims.values())}, distinct: {len(claims)}, in_use in db: {len(in_use)}")
+
+    assert not doubles, f"investments claimed more than once: {doubles}"
+    assert set(claims) == in_use, "claim log and database disagree"
+    print("OK: no investment was claimed twice")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--investments", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--attempts", type=int, default=100)
+    args = parser.parse_args()
+    run(args.investments, args.workers, args.threads, args.attempts)
@@ -0,0 +1,125 @@
+"""
+Upload snapshots under concurrent writes: writer threads keep committing
+batches of --batch estack transactions while snapshots are taken over and
+over. Every snapshot must pass PRAGMA integrity_check and hold a whole
+number of batches (no half-committed transaction).
+
+  backup api   database_backup.snapshot_db (what upload_db uploads)
+  raw copy     checkpoint, then read estack.db as a file (the old upload)
+
+    python benchmarks/snapshot_stress.py [--seconds 10] [--writers 4] [--batch 50]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database_backup  # noqa: E402
+from estack_schema import ensure_estack_schema, insert_estack_transaction  # noqa: E402
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+
+def writer(path, n, batch, stop, committed):
+    conn = connect(path)
+    i = 0
+    while not stop.is_set():
+        cur = conn.cursor()
+        for _ in range(batch):
+            insert_estack_transaction(cur, f"ZMW{100 + i % 50} | user_{n}_{i % 7} | w{n}-{i}", "COMPLETED")
+            i += 1
+        conn.commit()
+        committed[n] += 1
+    conn.close()
+
+
+def check(snapshot, batch):
+    """None if the snapshot is good, otherwise what is wrong with it."""
+    try:
+        conn = sqlite3.connect(snapshot)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != "ok":
+                return f"integrity_check: {result}"
+            rows = conn.execute("SELECT COUNT(*) FROM estack_transactions").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return str(e)
+    if rows % batch:
+        return f"{rows} rows is not a whole number of {batch}-row transactions"
+    return None
+
+
+def raw_copy(source, dest):
+    checkpoint = sqlite3.connect(source, timeout=30)
+    checkpoint.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    checkpoint.close()
+    shutil.copyfile(source, dest)
+    return 0
+
+
+def run(label, take, seconds, writers, batch, pages):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "estack.db")
+        conn = connect(path)
+        ensure_estack_schema(conn)
+        conn.close()
+
+        stop = threading.Event()
+        committed = [0] * writers
+        threads = [threading.Thread(target=writer, args=(path, n, batch, stop, committed)) for n in range(writers)]
+        for t in threads:
+            t.start()
+
+        snapshots, restarts, bad, durations = 0, 0, [], []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            snapshot = os.path.join(tmp, f"snapshot-{snapshots}.db")
+            started = time.perf_counter()
+            try:
+                restarts += take(path, snapshot, pages)
+                durations.append(time.perf_counter() - started)
+                problem = check(snapshot, batch)
+            except (ValueError, sqlite3.DatabaseError) as e:
+                problem = str(e)
+            if problem:
+                bad.append(problem)
+            snapshots += 1
+            os.remove(snapshot)
+
+        stop.set()
+        for t in threads:
+            t.join()
+
+    avg = sum(durations) / len(durations) * 1000 if durations else 0
+    print(f"{label}: {snapshots} snapshots ({avg:.1f} ms avg, {restarts} restarts), {len(bad)} bad, "
+          f"{sum(committed)} write transactions committed meanwhile")
+    for problem in sorted(set(bad))[:5]:
+        print("    ", problem)
+    return not bad
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=database_backup.SNAPSHOT_PAGES)
+    args = parser.parse_args()
+
+    ok = run("backup api", lambda src, dst, pages: database_backup.snapshot_db(dst, src, pages=pages),
+             args.seconds, args.writers, args.batch, args.pages)
+    run("raw copy  ", lambda src, dst, pages: raw_copy(src, dst),
+        args.seconds, args.writers, args.batch, args.pages)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,145 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+from callback_journal import callback_journal
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 Callback de-duplication
+# ------------------------------------------------------------
+# PawaPay retries callbacks. An exact replay, i.e. the same
+# depositId / payoutId, the same status and the same payload,
+# short-circuits with the response the first delivery got,
+# instead of redoing the read-modify-write (and, for eStack, the
+# Dropbox upload).
+#
+# In-memory LRU with a TTL in front of a small table in the
+# callback journal database, so replays are still recognised after
+# a restart or by another gunicorn worker. Only 200 responses are
+# remembered: a delivery that failed must be allowed to try again.
+#
+#   CALLBACK_DEDUPE_SIZE   10000   entries kept in memory
+#   CALLBACK_DEDUPE_TTL    86400   seconds a delivery is remembered
+# ============================================================
+
+DEDUPE_SIZE = int(os.getenv("CALLBACK_DEDUPE_SIZE", "10000"))
+DEDUPE_TTL = float(os.getenv("CALLBACK_DEDUPE_TTL", "86400"))
+
+
+def dedupe_key(data):
+    """'<id>|<status>|<sha256 of the canonical payload>', or None if the callback has no id."""
+    if not isinstance(data, dict):
+        return None
+    txn_id = data.get("depositId") or data.get("payoutId")
+    if not txn_id:
+        return None
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+    return f"{txn_id}|{data.get('status')}|{digest}"
+
+
+class CallbackDedupe:
+    def __init__(self, journal=callback_journal, size=DEDUPE_SIZE, ttl=DEDUPE_TTL):
+        self.pool = journal.pool
+        self.writer = journal.writer
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, body, status_code)
+        self.memory_hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        journal.maintenance.append(self.prune)
+
+    def create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS callback_dedupe (
+                dedupe_key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def ensure_schema(self):
+        with self.pool.connection() as conn:
+            self.create_tables(conn)
+            conn.commit()
+
+    def lookup(self, key):
+        """(body, status_code) this delivery was first answered with, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1], entry[2]
+                del self._entries[key]
+
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT response, status_code, created_at FROM callback_dedupe WHERE dedupe_key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        body = json.loads(row["response"])
+        with self._lock:
+            self.table_hits += 1
+            self._remember_locked(key, row["created_at"] + self.ttl, body, row["status_code"])
+        return body, row["status_code"]
+
+    def remember(self, key, body, status_code):
+        """Record the response to a delivery (only 200s are kept)."""
+        if status_code != 200:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember_locked(key, now + self.ttl, body, status_code)
+        # Not waited for: if it is lost, the next replay is just processed again.
+        self.writer.submit(
+            lambda conn, row: conn.execute(
+                "INSERT OR REPLACE INTO callback_dedupe (dedupe_key, response, status_code, created_at) "
+                "VALUES (?, ?, ?, ?)", row
+            ),
+            (key, json.dumps(body), status_code, now)
+        )
+
+    def prune(self):
+        """Drop persisted entries older than the TTL."""
+        self.writer.run(
+            lambda conn, cutoff: conn.execute("DELETE FROM callback_dedupe WHERE created_at <= ?", (cutoff,)),
+            time.time() - self.ttl
+        )
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.table_hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "table_hits": self.table_hits,
+                "misses": self.misses,
+                "hit_ratio": round(hits / total, 4) if total else 0.0,
+                "cached": len(self._entries),
+            }
+
+    def _remember_locked(self, key, expires_at, body, status_code):
+        self._entries[key] = (expires_at, body, status_code)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+callback_dedupe = CallbackDedupe()
@@ -0,0 +1,296 @@
+import os
+import json
+import queue
+import socket
+import threading
+import time
+import uuid
+import zlib
+import logging
+
+from db_pool import BASE_DIR, ConnectionPool, pragmas_from_env
+from write_queue import WriteQueue
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 Callback journal (fast-ack ingestion)
+# ------------------------------------------------------------
+# /callback/deposit appends the raw callback to a SQLite queue
+# table and acknowledges straight away; background workers apply
+# the journaled callbacks afterwards. The journal lives in its own
+# file with synchronous=FULL, so once PawaPay has its 200 the
+# callback survives a crash and is replayed on the next start.
+# Appends go through a WriteQueue, so concurrent callbacks share one
+# fsync instead of queueing behind each other's.
+#
+# Claims: every gunicorn worker runs a dispatcher over the same
+# journal. A dispatcher takes a row by flipping it from PENDING to
+# IN_PROGRESS under its owner id with a lease (a conditional UPDATE,
+# checked by rowcount), so each row is applied by one process. The
+# dispatcher renews the leases of the rows its process holds on
+# every poll, which covers an eStack callback waiting out a restore;
+# rows of a process that died become claimable again once their
+# lease runs out. A row whose worker raised is put back to PENDING.
+#
+# Ordering: a row is only claimed once no earlier row for the same
+# depositId / payoutId is PENDING or IN_PROGRESS, in any process, so
+# callbacks for one id are applied one after another, in order,
+# while different ids are applied in parallel (worker crc32(key) % N).
+#
+#   CALLBACK_JOURNAL_PATH        callback_journal.db next to the app
+#   CALLBACK_WORKERS             4
+#   CALLBACK_MAX_ATTEMPTS        5    then the row is marked FAILED
+#   CALLBACK_RETENTION_HOURS     24   APPLIED rows are pruned after this
+#   CALLBACK_LEASE_SECONDS       60   a claim not renewed for this long is taken over
+# ============================================================
+
+JOURNAL_PATH = os.getenv("CALLBACK_JOURNAL_PATH", os.path.join(BASE_DIR, "callback_journal.db"))
+WORKERS = int(os.getenv("CALLBACK_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("CALLBACK_MAX_ATTEMPTS", "5"))
+RETENTION_HOURS = float(os.getenv("CALLBACK_RETENTION_HOURS", "24"))
+LEASE_SECONDS = float(os.getenv("CALLBACK_LEASE_SECONDS", "60"))
+
+POLL_INTERVAL = 1.0
+DISPATCH_BATCH = 500
+
+
+def journal_pragmas():
+    # The journal is the only copy of a callback until it is applied: fsync every append.
+    pragmas = pragmas_from_env("JOURNAL_")
+    pragmas["synchronous"] = os.getenv("JOURNAL_SQLITE_SYNCHRONOUS", "FULL")
+    return pragmas
+
+
+class CallbackJournal:
+    def __init__(self, path=JOURNAL_PATH, workers=WORKERS, max_attempts=MAX_ATTEMPTS):
+        self.pool = ConnectionPool(path, pragmas=journal_pragmas(), name="callback-journal")
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.apply = None
+        self.writer = WriteQueue(self.pool, name="callback-journal")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self.owner = None
+        self._queues = []
+        self._in_flight = 0
+        self._idle = threading.Condition(self._lock)
+        self.applied = 0
+        self.failed = 0
+        self.maintenance = [self.prune]  # run by the dispatcher about once an hour
+
+    def create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS callback_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT,
+                payload TEXT NOT NULL,
+                received_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'PENDING',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                applied_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_callback_journal_status ON callback_journal (status, seq)")
+
+    def add_claim_columns(self, conn):
+        """owner / lease_until for cross-process claims, and the per-key index the claim checks."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(callback_journal)").fetchall()}
+        for column, ddl in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE callback_journal ADD COLUMN {column} {ddl}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_callback_journal_key ON callback_journal (key, seq)")
+
+    def ensure_schema(self):
+        with self.pool.connection() as conn:
+            self.create_tables(conn)
+            self.add_claim_columns(conn)
+            conn.commit()
+
+    # ---- request side ------------------------------------------------
+
+    def append(self, key, payload):
+        """Durably record one callback; returns its sequence number."""
+        self.start()
+        seq = self.writer.run(
+            lambda conn, row: conn.execute(
+                "INSERT INTO callback_journal (key, payload, received_at) VALUES (?, ?, ?)", row
+            ).lastrowid,
+            (key, json.dumps(payload), time.time())
+        )
+        self._wake.set()
+        return seq
+
+    # ---- workers -----------------------------------------------------
+
+    def start(self, apply=None):
+        """Start the dispatcher and workers (once per process; safe to call often)."""
+        if apply is not None:
+            self.apply = apply
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.ensure_schema()
+            self._pid = os.getpid()
+            self.owner = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}"
+            self._in_flight = 0
+            self._queues = [queue.Queue() for _ in range(self.workers)]
+            for n, q in enumerate(self._queues):
+                threading.Thread(target=self._work, args=(q,), name=f"callback-worker-{n}", daemon=True).start()
+            threading.Thread(target=self._dispatch, name="callback-dispatcher", daemon=True).start()
+
+    def _dispatch(self):
+        last_prune = 0.0
+        while True:
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                if self._in_flight:
+                    self.writer.run(self._renew, self.owner, time.time() + LEASE_SECONDS)
+                while True:
+                    rows = self.writer.run(self._claim, self.owner, time.time())
+                    for row in rows:
+                        with self._lock:
+                            self._in_flight += 1
+                        shard = zlib.crc32((row[1] or "").encode()) % self.workers
+                        self._queues[shard].put(row)
+                    if len(rows) < DISPATCH_BATCH:
+                        break
+                if time.time() - last_prune > 3600:
+                    for task in self.maintenance:
+                        task()
+                    last_prune = time.time()
+            except Exception:
+                logger.exception("Callback journal dispatch failed")
+
+    @staticmethod
+    def _claim(conn, owner, now):
+        """
+        Claim up to DISPATCH_BATCH rows for `owner`, oldest first, and
+        return them as (seq, key, payload, attempts). Runs on the
+        journal writer, inside its BEGIN IMMEDIATE.
+        """
+        rows = conn.execute(
+            "SELECT seq, key, payload, attempts FROM callback_journal AS j "
+            "WHERE (status = 'PENDING' OR (status = 'IN_PROGRESS' AND lease_until < ?)) "
+            "AND NOT EXISTS (SELECT 1 FROM callback_journal AS e WHERE e.key IS j.key AND e.seq < j.seq "
+            "AND e.status IN ('PENDING', 'IN_PROGRESS')) "
+            "ORDER BY seq LIMIT ?",
+            (now, DISPATCH_BATCH)
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            cur = conn.execute(
+                "UPDATE callback_journal SET status = 'IN_PROGRESS', owner = ?, lease_until = ? "
+                "WHERE seq = ? AND (status = 'PENDING' OR (status = 'IN_PROGRESS' AND lease_until < ?))",
+                (owner, now + LEASE_SECONDS, row[0], now)
+            )
+            if cur.rowcount == 1:
+                claimed.append(tuple(row))
+        return claimed
+
+    @staticmethod
+    def _renew(conn, owner, lease_until):
+        conn.execute(
+            "UPDATE callback_journal SET lease_until = ? WHERE owner = ? AND status = 'IN_PROGRESS'",
+            (lease_until, owner)
+        )
+
+    def _work(self, q):
+        while True:
+            seq, key, payload, attempts = q.get()
+            try:
+                self._apply_one(seq, key, json.loads(payload), attempts)
+            except Exception:
+                logger.exception("Callback journal worker failed on seq %s", seq)
+                self._release(seq)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    if self._in_flight == 0:
+                        self._idle.notify_all()
+                self._wake.set()  # the next callback for this key can be claimed now
+
+    def _release(self, seq):
+        """Put a claimed row back to PENDING; if even that fails, its lease runs out."""
+        try:
+            self.writer.run(
+                lambda conn, row: conn.execute(
+                    "UPDATE callback_journal SET status = 'PENDING', owner = NULL, lease_until = NULL "
+                    "WHERE seq = ? AND owner = ? AND status = 'IN_PROGRESS'", row
+                ),
+                (seq, self.owner)
+            )
+        except Exception:
+            logger.exception("Could not release callback journal seq %s", seq)
+
+    def _apply_one(self, seq, key, payload, attempts):
+        while True:
+            attempts += 1
+            try:
+                self.apply(payload)
+            except Exception as e:
+                logger.warning("Callback %s (seq %s) failed, attempt %s: %s", key, seq, attempts, e)
+                if attempts >= self.max_attempts:
+                    self._finish(seq, "FAILED", attempts, str(e))
+                    self.failed += 1
+                    return
+                # retry in place so later callbacks for this key keep waiting behind it
+                time.sleep(min(0.5 * 2 ** (attempts - 1), 5))
+                continue
+            self._finish(seq, "APPLIED", attempts, None)
+            self.applied += 1
+            return
+
+    def _finish(self, seq, status, attempts, error):
+        self.writer.run(
+            lambda conn, row: conn.execute(
+                "UPDATE callback_journal SET status = ?, attempts = ?, last_error = ?, applied_at = ?, "
+                "lease_until = NULL WHERE seq = ? AND owner = ?",
+                row
+            ),
+            (status, attempts, error, time.time(), seq, self.owner)
+        )
+
+    # ---- maintenance -------------------------------------------------
+
+    def prune(self, hours=RETENTION_HOURS):
+        self.writer.run(
+            lambda conn, cutoff: conn.execute(
+                "DELETE FROM callback_journal WHERE status = 'APPLIED' AND applied_at < ?", (cutoff,)
+            ),
+            time.time() - hours * 3600
+        )
+
+    def drain(self, timeout=30):
+        """Wait until everything journaled so far has been applied (tests, benchmarks, shutdown)."""
+        deadline = time.monotonic() + timeout
+        self._wake.set()
+        while True:
+            with self._lock:
+                if self._in_flight == 0 and self.pending() == 0:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(min(remaining, 0.05))
+
+    def pending(self):
+        """Rows not applied yet: PENDING, or IN_PROGRESS in this or another process."""
+        with self.pool.connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM callback_journal WHERE status IN ('PENDING', 'IN_PROGRESS')"
+            ).fetchone()[0]
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM callback_journal GROUP BY status").fetchall())
+        return {"pending": counts.get("PENDING", 0), "in_progress": counts.get("IN_PROGRESS", 0),
+                "failed": counts.get("FAILED", 0), "applied_total": self.applied, "in_flight": self._in_flight}
+
+
+callback_journal = CallbackJournal()
@@ -0,0 +1,119 @@
+import json
+
+# ============================================================
+# 🔹 Row change log (estack.db)
+# ------------------------------------------------------------
+# Triggers on the tracked tables append one row per INSERT / UPDATE /
+# DELETE to estack_changelog: the table, the operation, the rowid
+# and the new row as JSON. database_backup ships those rows to
+# Dropbox as small numbered segments instead of re-uploading the
+# whole file, and a restore replays them on top of the last full
+# base snapshot.
+#
+# seq is AUTOINCREMENT, so it never goes backwards even once shipped
+# rows are deleted, and sqlite_sequence holds the position of the
+# database: every change up to it is in the file. Replaying a change
+# fires the same triggers; the rows that produces are dropped again
+# (reset_after_replay), they are on Dropbox already.
+#
+# Derived tables (estack_tokens, estack_fts) are not tracked: their
+# own triggers rebuild them from the replayed rows. The triggers list
+# the columns the table has when they are installed; a migration that
+# adds a column to a tracked table must call install_triggers again.
+# ============================================================
+
+TRACKED_TABLES = ("estack_transactions", "notifications")
+
+
+def install_triggers(conn, tables=TRACKED_TABLES):
+    """(Re)create estack_changelog and the triggers that fill it."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS estack_changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            op TEXT NOT NULL,       -- 'I', 'U' or 'D'
+            row_id INTEGER NOT NULL,
+            data TEXT               -- json of the new row, NULL for a delete
+        )
+    """)
+    for table in tables:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+        if not columns:
+            raise ValueError(f"cannot track {table}: no such table")
+        row_json = "json_object(" + ", ".join(f"'{col}', NEW.{col}" for col in columns) + ")"
+        for op, event, values in (
+            ("I", "INSERT", f"'I', NEW.rowid, {row_json}"),
+            ("U", "UPDATE", f"'U', NEW.rowid, {row_json}"),
+            ("D", "DELETE", "'D', OLD.rowid, NULL"),
+        ):
+            name = f"{table}_changelog_{op.lower()}"
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"""
+                CREATE TRIGGER {name} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO estack_changelog (tbl, op, row_id, data) VALUES ('{table}', {values});
+                END
+            """)
+
+
+def has_changelog(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'estack_changelog'"
+    ).fetchone() is not None
+
+
+def position(conn):
+    """seq of the last change contained in this database (0 if none, or no change log)."""
+    if not has_changelog(conn):
+        return 0
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'estack_changelog'").fetchone()
+    return row[0] if row else 0
+
+
+def pending(conn, limit):
+    """Up to `limit` changes not shipped yet, oldest first, as [seq, tbl, op, row_id, data] lists."""
+    return [list(row) for row in conn.execute(
+        "SELECT seq, tbl, op, row_id, data FROM estack_changelog ORDER BY seq LIMIT ?", (limit,)
+    ).fetchall()]
+
+
+def mark_shipped(conn, last_seq):
+    conn.execute("DELETE FROM estack_changelog WHERE seq <= ?", (last_seq,))
+    conn.commit()
+
+
+def apply_changes(conn, changes, after):
+    """
+    Apply [seq, tbl, op, row_id, data] changes with seq > after, in
+    order, in the caller's transaction. Returns the last seq applied
+    (`after` if none was).
+    """
+    columns = {}  # table -> (column names, primary key column)
+    for seq, table, op, row_id, data in changes:
+        if seq <= after:
+            continue
+        if table not in columns:
+            info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+            columns[table] = ([row[1] for row in info], next(row[1] for row in info if row[5] == 1))
+        names, key = columns[table]
+        if op == "D":
+            conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (row_id,))
+        else:
+            row = json.loads(data)
+            cols = [col for col in names if col in row]
+            # An upsert on the primary key fires the INSERT or the UPDATE triggers, as the original write did
+            conn.execute(
+                f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                f"ON CONFLICT({key}) DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in cols)}",
+                [row[col] for col in cols]
+            )
+        after = seq
+    return after
+
+
+def reset_after_replay(conn, last_seq):
+    """Drop the log rows replaying produced and continue numbering after last_seq."""
+    conn.execute("DELETE FROM estack_changelog")
+    conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'estack_changelog'", (last_seq,))
+    if conn.execute("SELECT changes()").fetchone()[0] == 0:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('estack_changelog', ?)", (last_seq,))
@@ -1,6 +1,24 @@
 import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import timezone
 import dropbox
 
+try:
+    import fcntl
+except ImportError:  # not on Windows: restores and syncs are just not serialized across processes
+    fcntl = None
+
+import backup_artifact
+import changelog
+from db_pool import ESTACK_DB_PATH
+
 # ============================================================
 # 🔐 1️⃣ Environment Variables Required
 # ------------------------------------------------------------
@@ -11,7 +29,110 @@ import dropbox
 # ============================================================
 
 DBX_PATH = "/estack.db"
-LOCAL_DB = "estack.db"
+DBX_CHANGES = "/estack-changes"  # change segments, <first seq>-<last seq>.json
+LOCAL_DB = ESTACK_DB_PATH  # same file the app opens, whatever the cwd
+
+# ============================================================
+# 🔹 Restore policy (download_db)
+# ------------------------------------------------------------
+# RESTORE_POLICY=always   download and replace the local copy (default)
+#                newer    keep the local copy if it was modified after
+#                         the Dropbox one
+#                hash     a download whose content hash does not match
+#                         the metadata is rejected
+# Under every policy a local copy that already matches the Dropbox one
+# is kept (see the sync manifest below).
+# The file is downloaded next to estack.db and renamed over it, so a
+# failed download never leaves a half-written database. gunicorn
+# workers booting together take a file lock and only the first one
+# restores; the rest see it was restored during this boot and skip.
+# ============================================================
+RESTORE_POLICY = os.getenv("RESTORE_POLICY", "always").lower()
+DROPBOX_HASH_BLOCK = 4 * 1024 * 1024
+# Transfers stream in chunks of this size (a multiple of 4 MB, as upload
+# sessions expect), so memory stays flat however large estack.db gets and
+# uploads are not capped at the 150 MB single-request limit.
+DROPBOX_CHUNK = int(os.getenv("DROPBOX_CHUNK_MB", "8")) * 1024 * 1024
+# DROPBOX_COMPRESSION=off (default) | gzip | zstd | auto (zstd if the
+# zstandard package is installed, else gzip). Uploads are compressed
+# into a backup_artifact; restores read compressed and legacy
+# uncompressed uploads alike.
+DROPBOX_COMPRESSION = os.getenv("DROPBOX_COMPRESSION", "off")
+RESTORE_MARKER = LOCAL_DB + ".restored"  # touched after every restore attempt
+
+# ============================================================
+# 🔹 Sync manifest (estack.db.sync.json)
+# ------------------------------------------------------------
+# Records the Dropbox content hash and revision of the last upload or
+# download, the content hash of the uncompressed database (db_hash;
+# the same value unless the upload was compressed), plus the local
+# file's size / mtime after a download.
+#   upload_db   skips the upload when the snapshot's content hash
+#               equals the Dropbox one (directly, or via db_hash)
+#   download_db skips the download when the local file equals the
+#               Dropbox one: same revision and untouched since the last
+#               sync according to the manifest, or else same content hash
+# ============================================================
+SYNC_MANIFEST = LOCAL_DB + ".sync.json"
+
+# ============================================================
+# 🔹 Change shipping (sync_db)
+# ------------------------------------------------------------
+# With the row change log (changelog.py) in place, a sync uploads
+# only the changes since the last one, as a segment of a few hundred
+# bytes under DBX_CHANGES, instead of the whole database. A full base
+# (upload_db) goes out when there is none yet, every
+# DROPBOX_BASE_EVERY segments or DROPBOX_BASE_INTERVAL seconds, and
+# the segments it contains are deleted from Dropbox. A restore
+# downloads the base as before and replays the newer segments on top.
+# Changes stay in estack_changelog until a sync has shipped them.
+# Without Dropbox credentials there is nowhere to ship them: a sync
+# then drops them instead (a later first sync uploads a full base, as
+# the manifest has none or the log shows a gap) and reports success,
+# so the log does not grow and the sync loop does not retry forever.
+#
+# Every gunicorn worker syncs, so a sync (and a restore) holds a file
+# lock on estack.db.sync-lock: two workers never upload bases or
+# segments at the same time, and a base always holds at least the
+# changes of the one before it. base_seq and shipped_seq in the
+# manifest only move forward; a download starts a fresh manifest.
+#
+#   DROPBOX_SYNC_MODE       changes   changes: segments + periodic base
+#                                     full: whole database every sync
+#   DROPBOX_BASE_EVERY      500       segments between two bases
+#   DROPBOX_BASE_INTERVAL   86400     seconds between two bases
+#   DROPBOX_SEGMENT_ROWS    5000      changes per segment at most
+# ============================================================
+DROPBOX_SYNC_MODE = os.getenv("DROPBOX_SYNC_MODE", "changes").lower()
+DROPBOX_BASE_EVERY = int(os.getenv("DROPBOX_BASE_EVERY", "500"))
+DROPBOX_BASE_INTERVAL = float(os.getenv("DROPBOX_BASE_INTERVAL", "86400"))
+DROPBOX_SEGMENT_ROWS = int(os.getenv("DROPBOX_SEGMENT_ROWS", "5000"))
+SEGMENT_NAME = re.compile(r"^(\d+)-(\d+)\.json$")
+
+_restoring = threading.Event()
+_unconfigured_logged = False
+
+# ============================================================
+# 🔹 Upload snapshots
+# ------------------------------------------------------------
+# upload_db never reads estack.db itself: a write landing mid-read
+# would give a torn file. It copies the database with the SQLite
+# backup API into a temp file next to it, checks that copy and
+# uploads it. The copy runs SNAPSHOT_PAGES pages per step; each step
+# is a short read transaction, so writers (WAL) are never blocked.
+# If a writer commits between steps SQLite restarts the copy; after
+# SNAPSHOT_MAX_RESTARTS restarts the rest is copied in one step.
+# ============================================================
+SNAPSHOT_PAGES = int(os.getenv("SNAPSHOT_PAGES", "1024"))
+SNAPSHOT_MAX_RESTARTS = int(os.getenv("SNAPSHOT_MAX_RESTARTS", "3"))
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+class DropboxNotConfigured(ValueError):
+    """The Dropbox environment variables are not set."""
+
 
 def get_dbx():
     """Safely create Dropbox client using refresh token (auto-refresh forever)"""
@@ -20,7 +141,7 @@ def get_dbx():
     refresh_token = os.getenv("DROPBOX_REFRESH_TOKEN")
 
     if not all([app_key, app_secret, refresh_token]):
-        raise ValueError("❌ Missing one or more Dropbox environment variables.")
+        raise DropboxNotConfigured("❌ Missing one or more Dropbox environment variables.")
 
     dbx = dropbox.Dropbox(
         app_key=app_key,
@@ -30,31 +151,519 @@ def get_dbx():
     return dbx
 
 
+def checkpoint_db():
+    """
+    Fold the WAL back into estack.db so the file on disk holds every
+    committed transaction before it is hashed or dated for a restore.
+    """
+    if not os.path.exists(LOCAL_DB):
+        return
+    conn = sqlite3.connect(LOCAL_DB)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def snapshot_db(dest, source=LOCAL_DB, pages=SNAPSHOT_PAGES, max_restarts=SNAPSHOT_MAX_RESTARTS):
+    """
+    Write a transactionally consistent copy of `source` to `dest` with
+    the SQLite backup API and check it. Returns the number of times the
+    copy restarted because of concurrent writes. Raises ValueError if
+    the copy fails integrity_check.
+    """
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    restarts = 0
+    src = sqlite3.connect(source, timeout=30)
+    try:
+        dst = sqlite3.connect(dest)
+        try:
+            remaining_before = None
+
+            def progress(status, remaining, total):
+                nonlocal restarts, remaining_before
+                if remaining_before is not None and remaining > remaining_before:
+                    restarts += 1
+                    if restarts > max_restarts:
+                        raise _TooManyRestarts()
+                remaining_before = remaining
+
+            try:
+                src.backup(dst, pages=pages, progress=progress)
+            except _TooManyRestarts:
+                # Busy database: copy what is left under a single read transaction
+                src.backup(dst, pages=-1)
+
+            result = dst.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != "ok":
+                raise ValueError(f"snapshot failed integrity_check: {result}")
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return restarts
+
+
+def content_hash(chunks):
+    """Dropbox content_hash: sha256 of the concatenated sha256 of each 4 MB block."""
+    overall = hashlib.sha256()
+    for block in chunks:
+        overall.update(hashlib.sha256(block).digest())
+    return overall.hexdigest()
+
+
+def file_blocks(path):
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(DROPBOX_HASH_BLOCK)
+            if not block:
+                return
+            yield block
+
+
+def upload_file(dbx, path, dbx_path, chunk_size=DROPBOX_CHUNK):
+    """Upload a file in chunk_size pieces (one request if it fits in one)."""
+    mode = dropbox.files.WriteMode("overwrite")
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size <= chunk_size:
+            return dbx.files_upload(f.read(), dbx_path, mode=mode)
+        session = dbx.files_upload_session_start(f.read(chunk_size))
+        cursor = dropbox.files.UploadSessionCursor(session_id=session.session_id, offset=f.tell())
+        while size - f.tell() > chunk_size:
+            dbx.files_upload_session_append_v2(f.read(chunk_size), cursor)
+            cursor.offset = f.tell()
+        return dbx.files_upload_session_finish(f.read(), cursor, dropbox.files.CommitInfo(path=dbx_path, mode=mode))
+
+
+def download_file(dbx, dbx_path, path, chunk_size=DROPBOX_CHUNK):
+    """
+    Stream dbx_path into `path` (fsynced) and return (metadata, content
+    hash of what was written). A partial file is removed on failure.
+    """
+    metadata, res = dbx.files_download(dbx_path)
+    overall = hashlib.sha256()
+    pending = b""
+    try:
+        with open(path, "wb") as f:
+            for chunk in res.iter_content(chunk_size):
+                f.write(chunk)
+                pending += chunk
+                while len(pending) >= DROPBOX_HASH_BLOCK:
+                    overall.update(hashlib.sha256(pending[:DROPBOX_HASH_BLOCK]).digest())
+                    pending = pending[DROPBOX_HASH_BLOCK:]
+            if pending:
+                overall.update(hashlib.sha256(pending).digest())
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        res.close()
+    return metadata, overall.hexdigest()
+
+
+def read_manifest():
+    try:
+        with open(SYNC_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_manifest(**fields):
+    manifest = read_manifest()
+    for key in ("base_seq", "shipped_seq"):
+        # Positions never go backwards: a stale writer must not undo a newer base
+        if fields.get(key) is not None and manifest.get(key) is not None:
+            fields[key] = max(fields[key], manifest[key])
+    manifest.update(fields)
+    tmp_path = SYNC_MANIFEST + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, SYNC_MANIFEST)
+    return manifest
+
+
+def write_manifest(content_hash, rev, local_stat=None, db_hash=None):
+    """Record the Dropbox base copy (see the sync manifest above)."""
+    return update_manifest(
+        content_hash=content_hash,
+        rev=rev,
+        db_hash=db_hash or content_hash,
+        size=local_stat.st_size if local_stat else None,
+        mtime=local_stat.st_mtime if local_stat else None,
+        synced_at=time.time(),
+    )
+
+
+def _remote_metadata(dbx):
+    """Dropbox metadata of DBX_PATH, or None if there is no file there yet."""
+    try:
+        return dbx.files_get_metadata(DBX_PATH)
+    except dropbox.exceptions.ApiError:
+        return None
+
+
+def _local_matches(remote):
+    """
+    True if estack.db holds the Dropbox copy described by `remote`,
+    or that copy plus changes already shipped as segments (and maybe
+    some not shipped yet).
+    """
+    manifest = read_manifest()
+    stat = os.stat(LOCAL_DB)
+    if manifest.get("rev") and manifest["rev"] == getattr(remote, "rev", None):
+        if (manifest.get("size"), manifest.get("mtime")) == (stat.st_size, stat.st_mtime):
+            return True
+        if manifest.get("base_seq") is not None and _position(LOCAL_DB) >= manifest.get("shipped_seq", 0):
+            return True
+    checkpoint_db()
+    return _same_content(content_hash(file_blocks(LOCAL_DB)), remote, manifest)
+
+
+def _same_content(db_hash, remote, manifest):
+    """Does the Dropbox copy hold the database whose content hash is db_hash?"""
+    if db_hash == remote.content_hash:
+        return True
+    # A compressed upload: the remote hash is of the artifact
+    return manifest.get("content_hash") == remote.content_hash and manifest.get("db_hash") == db_hash
+
+
+def _restore_lock():
+    return _file_lock(LOCAL_DB + ".restore-lock")
+
+
+def _sync_lock():
+    return _file_lock(LOCAL_DB + ".sync-lock")
+
+
+@contextmanager
+def _file_lock(path):
+    with open(path, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
 def upload_db():
-    """Upload local estack.db to Dropbox"""
+    """
+    Upload local estack.db to Dropbox. Returns True if Dropbox now holds
+    it (uploaded, or already identical).
+    """
+    with _sync_lock():
+        return _upload_db()
+
+
+def _upload_db():
+    if _restoring.is_set():
+        print("⚠️ estack.db is being restored; upload skipped so the Dropbox copy is not overwritten.")
+        return False
+    fd, snapshot = tempfile.mkstemp(prefix="estack-", suffix=".snapshot", dir=os.path.dirname(LOCAL_DB) or ".")
+    os.close(fd)
+    artifact = snapshot + ".z"
     try:
         dbx = get_dbx()
-        with open(LOCAL_DB, "rb") as f:
-            dbx.files_upload(f.read(), DBX_PATH, mode=dropbox.files.WriteMode("overwrite"))
-        print("✅ estack.db uploaded to Dropbox.")
+        codec = backup_artifact.resolve_codec(DROPBOX_COMPRESSION)
+        snapshot_db(snapshot)
+        db_hash = content_hash(file_blocks(snapshot))
+        base_seq = _position(snapshot)
+        manifest = read_manifest()
+        remote = _remote_metadata(dbx)
+        if remote is not None and _same_content(db_hash, remote, manifest):
+            write_manifest(remote.content_hash, remote.rev, db_hash=db_hash)
+            _based(dbx, base_seq)
+            print("✅ estack.db unchanged since the last sync; upload skipped.")
+            return True
+
+        if codec:
+            backup_artifact.pack(snapshot, artifact, codec)
+        else:
+            artifact = snapshot
+        uploaded = upload_file(dbx, artifact, DBX_PATH)
+        artifact_hash = content_hash(file_blocks(artifact)) if codec else db_hash
+        write_manifest(artifact_hash, getattr(uploaded, "rev", None), db_hash=db_hash)
+        _based(dbx, base_seq)
+        if codec:
+            print(f"✅ estack.db uploaded to Dropbox ({codec}, {os.path.getsize(snapshot)} → "
+                  f"{os.path.getsize(artifact)} bytes).")
+        else:
+            print("✅ estack.db uploaded to Dropbox.")
+        return True
     except FileNotFoundError:
         print("⚠️ Local estack.db not found for upload.")
     except Exception as e:
         print("❌ Dropbox upload failed:", e)
+    finally:
+        for path in {snapshot, artifact}:
+            if os.path.exists(path):
+                os.remove(path)
+    return False
+
+
+def _position(path):
+    conn = sqlite3.connect(path)
+    try:
+        return changelog.position(conn)
+    finally:
+        conn.close()
+
+
+def _based(dbx, base_seq):
+    """A base holding every change up to base_seq is on Dropbox: drop what it supersedes."""
+    update_manifest(base_seq=base_seq, base_at=time.time(), segments=0, segment_bytes=0, shipped_seq=base_seq)
+    conn = sqlite3.connect(LOCAL_DB, timeout=30)
+    try:
+        if changelog.has_changelog(conn):
+            changelog.mark_shipped(conn, base_seq)
+    finally:
+        conn.close()
+    # Best effort: a segment left behind is just skipped by the next restore
+    try:
+        for first, last, path in _list_segments(dbx):
+            if last <= base_seq:
+                dbx.files_delete_v2(path)
+    except Exception as e:
+        print("⚠️ Could not delete old change segments from Dropbox:", e)
+
+
+def _list_segments(dbx):
+    """[(first seq, last seq, path)] of the change segments on Dropbox, by first seq."""
+    try:
+        result = dbx.files_list_folder(DBX_CHANGES)
+    except dropbox.exceptions.ApiError:
+        return []
+    entries = list(result.entries)
+    while result.has_more:
+        result = dbx.files_list_folder_continue(result.cursor)
+        entries.extend(result.entries)
+    segments = []
+    for entry in entries:
+        match = SEGMENT_NAME.match(entry.name)
+        if match:
+            segments.append((int(match.group(1)), int(match.group(2)), f"{DBX_CHANGES}/{entry.name}"))
+    return sorted(segments)
 
 
-def download_db():
-    """Download estack.db from Dropbox (run on app startup)"""
+def _base_due(conn):
+    if DROPBOX_SYNC_MODE == "full" or not changelog.has_changelog(conn):
+        return True
+    manifest = read_manifest()
+    if manifest.get("base_seq") is None:
+        return True
+    return manifest.get("segments", 0) >= DROPBOX_BASE_EVERY \
+        or time.time() - manifest.get("base_at", 0) >= DROPBOX_BASE_INTERVAL
+
+
+def sync_db():
+    """
+    Bring Dropbox up to date with estack.db: ship the changes since the
+    last sync as segments, or upload a full base when one is due.
+    Returns True on success.
+    """
+    if _restoring.is_set():
+        print("⚠️ estack.db is being restored; sync skipped so the Dropbox copy is not overwritten.")
+        return False
+    if not os.path.exists(LOCAL_DB):
+        print("⚠️ Local estack.db not found for upload.")
+        return False
+    with _sync_lock():
+        conn = sqlite3.connect(LOCAL_DB, timeout=30)
+        try:
+            try:
+                get_dbx()
+            except DropboxNotConfigured:
+                _drop_unshipped(conn)
+                return True
+            if _base_due(conn):
+                conn.close()
+                return _upload_db()
+            return _ship_changes(conn)
+        finally:
+            conn.close()
+
+
+def _drop_unshipped(conn):
+    global _unconfigured_logged
+    if not _unconfigured_logged:
+        print("⚠️ Dropbox is not configured; estack.db changes are not backed up.")
+        _unconfigured_logged = True
+    if changelog.has_changelog(conn):
+        changelog.mark_shipped(conn, changelog.position(conn))
+
+
+def _ship_changes(conn):
+    try:
+        dbx = get_dbx()
+        shipped = shipped_bytes = 0
+        while True:
+            changes = changelog.pending(conn, DROPBOX_SEGMENT_ROWS)
+            if not changes:
+                break
+            manifest = read_manifest()
+            first, last = changes[0][0], changes[-1][0]
+            if first > max(manifest.get("base_seq") or 0, manifest.get("shipped_seq") or 0) + 1:
+                # Changes went missing (e.g. the log was cleared): only a new base is safe
+                print("⚠️ Change log has a gap; uploading a full base instead.")
+                return _upload_db()
+            payload = json.dumps({"first": first, "last": last, "changes": changes},
+                                 separators=(",", ":")).encode()
+            dbx.files_upload(payload, f"{DBX_CHANGES}/{first:012d}-{last:012d}.json",
+                             mode=dropbox.files.WriteMode("overwrite"))
+            changelog.mark_shipped(conn, last)
+            update_manifest(shipped_seq=last, segments=manifest.get("segments", 0) + 1,
+                            segment_bytes=manifest.get("segment_bytes", 0) + len(payload))
+            shipped += len(changes)
+            shipped_bytes += len(payload)
+        if shipped:
+            print(f"✅ Shipped {shipped} estack.db changes to Dropbox ({shipped_bytes} bytes).")
+        return True
+    except Exception as e:
+        print("❌ Dropbox change shipping failed:", e)
+        return False
+
+
+def replay_changes(dbx, new_base=False):
+    """
+    Apply the Dropbox change segments newer than estack.db, in one
+    transaction. Returns the number of changes applied; on failure
+    nothing is applied and the database stays as it was. new_base:
+    estack.db was just downloaded, so its position is the Dropbox base.
+    """
+    try:
+        return _replay_changes(dbx, new_base)
+    except Exception as e:
+        print("❌ Replaying Dropbox change segments failed:", e)
+        return 0
+
+
+def _replay_changes(dbx, new_base):
+    conn = sqlite3.connect(LOCAL_DB, timeout=30)
+    try:
+        if not changelog.has_changelog(conn):
+            return 0
+        start = position = changelog.position(conn)
+        replayed = 0
+        for first, last, path in _list_segments(dbx):
+            if last <= position:
+                continue
+            if first > position + 1:
+                print(f"⚠️ Change segments missing after seq {position}; estack.db restored up to there.")
+                break
+            _, res = dbx.files_download(path)
+            try:
+                segment = json.loads(res.content)
+            finally:
+                res.close()
+            position = changelog.apply_changes(conn, segment["changes"], position)
+            replayed += 1
+        if position > start:
+            changelog.reset_after_replay(conn, position)
+        conn.commit()
+    finally:
+        conn.close()
+
+    fields = {"shipped_seq": position}
+    if new_base:
+        fields.update(base_seq=start, base_at=time.time(), segments=replayed, segment_bytes=0)
+    elif replayed:
+        fields["segments"] = read_manifest().get("segments", 0) + replayed
+    if position > start:
+        # The file now differs from the base: record it so the next boot still skips the download
+        checkpoint_db()
+        stat = os.stat(LOCAL_DB)
+        fields.update(size=stat.st_size, mtime=stat.st_mtime)
+        print(f"✅ Replayed {position - start} estack.db changes from {replayed} Dropbox segments.")
+    update_manifest(**fields)
+    return position - start
+
+
+def download_db(policy=RESTORE_POLICY, boot_started=None):
+    """
+    Restore estack.db from Dropbox (run on app startup; nothing may have
+    it open). Returns the outcome: "downloaded", "skipped-newer",
+    "skipped-same-hash", "skipped-restored-this-boot", "missing",
+    "rejected" or "failed".
+    boot_started: when this process started booting; if another worker
+    restored after that, the restore is skipped.
+    """
+    _restoring.set()
+    try:
+        with _restore_lock(), _sync_lock():
+            if boot_started is not None and os.path.exists(RESTORE_MARKER) \
+                    and os.path.getmtime(RESTORE_MARKER) >= boot_started:
+                print("✅ estack.db was already restored by another worker during this boot.")
+                return "skipped-restored-this-boot"
+            outcome = _restore(policy)
+            with open(RESTORE_MARKER, "a"):
+                os.utime(RESTORE_MARKER)
+            return outcome
+    finally:
+        _restoring.clear()
+
+
+def _restore(policy):
     try:
         dbx = get_dbx()
-        metadata, res = dbx.files_download(DBX_PATH)
-        with open(LOCAL_DB, "wb") as f:
-            f.write(res.content)
+        if os.path.exists(LOCAL_DB):
+            remote = dbx.files_get_metadata(DBX_PATH)
+            if policy == "newer":
+                checkpoint_db()
+                remote_mtime = remote.server_modified.replace(tzinfo=timezone.utc).timestamp()
+                if os.path.getmtime(LOCAL_DB) >= remote_mtime:
+                    print("✅ Local estack.db is newer than the Dropbox copy; restore skipped.")
+                    return "skipped-newer"
+            if _local_matches(remote):
+                print("✅ Local estack.db matches the Dropbox copy; restore skipped.")
+                replay_changes(dbx)
+                return "skipped-same-hash"
+
+        tmp_path = LOCAL_DB + ".download"
+        metadata, downloaded_hash = download_file(dbx, DBX_PATH, tmp_path)
+        if policy == "hash" and downloaded_hash != metadata.content_hash:
+            os.remove(tmp_path)
+            print("❌ Downloaded estack.db does not match its Dropbox content hash; keeping the local copy.")
+            return "rejected"
+
+        db_hash = downloaded_hash
+        if backup_artifact.read_header(tmp_path) is not None:
+            restored = LOCAL_DB + ".restore"
+            try:
+                codec = backup_artifact.unpack(tmp_path, restored)
+            except BaseException:
+                if os.path.exists(restored):
+                    os.remove(restored)
+                raise
+            finally:
+                os.remove(tmp_path)
+            tmp_path = restored
+            db_hash = content_hash(file_blocks(restored))
+            print(f"✅ Decompressed the {codec} backup of estack.db.")
+
+        # A WAL left over from the old file must not be replayed onto the new one
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(LOCAL_DB + suffix):
+                os.remove(LOCAL_DB + suffix)
+        os.replace(tmp_path, LOCAL_DB)
+        if os.path.exists(SYNC_MANIFEST):
+            os.remove(SYNC_MANIFEST)  # it described the file just replaced
+        write_manifest(downloaded_hash, getattr(metadata, "rev", None), os.stat(LOCAL_DB), db_hash=db_hash)
         print("✅ estack.db downloaded from Dropbox.")
+        replay_changes(dbx, new_base=True)
+        return "downloaded"
     except dropbox.exceptions.ApiError:
         print("⚠️ No existing estack.db found in Dropbox (starting fresh).")
+        return "missing"
     except Exception as e:
         print("❌ Dropbox download failed:", e)
+        return "failed"
 
 
 # import os
@@ -0,0 +1,206 @@
+import os
+import queue
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 SQLite connection manager
+# ------------------------------------------------------------
+# One pool per database file. Connections are opened once, get
+# their pragmas applied once, keep a larger prepared-statement
+# cache, and are reused across requests instead of paying
+# sqlite3.connect() on every handler call.
+#
+# Paths can be overridden with ESTACK_DB_PATH / TRANSACTIONS_DB_PATH.
+#
+# Pragmas (applied to every new connection, journal_mode first):
+#   SQLITE_JOURNAL_MODE   WAL      readers no longer block on callback writes
+#   SQLITE_SYNCHRONOUS    NORMAL   safe with WAL; FULL fsyncs every commit
+#   SQLITE_BUSY_TIMEOUT   5000     ms to wait on a lock before "database is locked"
+#   SQLITE_CACHE_SIZE     -16000   page cache (negative = KiB, so ~16 MB)
+#   SQLITE_MMAP_SIZE      134217728  bytes of the file read through mmap
+#   SQLITE_TEMP_STORE     MEMORY   temp tables / sorts stay off disk
+# Each can be set per database with an ESTACK_ / TRANSACTIONS_ prefix,
+# e.g. TRANSACTIONS_SQLITE_SYNCHRONOUS=FULL.
+#
+# Each database also has a read-only pool (file:...?mode=ro plus
+# PRAGMA query_only) sized by SQLITE_READ_POOL_SIZE. GET handlers read
+# through it, so polling traffic never takes a write lock and never
+# queues behind callback writes.
+#
+# A pool can be put on hold (hold() / resume()): acquire() then waits
+# until it is resumed, except on the thread that holds it. Startup
+# uses this so nothing opens estack.db while it is being restored.
+# ============================================================
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ESTACK_DB_PATH = os.getenv("ESTACK_DB_PATH", os.path.join(BASE_DIR, "estack.db"))
+TRANSACTIONS_DB_PATH = os.getenv("TRANSACTIONS_DB_PATH", os.path.join(BASE_DIR, "transactions.db"))
+
+STATEMENT_CACHE_SIZE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "16"))
+HOLD_TIMEOUT = float(os.getenv("SQLITE_HOLD_TIMEOUT", "600"))  # s acquire() waits on a held pool
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -16000,
+    "mmap_size": 134217728,
+    "temp_store": "MEMORY",
+}
+
+# Only meaningful for (and only allowed on) a connection that can write.
+WRITE_PRAGMAS = ("journal_mode", "synchronous")
+
+
+def pragmas_from_env(prefix=""):
+    """DEFAULT_PRAGMAS overridden by SQLITE_<NAME> and then <prefix>SQLITE_<NAME>."""
+    pragmas = {}
+    for name, default in DEFAULT_PRAGMAS.items():
+        key = f"SQLITE_{name.upper()}"
+        pragmas[name] = os.getenv(f"{prefix}{key}", os.getenv(key, default))
+    return pragmas
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that belongs to a pool. close() only rolls back
+    anything uncommitted (what a real close would discard); the handle
+    goes back to the pool when its owner releases it (request teardown
+    or the end of pool.connection()). Existing handler code that calls
+    db.close() therefore keeps working unchanged.
+    """
+
+    pool = None
+    idle = False
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        if self.in_transaction:
+            self.rollback()
+
+    def real_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, path, pragmas=None, size=POOL_SIZE, cached_statements=STATEMENT_CACHE_SIZE, name=None,
+                 readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.pragmas = dict(pragmas_from_env() if pragmas is None else pragmas)
+        self.size = size
+        self.cached_statements = cached_statements
+        self.name = name or os.path.basename(path)
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._open = threading.Event()
+        self._open.set()
+        self._holder = None
+        self.opened = 0
+
+    def _connect(self):
+        target = f"file:{pathname2url(self.path)}?mode=ro" if self.readonly else self.path
+        conn = sqlite3.connect(
+            target,
+            timeout=int(self.pragmas.get("busy_timeout", 5000)) / 1000,
+            factory=PooledConnection,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,  # a connection is only ever used by one request at a time
+            uri=self.readonly,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma, value in self.pragmas.items():
+            if self.readonly and pragma in WRITE_PRAGMAS:
+                continue
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        conn.pool = self
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def _check_fork(self):
+        # gunicorn forks workers after import: never share a handle with the parent.
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._idle = queue.LifoQueue()
+                    self._pid = os.getpid()
+
+    def hold(self):
+        """Make acquire() wait until resume(), on every thread but the calling one."""
+        self._holder = threading.get_ident()
+        self._open.clear()
+
+    def resume(self):
+        self._holder = None
+        self._open.set()
+
+    @property
+    def held(self):
+        return not self._open.is_set()
+
+    def acquire(self):
+        """Check out a connection (reused if one is idle, otherwise opened)."""
+        self._check_fork()
+        if not self._open.is_set() and threading.get_ident() != self._holder:
+            if not self._open.wait(HOLD_TIMEOUT):
+                raise sqlite3.OperationalError(f"{self.name} database is on hold (restore still running)")
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        conn.idle = False
+        return conn
+
+    def release(self, conn):
+        """Return a connection; an open transaction is rolled back first."""
+        if conn.pool is not self or conn.idle:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.real_close()
+            return
+        if os.getpid() == self._pid and self._idle.qsize() < self.size:
+            conn.idle = True
+            self._idle.put(conn)
+        else:
+            conn.real_close()
+
+    @contextmanager
+    def connection(self):
+        """Connection for code outside a Flask request (boot, background threads)."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().real_close()
+            except queue.Empty:
+                return
+
+
+estack_db = ConnectionPool(ESTACK_DB_PATH, pragmas=pragmas_from_env("ESTACK_"), name="estack")
+transactions_db = ConnectionPool(TRANSACTIONS_DB_PATH, pragmas=pragmas_from_env("TRANSACTIONS_"), name="transactions")
+
+estack_read_db = ConnectionPool(ESTACK_DB_PATH, pragmas=pragmas_from_env("ESTACK_"), size=READ_POOL_SIZE,
+                                name="estack-ro", readonly=True)
+transactions_read_db = ConnectionPool(TRANSACTIONS_DB_PATH, pragmas=pragmas_from_env("TRANSACTIONS_"),
+                                      size=READ_POOL_SIZE, name="transactions-ro", readonly=True)
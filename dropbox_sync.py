@@ -0,0 +1,178 @@
+import os
+import time
+import atexit
+import threading
+import logging
+
+import database_backup
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 Debounced background Dropbox sync
+# ------------------------------------------------------------
+# Writers call mark_dirty() after changing estack.db instead of
+# uploading it inline. One thread per process coalesces those
+# signals and uploads:
+#   - once no new change has arrived for DEBOUNCE seconds, or once
+#     the oldest pending change is MAX_LAG seconds old, whichever
+#     comes first (a steady stream of callbacks still gets synced);
+#   - never sooner than INTERVAL seconds after the previous upload.
+# A change that arrives during an upload marks the database dirty
+# again, so it goes out with the next one. A failed upload is retried
+# after INTERVAL. Pending changes are flushed at interpreter exit.
+# An upload is database_backup.sync_db: usually a small segment of
+# row changes, now and then a full base (see database_backup.py).
+#
+#   DROPBOX_SYNC_DEBOUNCE   2     seconds of quiet before uploading
+#   DROPBOX_SYNC_INTERVAL   30    minimum seconds between uploads
+#   DROPBOX_SYNC_MAX_LAG    60    a change waits at most this long (plus INTERVAL)
+# ============================================================
+
+DEBOUNCE = float(os.getenv("DROPBOX_SYNC_DEBOUNCE", "2"))
+INTERVAL = float(os.getenv("DROPBOX_SYNC_INTERVAL", "30"))
+MAX_LAG = float(os.getenv("DROPBOX_SYNC_MAX_LAG", "60"))
+FLUSH_TIMEOUT = 30
+
+
+def _upload():
+    # Looked up on every call so database_backup.sync_db can be swapped (tests, benchmarks)
+    return database_backup.sync_db()
+
+
+class DropboxSync:
+    def __init__(self, upload=_upload, debounce=DEBOUNCE, interval=INTERVAL, max_lag=MAX_LAG, name="dropbox-sync"):
+        self.upload = upload
+        self.debounce = max(0.0, debounce)
+        self.interval = max(0.0, interval)
+        self.max_lag = max(0.0, max_lag)
+        self.name = name
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._dirty_since = None   # monotonic time of the oldest change not uploaded yet
+        self._last_signal = None
+        self._last_upload_started = None
+        self._uploading = False
+        # metrics (wall clock where they are reported as timestamps)
+        self.signals = 0
+        self.uploads = 0
+        self.failures = 0
+        self.last_sync_at = None
+        self.last_sync_seconds = None
+        self.last_lag_seconds = None
+        self.last_error = None
+
+    # ---- public API --------------------------------------------------
+
+    def mark_dirty(self):
+        """Record that estack.db changed; returns immediately."""
+        self._ensure_worker()
+        now = time.monotonic()
+        with self._cond:
+            self.signals += 1
+            self._last_signal = now
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._cond.notify()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """Upload pending changes now (ignoring debounce / interval); True once nothing is pending."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._uploading:
+                if not self._cond.wait(max(0.0, deadline - time.monotonic())):
+                    return False
+            if self._dirty_since is None:
+                return True
+            self._uploading = True
+            dirty_since, self._dirty_since = self._dirty_since, None
+        return self._upload_once(dirty_since)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            lag = now - self._dirty_since if self._dirty_since is not None else 0.0
+            return {
+                "pending": self._dirty_since is not None,
+                "lag_seconds": round(lag, 3),
+                "last_sync_at": self.last_sync_at,
+                "seconds_since_sync": round(time.time() - self.last_sync_at, 3) if self.last_sync_at else None,
+                "last_sync_seconds": self.last_sync_seconds,
+                "last_lag_seconds": self.last_lag_seconds,
+                "signals": self.signals,
+                "uploads": self.uploads,
+                "coalesced": max(0, self.signals - self.uploads),
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
+
+    # ---- worker thread -----------------------------------------------
+
+    def _ensure_worker(self):
+        # Started lazily so a gunicorn worker gets its own thread after fork.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _due(self, now):
+        """Monotonic time the pending changes should go out (caller holds the lock)."""
+        due = min(self._last_signal + self.debounce, self._dirty_since + self.max_lag)
+        if self._last_upload_started is not None:
+            due = max(due, self._last_upload_started + self.interval)
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._dirty_since is None or self._uploading:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = self._due(now)
+                if now < due:
+                    self._cond.wait(due - now)  # a new signal may push the deadline out
+                    continue
+                self._uploading = True
+                dirty_since, self._dirty_since = self._dirty_since, None
+            self._upload_once(dirty_since)
+
+    def _upload_once(self, dirty_since):
+        started = time.monotonic()
+        try:
+            ok = self.upload() is not False
+            error = None if ok else "sync_db reported a failure"
+        except Exception as e:
+            ok, error = False, str(e)
+        finished = time.monotonic()
+
+        with self._cond:
+            self._uploading = False
+            self._last_upload_started = started
+            if ok:
+                self.uploads += 1
+                self.last_sync_at = time.time()
+                self.last_sync_seconds = round(finished - started, 3)
+                self.last_lag_seconds = round(finished - dirty_since, 3)
+            else:
+                self.failures += 1
+                self.last_error = error
+                logger.warning("Dropbox sync failed, retrying in %.1fs: %s", self.interval, error)
+                # keep the older timestamp: those changes are still not uploaded
+                if self._dirty_since is None or dirty_since < self._dirty_since:
+                    self._dirty_since = dirty_since
+                    self._last_signal = self._last_signal or dirty_since
+            self._cond.notify_all()
+        return ok
+
+
+dropbox_sync = DropboxSync()
+
+
+@atexit.register
+def _flush_at_exit():
+    if dropbox_sync._dirty_since is not None:
+        dropbox_sync.flush()
@@ -0,0 +1,368 @@
+import re
+import logging
+
+from transaction_parser import parse_name, parse_transaction
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 Structured eStack columns
+# ------------------------------------------------------------
+# name_of_transaction used to be the only place eStack ids lived,
+# e.g. "ZMW1000 | user_12 | <deposit uuid> | Borrower:2609...".
+# These columns hold the same values so lookups can use an index
+# instead of LIKE '%id%'. name_of_transaction is still written
+# for display and for older clients.
+# ============================================================
+
+ESTACK_COLUMNS = {
+    "kind": "TEXT",            # INVESTMENT, LOAN or UNKNOWN
+    "amount": "REAL",
+    "currency": "TEXT",
+    "user_id": "TEXT",
+    "deposit_id": "TEXT",      # investment / deposit id (also set on LOAN rows)
+    "loan_id": "TEXT",
+    "borrower_phone": "TEXT",
+}
+
+
+def estack_fields(name_of_transaction, cached=True):
+    """
+    Structured column values for a name_of_transaction string (see
+    transaction_parser for the formats). cached=False skips the LRU,
+    for one-off bulk passes that would only evict useful entries.
+    """
+    parse = parse_transaction if cached else parse_name
+    return parse(name_of_transaction).as_columns()
+
+
+def insert_estack_transaction(cur, name_of_transaction, status):
+    """Insert an eStack row with both the display string and its structured columns."""
+    fields = estack_fields(name_of_transaction)
+    cols = ", ".join(ESTACK_COLUMNS)
+    marks = ", ".join("?" for _ in ESTACK_COLUMNS)
+    cur.execute(
+        f"INSERT INTO estack_transactions (name_of_transaction, status, {cols}) VALUES (?, ?, {marks})",
+        (name_of_transaction, status, *fields.values())
+    )
+    return cur.lastrowid
+
+
+def ensure_estack_schema(conn):
+    """
+    Create estack_transactions if missing, add any structured column an
+    older database lacks, and index every structured column.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS estack_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_of_transaction TEXT NOT NULL,  -- e.g. "K1000 | user_123 | DEP4567"
+            status TEXT NOT NULL,               -- e.g. "invested", "loaned_out", "repaid"
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    cur.execute("PRAGMA table_info(estack_transactions)")
+    existing_cols = [r[1] for r in cur.fetchall()]
+
+    for col, coltype in ESTACK_COLUMNS.items():
+        if col not in existing_cols:
+            try:
+                cur.execute(f"ALTER TABLE estack_transactions ADD COLUMN {col} {coltype}")
+                logger.info("Added column %s to estack_transactions table", col)
+            except Exception:
+                logger.warning("Could not add column %s (may already exist)", col)
+
+    for col in ESTACK_COLUMNS:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_estack_{col} ON estack_transactions ({col})")
+
+    conn.commit()
+
+
+def ensure_estack_unique_keys(conn):
+    """
+    One INVESTMENT row per deposit_id, enforced by a partial unique index
+    so callbacks can upsert on it (see upserts.py). Run after the backfill:
+    rows without structured columns are outside the index anyway.
+
+    Duplicates left by the old LIKE lookups are merged first: the oldest
+    row is kept and takes the newest row's name_of_transaction, status
+    and structured columns (so e.g. a Borrower suffix added later
+    survives), the rest are deleted (loans point at deposit_id, not
+    rowid). Every merge is logged with the rowids involved.
+    """
+    cur = conn.cursor()
+    merged = ("name_of_transaction", "status", *ESTACK_COLUMNS)
+    dupes = cur.execute("""
+        SELECT deposit_id, MIN(rowid) AS keep, MAX(rowid) AS newest FROM estack_transactions
+        WHERE kind = 'INVESTMENT' AND deposit_id IS NOT NULL
+        GROUP BY deposit_id HAVING COUNT(*) > 1
+    """).fetchall()
+    for deposit_id, keep, newest in dupes:
+        cur.execute(
+            f"UPDATE estack_transactions SET ({', '.join(merged)}) = "
+            f"(SELECT {', '.join(merged)} FROM estack_transactions WHERE rowid = ?) WHERE rowid = ?",
+            (newest, keep)
+        )
+        deleted = [row[0] for row in cur.execute(
+            "SELECT rowid FROM estack_transactions WHERE deposit_id = ? AND kind = 'INVESTMENT' AND rowid != ?",
+            (deposit_id, keep)
+        ).fetchall()]
+        cur.execute(
+            "DELETE FROM estack_transactions WHERE deposit_id = ? AND kind = 'INVESTMENT' AND rowid != ?",
+            (deposit_id, keep)
+        )
+        logger.warning("Duplicate INVESTMENT rows for deposit %s: kept rowid %s with the name and status of "
+                       "rowid %s, deleted rowids %s.", deposit_id, keep, newest, deleted)
+    if dupes:
+        logger.warning("Merged duplicate INVESTMENT rows for %d deposit ids.", len(dupes))
+
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_estack_investment_deposit
+        ON estack_transactions (deposit_id) WHERE kind = 'INVESTMENT'
+    """)
+    conn.commit()
+
+
+def backfill_estack_columns(conn, chunk_size=5000):
+    """
+    Online migration: parse name_of_transaction for rows that have no
+    structured columns yet. Works in rowid order and commits per chunk,
+    so writers only ever wait for one chunk. Safe to re-run; rows that
+    are already filled are skipped.
+    """
+    cur = conn.cursor()
+    last_rowid = 0
+    total = 0
+
+    while True:
+        rows = cur.execute(
+            """
+            SELECT rowid, name_of_transaction FROM estack_transactions
+            WHERE kind IS NULL AND rowid > ?
+            ORDER BY rowid LIMIT ?
+            """,
+            (last_rowid, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        assignments = ", ".join(f"{col} = ?" for col in ESTACK_COLUMNS)
+        cur.executemany(
+            f"UPDATE estack_transactions SET {assignments} WHERE rowid = ?",
+            [(*estack_fields(name, cached=False).values(), rowid) for rowid, name in rows]
+        )
+        conn.commit()
+
+        last_rowid = rows[-1][0]
+        total += len(rows)
+
+    if total:
+        logger.info("Backfilled %d estack_transactions rows with structured columns.", total)
+    return total
+
+
+# ============================================================
+# 🔹 Token inverted index
+# ------------------------------------------------------------
+# estack_tokens maps every "|" / ":" separated piece of
+# name_of_transaction (user ids, deposit / loan uuids, phones) to
+# the row it came from, so "every row mentioning X" is an indexed
+# equality join instead of LIKE '%X%' (which also made user_1
+# match user_12). Triggers keep it current in plain SQL, so writes
+# from any connection (including the sqlite3 shell) stay indexed.
+# ============================================================
+
+def _token_select(name, rowid):
+    """SELECT producing (token, rowid) pairs for one name_of_transaction expression."""
+    # json_quote escapes quotes, backslashes and every control character, and
+    # none of its escapes contain ":" or "|", so splitting the quoted string
+    # on them still gives valid JSON strings. TAB / LF / CR become spaces first.
+    as_json = (
+        f"""'[' || replace(replace(json_quote(replace(replace(replace({name},"""
+        """ char(9), ' '), char(10), ' '), char(13), ' ')), ':', '","'), '|', '","') || ']'"""
+    )
+    return (
+        f"SELECT DISTINCT trim(j.value), {rowid} FROM json_each({as_json}) AS j "
+        f"WHERE trim(j.value) != ''"
+    )
+
+
+def ensure_estack_tokens(conn):
+    """Create the token table and the triggers that maintain it."""
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS estack_tokens (
+            token TEXT NOT NULL,
+            txn_rowid INTEGER NOT NULL,
+            PRIMARY KEY (token, txn_rowid)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_estack_tokens_rowid ON estack_tokens (txn_rowid)")
+
+    # Recreated every time so a database gets the current tokenizer (see migration 4)
+    for trigger in ("estack_tokens_ai", "estack_tokens_au", "estack_tokens_ad"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cur.execute(f"""
+        CREATE TRIGGER estack_tokens_ai AFTER INSERT ON estack_transactions
+        BEGIN
+            INSERT OR IGNORE INTO estack_tokens (token, txn_rowid)
+            {_token_select("new.name_of_transaction", "new.rowid")};
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER estack_tokens_au AFTER UPDATE OF name_of_transaction ON estack_transactions
+        BEGIN
+            DELETE FROM estack_tokens WHERE txn_rowid = old.rowid;
+            INSERT OR IGNORE INTO estack_tokens (token, txn_rowid)
+            {_token_select("new.name_of_transaction", "new.rowid")};
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER estack_tokens_ad AFTER DELETE ON estack_transactions
+        BEGIN
+            DELETE FROM estack_tokens WHERE txn_rowid = old.rowid;
+        END
+    """)
+    conn.commit()
+
+
+def rebuild_estack_tokens(conn):
+    """Repopulate estack_tokens from scratch (existing databases, or after manual edits)."""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM estack_tokens")
+    cur.execute(
+        "INSERT OR IGNORE INTO estack_tokens (token, txn_rowid) "
+        + _token_select("t.name_of_transaction", "t.rowid").replace(
+            "FROM json_each", "FROM estack_transactions AS t, json_each", 1)
+    )
+    conn.commit()
+    count = cur.execute("SELECT COUNT(*) FROM estack_tokens").fetchone()[0]
+    logger.info("Rebuilt estack_tokens: %d tokens.", count)
+    return count
+
+
+def estack_tokens_missing(conn):
+    """True when the token table is empty but estack_transactions is not."""
+    cur = conn.cursor()
+    has_tokens = cur.execute("SELECT EXISTS (SELECT 1 FROM estack_tokens)").fetchone()[0]
+    has_rows = cur.execute("SELECT EXISTS (SELECT 1 FROM estack_transactions)").fetchone()[0]
+    return bool(has_rows and not has_tokens)
+
+
+
+# ============================================================
+# 🔹 FTS5 search mirror
+# ------------------------------------------------------------
+# estack_fts is an external-content FTS5 table over
+# name_of_transaction (no second copy of the text), used by
+# /api/estack/search for token and prefix lookups. "_" is a token
+# character so user_1 and user_12 stay distinct; "-" and ":" split,
+# so uuids are phrases of their groups and "Borrower:<phone>" yields
+# the phone as its own token.
+# ============================================================
+
+def fts5_available(conn):
+    """True if this SQLite build ships FTS5."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except Exception:
+        return False
+
+
+def ensure_estack_fts(conn):
+    """
+    Create estack_fts and its sync triggers. Returns False (and does
+    nothing) when FTS5 is unavailable. A freshly created index is
+    rebuilt from the existing rows.
+    """
+    if not fts5_available(conn):
+        logger.warning("SQLite FTS5 not available; /api/estack/search disabled.")
+        return False
+
+    cur = conn.cursor()
+    created = not cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'estack_fts'"
+    ).fetchone()
+
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS estack_fts USING fts5(
+            name_of_transaction,
+            content = 'estack_transactions',
+            tokenize = "unicode61 tokenchars '_'",
+            prefix = '2 4'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS estack_fts_ai AFTER INSERT ON estack_transactions
+        BEGIN
+            INSERT INTO estack_fts (rowid, name_of_transaction) VALUES (new.rowid, new.name_of_transaction);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS estack_fts_au AFTER UPDATE OF name_of_transaction ON estack_transactions
+        BEGIN
+            INSERT INTO estack_fts (estack_fts, rowid, name_of_transaction)
+            VALUES ('delete', old.rowid, old.name_of_transaction);
+            INSERT INTO estack_fts (rowid, name_of_transaction) VALUES (new.rowid, new.name_of_transaction);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS estack_fts_ad AFTER DELETE ON estack_transactions
+        BEGIN
+            INSERT INTO estack_fts (estack_fts, rowid, name_of_transaction)
+            VALUES ('delete', old.rowid, old.name_of_transaction);
+        END
+    """)
+    conn.commit()
+
+    if created:
+        rebuild_estack_fts(conn)
+    return True
+
+
+def rebuild_estack_fts(conn):
+    """Re-index estack_fts from estack_transactions."""
+    conn.execute("INSERT INTO estack_fts (estack_fts) VALUES ('rebuild')")
+    conn.commit()
+    logger.info("Rebuilt estack_fts search index.")
+
+
+def estack_fts_query(text, prefix=False):
+    """
+    Turn free text into a safe FTS5 MATCH expression. Every term is
+    quoted (so user input can't inject FTS syntax) and terms are ANDed.
+    A term ending in "*", or every term when prefix=True, is a prefix
+    query, e.g. "26097*" or "0f59ea4f-bc*".
+    """
+    terms = []
+    for raw in re.split(r"[\s|]+", text or ""):
+        is_prefix = prefix or raw.endswith("*")
+        term = raw.rstrip("*").strip()
+        if not term:
+            continue
+        quoted = '"' + term.replace('"', '""') + '"'
+        terms.append(quoted + "*" if is_prefix else quoted)
+    return " AND ".join(terms)
+
+if __name__ == "__main__":
+    import argparse
+    import sqlite3
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="eStack schema maintenance")
+    parser.add_argument("command", choices=["rebuild-tokens", "rebuild-fts"])
+    parser.add_argument("--db", default="estack.db", help="path to estack.db")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ensure_estack_schema(conn)
+    ensure_estack_tokens(conn)
+    if args.command == "rebuild-tokens":
+        rebuild_estack_tokens(conn)
+    elif args.command == "rebuild-fts" and ensure_estack_fts(conn):
+        rebuild_estack_fts(conn)
+    conn.close()
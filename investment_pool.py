@@ -0,0 +1,196 @@
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 Lendable investment pool
+# ------------------------------------------------------------
+# Process-local view of eStack investments that can back a loan
+# (status AVAILABLE or COMPLETED), indexed by deposit id and by
+# amount. Warmed from estack.db at startup and kept current by the
+# handlers that change an investment's status.
+#
+# The database stays the source of truth: a claim removes the entry
+# here under a lock (so two threads in this worker can't both get
+# it) and the caller then confirms it with a conditional UPDATE
+# (so two workers can't both get it either). A stale entry only
+# costs one failed UPDATE, after which it is dropped.
+# ============================================================
+
+LENDABLE_STATUSES = ("AVAILABLE", "COMPLETED")
+
+
+class PoolEntry:
+    __slots__ = ("deposit_id", "rowid", "amount", "status")
+
+    def __init__(self, deposit_id, rowid, amount, status):
+        self.deposit_id = deposit_id
+        self.rowid = rowid
+        self.amount = amount if amount is not None else 0.0
+        self.status = status
+
+    def __repr__(self):
+        return f"PoolEntry({self.deposit_id!r}, rowid={self.rowid}, amount={self.amount}, status={self.status!r})"
+
+
+class InvestmentPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_amount = []  # sorted (amount, deposit_id)
+        self.warmed = False
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, deposit_id):
+        return deposit_id in self._by_id
+
+    # ---- maintenance -------------------------------------------------
+
+    def warm(self, conn):
+        """Load every lendable investment from estack_transactions."""
+        marks = ", ".join("?" for _ in LENDABLE_STATUSES)
+        rows = conn.execute(
+            f"""
+            SELECT deposit_id, rowid, amount, status FROM estack_transactions
+            WHERE kind = 'INVESTMENT' AND deposit_id IS NOT NULL AND status IN ({marks})
+            """,
+            LENDABLE_STATUSES
+        ).fetchall()
+
+        with self._lock:
+            self._by_id = {}
+            self._by_amount = []
+            for deposit_id, rowid, amount, status in rows:
+                self._add_locked(PoolEntry(deposit_id, rowid, amount, status))
+            self.warmed = True
+        logger.info("Investment pool warmed with %d lendable investments.", len(rows))
+
+    def update(self, deposit_id, status, rowid=None, amount=None):
+        """Record a status change: lendable statuses (re)enter the pool, anything else leaves it."""
+        if not deposit_id:
+            return
+        with self._lock:
+            old = self._remove_locked(deposit_id)
+            if status in LENDABLE_STATUSES:
+                if rowid is None and old is not None:
+                    rowid = old.rowid
+                if amount is None and old is not None:
+                    amount = old.amount
+                if rowid is not None:
+                    self._add_locked(PoolEntry(deposit_id, rowid, amount, status))
+
+    def discard(self, deposit_id):
+        with self._lock:
+            self._remove_locked(deposit_id)
+
+    def release(self, entry):
+        """Put back an entry whose claim was not used (e.g. the request failed)."""
+        with self._lock:
+            if entry.deposit_id not in self._by_id:
+                self._add_locked(entry)
+
+    # ---- claims ------------------------------------------------------
+
+    def claim(self, deposit_id, status=None):
+        """Atomically take a specific investment (optionally only if it has `status`)."""
+        with self._lock:
+            entry = self._by_id.get(deposit_id)
+            if entry is None or (status is not None and entry.status != status):
+                return None
+            return self._remove_locked(deposit_id)
+
+    def claim_amount(self, min_amount, status=None):
+        """Atomically take the smallest investment worth at least min_amount."""
+        with self._lock:
+            i = bisect.bisect_left(self._by_amount, (float(min_amount), ""))
+            for amount, deposit_id in self._by_amount[i:]:
+                if status is None or self._by_id[deposit_id].status == status:
+                    return self._remove_locked(deposit_id)
+            return None
+
+    # ---- internals (caller holds the lock) ---------------------------
+
+    def _add_locked(self, entry):
+        self._by_id[entry.deposit_id] = entry
+        bisect.insort(self._by_amount, (entry.amount, entry.deposit_id))
+
+    def _remove_locked(self, deposit_id):
+        entry = self._by_id.pop(deposit_id, None)
+        if entry is not None:
+            i = bisect.bisect_left(self._by_amount, (entry.amount, deposit_id))
+            if i < len(self._by_amount) and self._by_amount[i] == (entry.amount, deposit_id):
+                del self._by_amount[i]
+        return entry
+
+
+def _db_entry(cur, deposit_id, statuses):
+    marks = ", ".join("?" for _ in statuses)
+    row = cur.execute(
+        f"""
+        SELECT rowid, amount, status FROM estack_transactions
+        WHERE deposit_id = ? AND kind = 'INVESTMENT' AND status IN ({marks})
+        """,
+        (deposit_id, *statuses)
+    ).fetchone()
+    return PoolEntry(deposit_id, row[0], row[1], row[2]) if row else None
+
+
+def _db_amount_entry(cur, min_amount, statuses):
+    marks = ", ".join("?" for _ in statuses)
+    row = cur.execute(
+        f"""
+        SELECT deposit_id, rowid, amount, status FROM estack_transactions
+        WHERE kind = 'INVESTMENT' AND deposit_id IS NOT NULL AND status IN ({marks}) AND amount >= ?
+        ORDER BY amount LIMIT 1
+        """,
+        (*statuses, float(min_amount))
+    ).fetchone()
+    return PoolEntry(row[0], row[1], row[2], row[3]) if row else None
+
+
+def claim_investment(cur, pool, new_status, deposit_id=None, min_amount=None, status=None):
+    """
+    Claim a lendable investment for a loan and move it to new_status.
+
+    Picks by deposit_id, or else the smallest investment >= min_amount.
+    Falls back to estack.db when this worker's pool has no (or a stale)
+    entry, since another worker may have changed it. The
+    claim is confirmed with UPDATE ... WHERE status = <expected>, so it
+    holds across processes. Must run inside the caller's transaction
+    (BEGIN IMMEDIATE). Returns the claimed PoolEntry or None.
+    """
+    statuses = (status,) if status else LENDABLE_STATUSES
+
+    while True:
+        from_db = False
+        if deposit_id is not None:
+            entry = pool.claim(deposit_id, status)
+            if entry is None:
+                entry, from_db = _db_entry(cur, deposit_id, statuses), True
+        else:
+            entry = pool.claim_amount(min_amount or 0, status)
+            if entry is None:
+                entry, from_db = _db_amount_entry(cur, min_amount or 0, statuses), True
+
+        if entry is None:
+            return None
+
+        cur.execute(
+            "UPDATE estack_transactions SET status = ? WHERE rowid = ? AND status = ?",
+            (new_status, entry.rowid, entry.status)
+        )
+        if cur.rowcount == 1:
+            if from_db:
+                pool.discard(entry.deposit_id)
+            return entry
+        if from_db:
+            return None
+        # Stale pool entry (another worker moved it on): it is already out
+        # of the pool, so just try again.
+
+
+investment_pool = InvestmentPool()
@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 Schema registry: versioned migrations + backfills
+# ------------------------------------------------------------
+# Every table, column and index the app uses is created by an
+# ordered, run-once migration when the worker boots, instead of by
+# CREATE TABLE IF NOT EXISTS inside request handlers or by re-running
+# every ALTER / backfill on every import.
+#
+#   schema.migration(pool, version, name, fn)   fn(conn), once per database
+#   schema.backfill(pool, name, fn, table)      fn(conn, after, limit), chunked
+#   schema.expect(pool, table, columns, indexes) checked once migrations ran
+#
+# Each database records what it has applied in schema_version. A
+# migration must be idempotent: if the process dies between the
+# migration and its schema_version row, it runs again.
+#
+# Backfills walk a table in rowid order, one chunk per transaction.
+# The chunk and its progress row (schema_backfills) commit together,
+# so an interrupted backfill resumes where it stopped, and several
+# workers running the same backfill just take turns at chunks.
+#
+#   SCHEMA_BACKFILL         background   boot: finish before ready
+#                                        background: thread after boot
+#                                        off: leave for a later boot
+#   SCHEMA_BACKFILL_CHUNK   5000         rows per chunk / transaction
+#
+# init(exclude=[pool]) leaves a database for a later init(): startup
+# migrates estack.db only once it has been restored from Dropbox.
+# is_ready(pool, ...) tells whether those databases have been through
+# init; `ready` is set once all of them have. Backfills never hold
+# either up unless SCHEMA_BACKFILL=boot.
+# ============================================================
+
+BACKFILL_MODE = os.getenv("SCHEMA_BACKFILL", "background").lower()
+BACKFILL_CHUNK = int(os.getenv("SCHEMA_BACKFILL_CHUNK", "5000"))
+PROGRESS_INTERVAL = 5.0  # seconds between backfill progress log lines
+
+
+def _ensure_bookkeeping(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_backfills (
+            name TEXT PRIMARY KEY,
+            last_rowid INTEGER NOT NULL DEFAULT 0,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        )
+    """)
+    conn.commit()
+
+
+class SchemaRegistry:
+    def __init__(self, backfill_mode=BACKFILL_MODE, chunk_size=BACKFILL_CHUNK):
+        self._migrations = {}  # database path -> (pool, {version: (name, fn)})
+        self._backfills = []   # (pool, name, fn, table)
+        self._expected = []
+        self._lock = threading.Lock()
+        self.backfill_mode = backfill_mode
+        self.chunk_size = chunk_size
+        self.ready = threading.Event()
+        self._ready_paths = set()
+        self.problems = []
+        self.backfill_progress = {}  # name -> {"rows_done", "last_rowid", "done"}
+
+    # ---- registration ------------------------------------------------
+
+    def migration(self, pool, version, name, fn=None):
+        """Register fn(conn) as migration `version` of pool's database (usable as a decorator)."""
+        if fn is None:
+            return lambda f: self.migration(pool, version, name, f)
+        _, versions = self._migrations.setdefault(pool.path, (pool, {}))
+        if version in versions:
+            raise ValueError(f"{pool.name}: migration {version} registered twice")
+        versions[version] = (name, fn)
+        return fn
+
+    def backfill(self, pool, name, fn=None, table=None):
+        """
+        Register a chunked backfill. fn(conn, after, limit) handles up to
+        `limit` rows with rowid > after and returns (last_rowid, rows), or
+        None once there is nothing left. `table` is only used to report
+        progress.
+        """
+        if fn is None:
+            return lambda f: self.backfill(pool, name, f, table)
+        self._backfills.append((pool, name, fn, table))
+        return fn
+
+    def expect(self, pool, table, columns=(), indexes=()):
+        """Declare a table (and columns / indexes on it) that must exist once init() has run."""
+        self._expected.append((pool, table, tuple(columns), tuple(indexes)))
+
+    # ---- boot --------------------------------------------------------
+
+    def init(self, exclude=()):
+        """
+        Apply pending migrations, verify, and run / schedule backfills for
+        every registered database not in `exclude` (pools) and not done
+        already. Returns True if those databases are ready.
+        """
+        with self._lock:
+            skip = {pool.path for pool in exclude} | self._ready_paths
+            paths = [path for path in self._migrations if path not in skip]
+            for path in paths:
+                self.migrate(*self._migrations[path])
+            self.problems = self.verify(paths)
+            if self.problems:
+                for problem in self.problems:
+                    logger.error("Schema check failed: %s", problem)
+                return False
+
+            backfills = [b for b in self._backfills if b[0].path in paths]
+            if self.backfill_mode == "boot":
+                self.run_backfills(backfills)
+            elif self.backfill_mode == "background" and backfills:
+                threading.Thread(target=self.run_backfills, args=(backfills,), name="schema-backfill",
+                                 daemon=True).start()
+            self._ready_paths.update(paths)
+            if self._ready_paths >= set(self._migrations):
+                self.ready.set()
+            return True
+
+    def is_ready(self, *pools):
+        return all(pool.path in self._ready_paths for pool in pools)
+
+    def migrate(self, pool, versions):
+        with pool.connection() as conn:
+            _ensure_bookkeeping(conn)
+            applied = {row[0] for row in conn.execute("SELECT version FROM schema_version").fetchall()}
+            pending = sorted(v for v in versions if v not in applied)
+            for version in pending:
+                name, fn = versions[version]
+                started = time.perf_counter()
+                fn(conn)
+                conn.execute(
+                    "INSERT OR IGNORE INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, time.time())
+                )
+                conn.commit()
+                logger.info("%s: applied migration %d (%s) in %.2fs",
+                            pool.name, version, name, time.perf_counter() - started)
+            if not pending:
+                logger.info("%s: schema at version %d, nothing to migrate", pool.name, max(applied, default=0))
+
+    def verify(self, paths=None):
+        """List what is missing (empty when every expectation holds) for `paths` (default: all)."""
+        problems = []
+        for pool, table, columns, indexes in self._expected:
+            if paths is not None and pool.path not in paths:
+                continue
+            with pool.connection() as conn:
+                have = {row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+                if not have:
+                    problems.append(f"{pool.name}: table {table} is missing")
+                    continue
+                problems.extend(f"{pool.name}: column {table}.{col} is missing" for col in columns if col not in have)
+                have_indexes = {row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table,)
+                ).fetchall()}
+                problems.extend(f"{pool.name}: index {name} is missing" for name in indexes if name not in have_indexes)
+        return problems
+
+    # ---- backfills ---------------------------------------------------
+
+    def run_backfills(self, backfills=None):
+        for pool, name, fn, table in self._backfills if backfills is None else backfills:
+            try:
+                self._run_backfill(pool, name, fn, table)
+            except Exception:
+                logger.exception("Backfill %s stopped; it resumes from its last chunk on the next boot", name)
+
+    def _run_backfill(self, pool, name, fn, table):
+        with pool.connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO schema_backfills (name) VALUES (?)", (name,))
+            conn.commit()
+            total = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] if table else None
+            started = last_report = time.perf_counter()
+
+            while True:
+                # Progress is read inside the write transaction: another worker may have moved it
+                conn.execute("BEGIN IMMEDIATE")
+                after, rows_done, done = conn.execute(
+                    "SELECT last_rowid, rows_done, done FROM schema_backfills WHERE name = ?", (name,)
+                ).fetchone()
+                if done:
+                    conn.rollback()
+                    break
+                chunk = fn(conn, after, self.chunk_size)
+                if chunk is None:
+                    conn.execute("UPDATE schema_backfills SET done = 1, updated_at = ? WHERE name = ?",
+                                 (time.time(), name))
+                    conn.commit()
+                    logger.info("Backfill %s complete: %d rows in %.1fs", name, rows_done,
+                                time.perf_counter() - started)
+                    done = 1
+                    break
+                after, rows = chunk
+                rows_done += rows
+                conn.execute(
+                    "UPDATE schema_backfills SET last_rowid = ?, rows_done = ?, updated_at = ? WHERE name = ?",
+                    (after, rows_done, time.time(), name)
+                )
+                conn.commit()
+                self.backfill_progress[name] = {"rows_done": rows_done, "last_rowid": after, "done": False}
+
+                if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.perf_counter()
+                    pct = f" ({100 * after / total:.0f}%)" if total else ""
+                    logger.info("Backfill %s: %d rows, up to rowid %d%s", name, rows_done, after, pct)
+
+            self.backfill_progress[name] = {"rows_done": rows_done, "last_rowid": after, "done": bool(done)}
+
+    def status(self):
+        return {"ready": self.ready.is_set(), "databases_ready": sorted(self._ready_paths),
+                "problems": list(self.problems),
+                "backfills": dict(self.backfill_progress)}
+
+
+schema = SchemaRegistry()
@@ -0,0 +1,103 @@
+import os
+import re
+from functools import lru_cache
+
+# ============================================================
+# 🔹 name_of_transaction parser
+# ------------------------------------------------------------
+# One place that knows the pipe-delimited eStack formats:
+#   "ZMW1000 | user_12 | <deposit_id> [| Borrower:<phone>]"
+#   "INVESTMENT | K1000 | user_12 | <deposit_id> [| Borrower:<phone>]"   (legacy)
+#   "LOAN | ZMW500 | <phone> | <investment_id> | <loan_id>"
+# parse_transaction() is memoised on the raw string, so repeated
+# rows (retried callbacks, big user histories) are parsed once.
+# ============================================================
+
+PARSER_CACHE_SIZE = int(os.getenv("ESTACK_PARSER_CACHE_SIZE", "8192"))
+
+_AMOUNT_RE = re.compile(r"^([A-Za-z]*)\s*(-?[\d,]+(?:\.\d+)?)$")
+_BORROWER_PREFIX = "borrower:"
+
+
+class EstackRecord:
+    """Parsed eStack transaction. Instances are shared by the cache: treat as read-only."""
+
+    __slots__ = ("kind", "amount", "currency", "user", "deposit_id", "loan_id", "borrower")
+
+    def __init__(self, kind="UNKNOWN", amount=None, currency=None, user=None,
+                 deposit_id=None, loan_id=None, borrower=None):
+        self.kind = kind
+        self.amount = amount
+        self.currency = currency
+        self.user = user
+        self.deposit_id = deposit_id
+        self.loan_id = loan_id
+        self.borrower = borrower
+
+    def as_columns(self):
+        """Values for the structured estack_transactions columns, in ESTACK_COLUMNS order."""
+        return {
+            "kind": self.kind,
+            "amount": self.amount,
+            "currency": self.currency,
+            "user_id": self.user,
+            "deposit_id": self.deposit_id,
+            "loan_id": self.loan_id,
+            "borrower_phone": self.borrower,
+        }
+
+    def __repr__(self):
+        return (f"EstackRecord(kind={self.kind!r}, amount={self.amount!r}, user={self.user!r}, "
+                f"deposit_id={self.deposit_id!r}, loan_id={self.loan_id!r}, borrower={self.borrower!r})")
+
+
+def _amount(text):
+    match = _AMOUNT_RE.match(text)
+    if not match:
+        return None, None
+    try:
+        return float(match.group(2).replace(",", "")), match.group(1) or None
+    except ValueError:
+        return None, match.group(1) or None
+
+
+def _borrower(extras):
+    borrower = None
+    for extra in extras:
+        if extra[:9].lower() == _BORROWER_PREFIX:
+            borrower = extra[9:].strip() or None
+    return borrower
+
+
+def parse_name(name_of_transaction):
+    """Parse one name_of_transaction string (uncached; use parse_transaction in handlers)."""
+    parts = [p.strip() for p in (name_of_transaction or "").split("|")]
+    head = parts[0].upper()
+
+    if head == "LOAN" and len(parts) >= 5:
+        amount, currency = _amount(parts[1])
+        return EstackRecord("LOAN", amount, currency, None,
+                            parts[3] or None, parts[4] or None, parts[2] or None)
+    if head == "INVESTMENT" and len(parts) >= 4:
+        amount, currency = _amount(parts[1])
+        return EstackRecord("INVESTMENT", amount, currency, parts[2] or None,
+                            parts[3] or None, None, _borrower(parts[4:]))
+    if len(parts) >= 3:
+        amount, currency = _amount(parts[0])
+        return EstackRecord("INVESTMENT", amount, currency, parts[1] or None,
+                            parts[2] or None, None, _borrower(parts[3:]))
+    return EstackRecord()
+
+
+parse_transaction = lru_cache(maxsize=PARSER_CACHE_SIZE)(parse_name)
+parse_transaction.__doc__ = "Memoised parse_name (bounded LRU keyed on the raw string)."
+
+
+def format_investment(currency, amount, user_id, deposit_id):
+    """name_of_transaction for a deposit / investment row."""
+    return f"{currency}{amount} | {user_id} | {deposit_id}"
+
+
+def format_loan(amount, phone, investment_id, loan_id, currency="ZMW"):
+    """name_of_transaction for a LOAN row."""
+    return f"LOAN | {currency}{amount} | {phone} | {investment_id} | {loan_id}"
@@ -0,0 +1,92 @@
+import sqlite3
+
+from estack_schema import ESTACK_COLUMNS, estack_fields
+
+# ============================================================
+# 🔹 Single-statement upserts
+# ------------------------------------------------------------
+# INSERT ... ON CONFLICT DO UPDATE against the real unique keys:
+#   transactions.depositId                 (deposits and payouts)
+#   estack_transactions.deposit_id         (partial unique index on
+#                                           kind = 'INVESTMENT')
+# One statement and one index probe per write, instead of a
+# SELECT followed by an UPDATE or INSERT. Unlike INSERT OR REPLACE,
+# a conflicting row is updated in place, so columns the new write
+# doesn't mention keep their values.
+# ============================================================
+
+# RETURNING arrived in SQLite 3.35; older builds re-read the row instead.
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+TRANSACTION_COLUMNS = (
+    "depositId", "status", "amount", "currency", "phoneNumber", "provider", "providerTransactionId",
+    "failureCode", "failureMessage", "metadata", "received_at", "updated_at", "type", "user_id",
+)
+
+# Set once on insert, never overwritten by a later callback.
+_INSERT_ONLY = ("depositId", "received_at", "type")
+
+
+def _transaction_upsert_sql(keep_existing):
+    if keep_existing:
+        merge = "COALESCE({col}, excluded.{col})"
+    else:
+        merge = "COALESCE(excluded.{col}, {col})"
+    assignments = ", ".join(
+        f"{col} = " + (merge.format(col=col) if col != "updated_at" else "COALESCE(excluded.updated_at, updated_at)")
+        for col in TRANSACTION_COLUMNS if col not in _INSERT_ONLY
+    )
+    return (
+        f"INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)}) "
+        f"ON CONFLICT(depositId) DO UPDATE SET {assignments}"
+    )
+
+
+def _estack_upsert_sql(keep_existing):
+    new_status = "estack_transactions.status" if keep_existing else "excluded.status"
+    return (
+        f"INSERT INTO estack_transactions (name_of_transaction, status, {', '.join(ESTACK_COLUMNS)}) "
+        f"VALUES (?, ?, {', '.join('?' for _ in ESTACK_COLUMNS)}) "
+        f"ON CONFLICT(deposit_id) WHERE kind = 'INVESTMENT' DO UPDATE SET status = {new_status}"
+        + (" RETURNING rowid, amount, status" if HAS_RETURNING else "")
+    )
+
+
+# Built once: the statements are fixed, only the parameters change per call.
+_TRANSACTION_UPSERT = {keep: _transaction_upsert_sql(keep) for keep in (False, True)}
+_ESTACK_UPSERT = {keep: _estack_upsert_sql(keep) for keep in (False, True)}
+
+
+def upsert_transaction(conn, row, keep_existing=False):
+    """
+    Insert or update one transactions row keyed on depositId.
+    row: {column: value} using TRANSACTION_COLUMNS; missing keys are NULL.
+    On conflict a non-NULL incoming value replaces the stored one
+    (keep_existing=False, callbacks) or only fills a stored NULL
+    (keep_existing=True, e.g. initiate_payment racing its own callback).
+    updated_at always takes the incoming value when one is given.
+    """
+    conn.execute(_TRANSACTION_UPSERT[keep_existing], [row.get(col) for col in TRANSACTION_COLUMNS])
+
+
+def upsert_estack_investment(conn, name_of_transaction, status, keep_existing=False):
+    """
+    Insert an eStack investment, or update the one already recorded for
+    its deposit_id: its status is set to `status`, or left alone with
+    keep_existing=True (initiate_investment racing its own callback).
+    Returns (rowid, amount, status) of the stored row.
+    """
+    fields = estack_fields(name_of_transaction)
+    params = (name_of_transaction, status, *fields.values())
+
+    if HAS_RETURNING:
+        row = conn.execute(_ESTACK_UPSERT[keep_existing], params).fetchall()[0]
+        return row[0], row[1], row[2]
+
+    conn.execute(_ESTACK_UPSERT[keep_existing], params)
+    row = conn.execute(
+        "SELECT rowid, amount, status FROM estack_transactions WHERE deposit_id = ? AND kind = 'INVESTMENT'",
+        (fields["deposit_id"],)
+    ).fetchone()
+    return row[0], row[1], row[2]
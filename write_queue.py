@@ -0,0 +1,203 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from db_pool import estack_db, transactions_db
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# 🔹 Single-writer queue with group commit
+# ------------------------------------------------------------
+# One thread per database owns the write connection. Handlers
+# submit a unit of work (a function taking that connection) and
+# wait on a future; the writer runs whatever has queued up in one
+# BEGIN IMMEDIATE ... COMMIT, so N concurrent callbacks cost one
+# lock acquisition and one fsync instead of N.
+#
+# Each unit runs inside its own SAVEPOINT: a unit that raises is
+# rolled back on its own and its future gets the exception, the
+# rest of the batch still commits. Futures resolve only after the
+# COMMIT, so a handler that got its result can rely on the write
+# being durable. Units must not commit, must not touch Flask's g,
+# and must not wait on the same queue (the writer would deadlock).
+#
+#   WRITE_QUEUE_MAX_BATCH      64   units per transaction
+#   WRITE_QUEUE_MAX_DELAY_MS   0    extra wait for a batch to fill up; 0 takes
+#                                   whatever queued while the last commit ran
+#   WRITE_QUEUE_TIMEOUT        30   seconds run() waits for its result
+#
+# When run() times out it cancels the unit. If the unit had not
+# started, nothing was written and the timeout is raised; if it was
+# already running, it may still commit, so run() raises
+# StillProcessing instead and the caller must not report a failure
+# (a client retrying a disbursement would be paid twice).
+# ============================================================
+
+MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "64"))
+MAX_DELAY_MS = float(os.getenv("WRITE_QUEUE_MAX_DELAY_MS", "0"))
+RUN_TIMEOUT = float(os.getenv("WRITE_QUEUE_TIMEOUT", "30"))
+
+
+class StillProcessing(Exception):
+    """run() stopped waiting for a unit that had already started: it may still commit."""
+
+    def __init__(self, future):
+        super().__init__("the write is still processing and may still be applied")
+        self.future = future
+
+
+class WriteQueue:
+    def __init__(self, pool, max_batch=MAX_BATCH, max_delay_ms=MAX_DELAY_MS, name=None):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay_ms) / 1000
+        self.name = name or pool.name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # counters, read by benchmarks / debugging
+        self.units = 0
+        self.batches = 0
+
+    # ---- public API --------------------------------------------------
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(conn, *args, **kwargs); returns a Future with its result."""
+        self._ensure_writer()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """
+        submit() and wait for the committed result (re-raises the unit's
+        exception). After RUN_TIMEOUT the unit is cancelled and the timeout
+        raised; a unit already running raises StillProcessing instead.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=RUN_TIMEOUT)
+        except FutureTimeout:
+            if future.cancel():
+                raise FutureTimeout(f"{self.name} write timed out before it started; nothing was written") from None
+            if future.done():
+                return future.result()  # finished while we were giving up
+            raise StillProcessing(future) from None
+
+    def stop(self, timeout=5):
+        """Finish what is queued, then stop the writer thread."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+        self._thread = None
+
+    # ---- writer thread -----------------------------------------------
+
+    def _ensure_writer(self):
+        # Started lazily so a gunicorn worker gets its own writer after fork.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=f"writer-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                self._queue.put(None)  # seen again by _run after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = self.pool.acquire()
+        conn.isolation_level = None  # transactions are managed explicitly below
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    return
+                batch = self._collect(first)
+                try:
+                    self._commit_batch(conn, batch)
+                except Exception as e:
+                    # Never let the writer die: fail the batch and carry on
+                    logger.exception("Writer %s failed a batch", self.name)
+                    if conn.in_transaction:
+                        try:
+                            conn.execute("ROLLBACK")
+                        except sqlite3.Error:
+                            pass
+                    for future, *_ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            conn.isolation_level = ""
+            self.pool.release(conn)
+
+    def _commit_batch(self, conn, batch):
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for future, *_ in batch:
+                if not future.done():  # a cancelled unit is done already
+                    future.set_exception(e)
+            return
+
+        try:
+            for future, fn, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT unit")
+                try:
+                    result = fn(conn, *args, **kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO unit")
+                    conn.execute("RELEASE unit")
+                    future.set_exception(e)
+                    continue
+                conn.execute("RELEASE unit")
+                done.append((future, result))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # The transaction itself is gone (failed savepoint rollback or
+            # COMMIT): nothing in this batch was written.
+            logger.exception("Group commit on %s failed", self.name)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.units += len(batch)
+        self.batches += 1
+        for future, result in done:
+            future.set_result(result)
+
+
+estack_writer = WriteQueue(estack_db)
+transactions_writer = WriteQueue(transactions_db)